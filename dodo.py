@@ -1,14 +1,27 @@
 import json
 from warnings import catch_warnings, simplefilter
 
-from doit.tools import config_changed
+from doit.tools import config_changed, create_folder
 from mne_bids import make_dataset_description
 
 from metacog import bp
 from metacog.config_parser import cfg
 from metacog.paths import dirs
 from metacog.dataset_specific_utils import iter_files
-from metacog.utils import disable
+from metacog.epoch_store import build_epoch_store, store_files
+from metacog.executor import script_action
+from metacog.fingerprint import FingerprintChecker
+from metacog.manifest import update_manifest
+from metacog.source_store import source_trials_files, source_trials_prefix
+from metacog.utils import disable, disable_if
+
+FUSED = cfg.fused_config["enabled"]
+BAND_POWER = cfg.band_power_config["enabled"]
+
+DOIT_CONFIG = {
+    # cached size/mtime/inode + fast hash instead of md5 of multi-GB FIFs
+    "check_file_uptodate": FingerprintChecker,
+}
 
 # DOIT_CONFIG = {
 #     "default_tasks": [
@@ -64,7 +77,7 @@ def task_compute_head_position():
         yield dict(
             name=raw.name,
             file_dep=[raw],
-            actions=[f"python {script} {subj} {task} -r {run}"],
+            actions=[script_action(script, "write_head_position", raw, hp)],
             targets=[hp],
         )
 
@@ -85,6 +98,7 @@ def task_mark_bads_maxfilter():
         )
 
 
+@disable_if(FUSED)
 def task_apply_maxfilter():
     """Apply maxfilter to raw data; interpolate bad channels in process"""
     script = "preproc/03-apply_maxfilter.py"
@@ -101,11 +115,22 @@ def task_apply_maxfilter():
             uptodate=[config_changed(cfg.maxfilt_config)],
             clean=True,
             file_dep=[raw, bads, annot],
-            actions=[f"python {script} {subj} {task} -r {run} -s {ses}"],
+            actions=[
+                script_action(
+                    script,
+                    "apply_maxfilter",
+                    raw,
+                    bads,
+                    annot,
+                    maxfilt,
+                    subj == "emptyroom",
+                )
+            ],
             targets=[maxfilt],
         )
 
 
+@disable_if(FUSED)
 def task_concat_filter_resample():
     """Concatenate runs, bandpass-filter and downsample data"""
     script = "preproc/04-concat_filter_resample.py"
@@ -116,7 +141,8 @@ def task_concat_filter_resample():
         bp.maxf_subj = bp.maxfilt.update(subject=subj, task=task, session=ses)
         filt = bp.filt.fpath(subject=subj, task=task, session=ses)
 
-        if task == cfg.subj_tasks[subj][0]:
+        is_mult_runs = task == cfg.subj_tasks[subj][0]
+        if is_mult_runs:
             maxfilt = [bp.maxf_subj.fpath(run=r) for r in runs]
         else:
             maxfilt = [bp.maxf_subj.fpath(run=None)]
@@ -126,12 +152,21 @@ def task_concat_filter_resample():
             name=name,
             uptodate=[config_changed(cfg.concat_config)],
             file_dep=maxfilt,
-            actions=[f"python {script} {subj} {task} -s {ses}"],
+            actions=[
+                script_action(
+                    script,
+                    "process_fif",
+                    maxfilt if is_mult_runs else maxfilt[0],
+                    filt,
+                    is_mult_runs,
+                )
+            ],
             targets=[filt],
             clean=True,
         )
 
 
+@disable_if(FUSED)
 def task_compute_ica():
     """Compute ICA solution for filtered and resampled data. Skip emptyroom."""
     script = "preproc/05-compute_ica.py"
@@ -143,11 +178,65 @@ def task_compute_ica():
             name=filt.name,
             uptodate=[config_changed(cfg.ica_config)],
             file_dep=[filt],
-            actions=[f"python {script} {subj} {task}"],
+            actions=[
+                script_action(script, "compute_ica", filt, ica_sol, task)
+            ],
             targets=[ica_sol],
         )
 
 
+@disable_if(not FUSED)
+def task_maxfilter_filter_ica():
+    """Maxfilter, filter and resample data and compute ICA in memory"""
+    script = "preproc/03-05-maxfilter_filter_ica.py"
+    for subj, task, runs, ses in iter_files(
+        ["emptyroom"] + cfg.subjects, "joint"
+    ):
+        is_er = subj == "emptyroom"
+        if is_er or task != cfg.subj_tasks[subj][0]:
+            runs = [None]
+        bids = [
+            dict(subject=subj, task=task, run=r, session=ses) for r in runs
+        ]
+
+        raw = [bp.root.fpath(**b) for b in bids]
+        bads = [bp.bads.fpath(**b) for b in bids]
+        annot = [bp.annot.fpath(**b) for b in bids]
+        filt = bp.filt.fpath(subject=subj, task=task, session=ses)
+        ica_sol = None if is_er else bp.ica_sol.fpath(subject=subj, task=task)
+        maxfilt = None
+        if cfg.fused_config["save_maxfilt"]:
+            maxfilt = [bp.maxfilt.fpath(**b) for b in bids]
+
+        configs = dict(
+            maxfilt=cfg.maxfilt_config,
+            concat=cfg.concat_config,
+            ica=cfg.ica_config,
+            fused=cfg.fused_config,
+        )
+        yield dict(
+            name=filt.name,
+            uptodate=[config_changed(configs)],
+            file_dep=raw + bads + annot,
+            actions=[
+                script_action(
+                    script,
+                    "maxfilter_filter_ica",
+                    raw,
+                    bads,
+                    annot,
+                    filt,
+                    ica_sol,
+                    task,
+                    maxfilt,
+                    is_er,
+                )
+            ],
+            targets=[filt] + ([ica_sol] if ica_sol else []) + (maxfilt or []),
+            clean=True,
+        )
+
+
 # @disable
 def task_inspect_ica():
     """Remove artifacts with precomputed ICA solution."""
@@ -180,7 +269,11 @@ def task_apply_ica():
         yield dict(
             name=filt.name,
             file_dep=[filt, ica_sol, ica_bads],
-            actions=[f"python {script} {subj} {task}"],
+            actions=[
+                script_action(
+                    script, "clean_fif", filt, ica_sol, ica_bads, cleaned_fif
+                )
+            ],
             targets=[cleaned_fif],
             clean=True,
         )
@@ -214,12 +307,35 @@ def task_make_epochs():
             name=cleaned_fif.name,
             uptodate=[config_changed(cfg.epochs_config)],
             file_dep=[cleaned_fif, annot, beh],
-            actions=[f"python {script} {subj}"],
+            actions=[
+                script_action(
+                    script, "make_epochs", cleaned_fif, annot, beh, epochs
+                )
+            ],
             targets=[epochs],
             clean=True,
         )
 
 
+def task_build_epoch_store():
+    """Write epochs of all subjects to the memory-mapped group store"""
+    epochs_paths = {s: bp.epochs.fpath(subject=s) for s in cfg.subjects}
+    store_cfg = cfg.epoch_store_config
+    return dict(
+        uptodate=[config_changed(store_cfg)],
+        file_dep=list(epochs_paths.values()),
+        actions=[
+            (
+                build_epoch_store,
+                [epochs_paths, dirs.group_epochs],
+                dict(store_cfg, n_jobs=cfg.loader_config["n_jobs"]),
+            )
+        ],
+        targets=store_files(dirs.group_epochs, store_cfg["ch_types"]),
+        clean=True,
+    )
+
+
 @disable
 def task_freesurfer():
     for subj in cfg.subjects:
@@ -228,6 +344,7 @@ def task_freesurfer():
             name=f"sub-{subj}",
             file_dep=[bp.anat],
             actions=[
+                (create_folder, [dirs.fsf_subjects]),
                 f"recon-all -i {anat} -s sub-{subj} -all -sd"
                 f" {dirs.fsf_subjects} -parallel -openmp {cfg.fsf_config['openmp']}"
             ],
@@ -339,12 +456,15 @@ def task_compute_sources():
         yield dict(
             name=subj_bids,
             file_dep=[fwd_path, inv_path, epochs_path],
-            targets=[dirs.sources / subj_bids],
+            targets=source_trials_files(
+                source_trials_prefix(dirs.sources / subj_bids, subj)
+            ),
             actions=[f"python {script} {subj}"],
             clean=True,
         )
 
 
+@disable_if(BAND_POWER)
 def task_compute_tfr_epochs():
     """Compute time-frequency for epochs"""
     script = "preproc/15-compute_tfr_epochs.py"
@@ -355,34 +475,94 @@ def task_compute_tfr_epochs():
 
         yield dict(
             name=subj_bids,
-            uptodate=[config_changed(cfg.tfr_config)],
+            uptodate=[
+                config_changed(cfg.tfr_config),
+                config_changed(cfg.tfr_store_config),
+            ],
             file_dep=[epochs_path],
             targets=[tfr_path],
-            actions=[f"python {script} {subj}"],
+            actions=[
+                script_action(
+                    script, "compute_tfr_epochs", epochs_path, tfr_path
+                )
+            ],
             clean=True,
         )
 
 
+@disable_if(BAND_POWER)
 def task_average_tfr():
     """Compute inverse solution"""
     script = "preproc/16-average_tfr.py"
     for subj in cfg.subjects:
         subj_bids = f"sub-{subj}"
         tfr_path = bp.tfr.fpath(subject=subj)
-        av_tfr_paths = [
-            bp.tfr_av.fpath(subject=subj, acquisition=b)
+        av_tfr_paths = {
+            b: bp.tfr_av.fpath(subject=subj, acquisition=b)
             for b in cfg.target_bands
-        ]
+        }
 
         yield dict(
             name=subj_bids,
+            uptodate=[
+                config_changed(cfg.target_bands),
+                config_changed(cfg.tfr_store_config),
+            ],
             file_dep=[tfr_path],
-            targets=av_tfr_paths,
-            actions=[f"python {script} {subj}"],
+            targets=list(av_tfr_paths.values()),
+            actions=[
+                script_action(script, "average_tfr", tfr_path, av_tfr_paths)
+            ],
             clean=True,
         )
 
 
+@disable_if(not BAND_POWER)
+def task_compute_band_power():
+    """Compute single-trial power in target bands without full TFR"""
+    script = "preproc/15-16-compute_band_power.py"
+    for subj in cfg.subjects:
+        subj_bids = f"sub-{subj}"
+        epochs_path = bp.epochs.fpath(subject=subj)
+        tfr_av_paths = {
+            b: bp.tfr_av.fpath(subject=subj, acquisition=b)
+            for b in cfg.target_bands
+        }
+
+        configs = dict(
+            tfr=cfg.tfr_config,
+            bands=cfg.target_bands,
+            store=cfg.tfr_store_config,
+            band_power=cfg.band_power_config,
+        )
+        yield dict(
+            name=subj_bids,
+            uptodate=[config_changed(configs)],
+            file_dep=[epochs_path],
+            targets=list(tfr_av_paths.values()),
+            actions=[
+                script_action(
+                    script, "compute_band_power", epochs_path, tfr_av_paths
+                )
+            ],
+            clean=True,
+        )
+
+
+def task_update_manifest():
+    """Index files produced by the pipeline in the dataset manifest"""
+    # standalone: run_script adds targets of the other tasks as they are
+    # written, so this only picks up files made outside doit and needs no
+    # task_dep (`doit update_manifest` must not run the pipeline). Never up
+    # to date: each run stats every file but rehashes only new or changed
+    # ones
+    return dict(
+        actions=[(update_manifest,)],
+        uptodate=[False],
+        verbosity=2,
+    )
+
+
 # def task_compute_sources():
 #     for subj_path in sorted(dirs.fsf_subjects.glob("sub-*")):
 #         subj_id = subj_path.name
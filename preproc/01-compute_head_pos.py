@@ -28,6 +28,11 @@ def compute_head_position(src: Path) -> np.ndarray:
     return compute_head_pos(raw.info, chpi_locs)
 
 
+def write_head_position(src: Path, dest: Path) -> None:
+    logger.info(f"Processing {src.name} --> {dest}")
+    write_head_pos(dest, compute_head_position(src))
+
+
 if __name__ == "__main__":
     args = parse_args(description=__doc__, args=sys.argv[1:], emptyroom=False)
     subj, task, run = args.subject, args.task, args.run
@@ -37,8 +42,5 @@ if __name__ == "__main__":
     # output
     headpos = bp.headpos.fpath(subject=subj, task=task, run=run)
 
-    headpos.parent.mkdir(exist_ok=True)
-    logger.info(f"Processing {raw.name} --> {headpos}")
-
-    head_pos = compute_head_position(raw)
-    write_head_pos(headpos, head_pos)
+    headpos.parent.mkdir(exist_ok=True, parents=True)
+    write_head_position(raw, headpos)
@@ -63,6 +63,6 @@ if __name__ == "__main__":
     bads = bp.bads.fpath(subject=subj, task=task, run=run, session=ses)
     annot = bp.annot.fpath(subject=subj, task=task, run=run, session=ses)
 
-    bads.parent.mkdir(exist_ok=True)
+    bads.parent.mkdir(exist_ok=True, parents=True)
 
     annotate_fif(raw, bads, annot, subj == "emptyroom")
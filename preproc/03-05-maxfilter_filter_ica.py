@@ -0,0 +1,105 @@
+"""
+Maxfilter, concatenate, filter, resample and compute ICA in one go
+
+Fused version of 03-apply_maxfilter.py, 04-concat_filter_resample.py and
+05-compute_ica.py: data is passed between the steps in memory instead of
+being written to disk and read back after each step. Filtered data is always
+saved since later steps use it; maxfiltered data only if requested.
+
+Note
+----
+Data is kept in double precision between the steps while the files written
+by the separate scripts are single precision, so the results can differ
+from the non-fused ones by float32 rounding.
+
+"""
+import sys
+from pathlib import Path
+
+from metacog import bp
+from metacog.config_parser import cfg
+from metacog.executor import load_script
+from metacog.utils import setup_logging
+from metacog.dataset_specific_utils import parse_args
+
+logger = setup_logging(__file__)
+
+here = Path(__file__).resolve().parent
+maxfilter_script = load_script(here / "03-apply_maxfilter.py")
+concat_script = load_script(here / "04-concat_filter_resample.py")
+ica_script = load_script(here / "05-compute_ica.py")
+
+
+def maxfilter_filter_ica(
+    raw_paths,
+    bads_paths,
+    annot_paths,
+    filt_path,
+    ica_sol_path=None,
+    task=None,
+    maxfilt_paths=None,
+    is_er=False,
+):
+    """
+    Run maxfilter, concat/filter/resample and ICA on runs of one recording
+
+    Parameters
+    ----------
+    raw_paths, bads_paths, annot_paths : list of Path
+        raw data, bad channels and annotations for each run
+    filt_path : Path
+        where to save filtered and resampled data
+    ica_sol_path : Path | None
+        where to save ICA solution; None to skip ICA (emptyroom)
+    task : str | None
+        task name; used for ICA decimation
+    maxfilt_paths : list of Path | None
+        where to save maxfiltered runs; None to keep them in memory only
+    is_er : bool
+        whether the data is emptyroom recording
+
+    """
+    raws = []
+    for i, paths in enumerate(zip(raw_paths, bads_paths, annot_paths)):
+        raw_sss = maxfilter_script.maxfilter_raw(*paths, is_er)
+        if maxfilt_paths is not None:
+            raw_sss.save(maxfilt_paths[i], overwrite=True)
+        raws.append(raw_sss)
+
+    raw = concat_script.concat_raws_common(raws)
+    concat_script.filter_resample(raw)
+    del raws, raw_sss
+    raw.save(filt_path, overwrite=True)
+
+    if ica_sol_path is not None:
+        ica = ica_script.fit_ica(raw, task)
+        ica_script.save_ica(raw, ica, ica_sol_path)
+
+
+if __name__ == "__main__":
+    args = parse_args(__doc__, args=sys.argv[1:], emptyroom=True)
+    subj, task, ses = args.subject, args.task, args.session
+    is_er = subj == "emptyroom"
+    if is_er or task != cfg.subj_tasks[subj][0]:
+        runs = [None]
+    else:
+        runs = [int(r) for r in cfg.subj_runs[subj]]
+    bids = [dict(subject=subj, task=task, run=r, session=ses) for r in runs]
+
+    # input
+    raw = [bp.root.fpath(**b) for b in bids]
+    bads = [bp.bads.fpath(**b) for b in bids]
+    annot = [bp.annot.fpath(**b) for b in bids]
+    # output
+    filt = bp.filt.fpath(subject=subj, task=task, session=ses)
+    ica_sol = None if is_er else bp.ica_sol.fpath(subject=subj, task=task)
+    maxfilt = None
+    if cfg.fused_config["save_maxfilt"]:
+        maxfilt = [bp.maxfilt.fpath(**b) for b in bids]
+        maxfilt[0].parent.mkdir(exist_ok=True, parents=True)
+
+    filt.parent.mkdir(exist_ok=True, parents=True)
+    if ica_sol is not None:
+        ica_sol.parent.mkdir(exist_ok=True, parents=True)
+
+    maxfilter_filter_ica(raw, bads, annot, filt, ica_sol, task, maxfilt, is_er)
@@ -6,9 +6,13 @@ Note
 requires mne >= 0.20 for filtering line noise with filter_chpi
 for emptyroom data
 
+Long recordings can be processed in chunks with bounded memory; see
+maxfilt_stream_config in metacog/config.py
+
 """
 import sys
 
+import numpy as np
 from mne.io import read_raw_fif
 from mne.chpi import filter_chpi
 from mne import read_annotations
@@ -17,45 +21,96 @@ from mne.channels import fix_mag_coil_types
 
 from metacog import bp
 from metacog.config_parser import cfg
-from metacog.paths import crosstalk_file, cal_file
+from metacog.paths import crosstalk, calibration
+from metacog.streaming import process_raw_in_chunks
 from metacog.utils import setup_logging
 from metacog.dataset_specific_utils import parse_args
 
 logger = setup_logging(__file__)
 
+T_STEP = 0.01  # step of filter_chpi sliding window, s (its default)
 
-def prepare_raw(raw_path, bads_path, annot_path, is_er):
-    """Load raw, filter chpi and line noise, set bads and annotations"""
-    raw = read_raw_fif(raw_path, preload=True)
-    filter_chpi(
-        raw, allow_line_only=is_er, t_window=cfg.maxfilt_config["t_window"]
-    )
-    fix_mag_coil_types(raw.info)
 
+def read_bads(bads_path):
     with open(bads_path, "r") as f:
         bads = f.readline().split("\t")
-        if bads == [""]:
-            bads = []
-        raw.info["bads"] = bads
+    return [] if bads == [""] else bads
 
-    raw.set_annotations(read_annotations(annot_path))
 
+def clean_raw(raw, bads, is_er):
+    """Filter chpi and line noise, fix coil types and set bads in place"""
+    filter_chpi(
+        raw,
+        allow_line_only=is_er,
+        t_window=cfg.maxfilt_config["t_window"],
+        t_step=T_STEP,
+    )
+    fix_mag_coil_types(raw.info)
+    raw.info["bads"] = bads
     return raw
 
 
-def apply_maxfilter(raw_path, bads_path, annot_path, maxfilt_path, is_er):
-    raw = prepare_raw(raw_path, bads_path, annot_path, is_er)
+def prepare_raw(raw_path, bads_path, annot_path, is_er):
+    """Load raw, filter chpi and line noise, set bads and annotations"""
+    raw = read_raw_fif(raw_path, preload=True)
+    clean_raw(raw, read_bads(bads_path), is_er)
+    raw.set_annotations(read_annotations(annot_path))
+    return raw
 
+
+def sss(raw, is_er):
     coord_frame = "head" if is_er else "meg"
 
-    raw_sss = maxwell_filter(
+    return maxwell_filter(
         raw,
-        cross_talk=crosstalk_file,
-        calibration=cal_file,
+        cross_talk=crosstalk,
+        calibration=calibration,
         skip_by_annotation=[],
         coord_frame=coord_frame,
     )
 
+
+def maxfilter_raw(raw_path, bads_path, annot_path, is_er):
+    """Load and prepare raw and apply maxfilter; returns maxfiltered raw"""
+    return sss(prepare_raw(raw_path, bads_path, annot_path, is_er), is_er)
+
+
+def maxfilter_in_chunks(raw_path, bads_path, annot_path, maxfilt_path, is_er):
+    """
+    Maxfilter raw in overlapping chunks with bounded memory
+
+    Both cHPI filtering and SSS without tSSS and movement compensation only
+    depend on the data within t_window around each sample, so with chunk
+    boundaries on filter_chpi's t_step grid the result equals the one of
+    `maxfilter_raw` up to float rounding.
+
+    """
+    chunk_duration = cfg.maxfilt_stream_config["chunk_duration"]
+    overlap = cfg.maxfilt_stream_config["overlap"]
+    t_window = cfg.maxfilt_config["t_window"]
+    if not isinstance(t_window, str) and overlap < t_window:
+        raise ValueError(f"Overlap must exceed t_window ({t_window} s)")
+
+    raw = read_raw_fif(raw_path, preload=False)
+    raw.set_annotations(read_annotations(annot_path))
+    bads = read_bads(bads_path)
+    step = int(np.ceil(T_STEP * raw.info["sfreq"]))
+
+    def process(chunk):
+        return sss(clean_raw(chunk, bads, is_er), is_er)
+
+    process_raw_in_chunks(
+        raw, process, maxfilt_path, chunk_duration, overlap, step
+    )
+
+
+def apply_maxfilter(raw_path, bads_path, annot_path, maxfilt_path, is_er):
+    if cfg.maxfilt_stream_config["chunk_duration"] is not None:
+        maxfilter_in_chunks(
+            raw_path, bads_path, annot_path, maxfilt_path, is_er
+        )
+        return
+    raw_sss = maxfilter_raw(raw_path, bads_path, annot_path, is_er)
     raw_sss.save(maxfilt_path, overwrite=True)
 
 
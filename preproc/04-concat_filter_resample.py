@@ -19,16 +19,21 @@ logger = setup_logging(__file__)
 warnings.simplefilter("ignore", RuntimeWarning)
 
 
-def concat_runs(fif_paths):
-    raws = [read_raw_fif(f, preload=True) for f in fif_paths]
+def concat_raws_common(raws):
+    """Concatenate loaded raws keeping only the channels present in all"""
     common_ch_names = set.intersection(*[set(r.ch_names) for r in raws])
     for raw in raws:
         raw.pick_channels(list(common_ch_names))
     return concatenate_raws(raws) if len(raws) > 1 else raws[0]
 
 
-def process_fif(src, dest, is_mult_runs):
-    raw = concat_runs(src) if is_mult_runs else read_raw_fif(src, preload=True)
+def concat_runs(fif_paths):
+    raws = [read_raw_fif(f, preload=True) for f in fif_paths]
+    return concat_raws_common(raws)
+
+
+def filter_resample(raw):
+    """Apply projectors, bandpass-filter and downsample raw in place"""
     raw.apply_proj()
     raw.filter(
         l_freq=cfg.concat_config["filter_freqs"][0],
@@ -36,6 +41,12 @@ def process_fif(src, dest, is_mult_runs):
         pad=cfg.concat_config["pad"],
     )
     raw.resample(sfreq=cfg.concat_config["resamp_freq"])
+    return raw
+
+
+def process_fif(src, dest, is_mult_runs):
+    raw = concat_runs(src) if is_mult_runs else read_raw_fif(src, preload=True)
+    filter_resample(raw)
     raw.save(dest, overwrite=True)
 
 
@@ -25,8 +25,8 @@ def generate_report(raw, ica, report_savepath):
     report.save(report_savepath, overwrite=True, open_browser=False)
 
 
-def compute_ica(fif_path, ica_sol_path, task):
-    raw = read_raw_fif(fif_path, preload=True)
+def fit_ica(raw, task):
+    """Fit ICA to loaded raw with parameters from ica_config"""
     ica = ICA(
         cfg.ica_config["n_components"],
         random_state=cfg.ica_config["random_state"],
@@ -39,12 +39,22 @@ def compute_ica(fif_path, ica_sol_path, task):
         decim=decim,
         reject_by_annotation=cfg.ica_config["annot_rej"],
     )
+    return ica
+
+
+def save_ica(raw, ica, ica_sol_path):
+    """Save ICA solution and html report with its components next to it"""
     ica.save(ica_sol_path)
 
     report_path = ica_sol_path.with_suffix(".html")
     generate_report(raw, ica, report_path)
 
 
+def compute_ica(fif_path, ica_sol_path, task):
+    raw = read_raw_fif(fif_path, preload=True)
+    save_ica(raw, fit_ica(raw, task), ica_sol_path)
+
+
 if __name__ == "__main__":
     args = parse_args(__doc__, args=sys.argv[1:], emptyroom=False)
     subj, task = args.subject, args.task
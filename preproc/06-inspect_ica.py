@@ -31,7 +31,7 @@ if __name__ == "__main__":
     # output
     ica_bads = bp.ica_bads.fpath(subject=subj, task=task)
 
-    ica_bads.parent.mkdir(exist_ok=True)
+    ica_bads.parent.mkdir(exist_ok=True, parents=True)
     # logger.info(f"Processing {args.path}")
     # print(f"Processing {args.path}")
     inspect_ica(filt, ica_sol, ica_bads)
@@ -14,7 +14,7 @@ subj = args.subject
 info_src = bp.root.fpath(subject=subj, task="questions", run=1, session=None)
 
 trans_path = bp.trans.fpath(subject=subj)
-trans_path.parent.mkdir(exist_ok=True)
+trans_path.parent.mkdir(exist_ok=True, parents=True)
 trans_path = trans_path if trans_path.exists() else None
 
 
@@ -47,5 +47,5 @@ fwd = make_forward_solution(
 )
 
 fwd_path = bp.fwd.fpath(subject=subj)
-fwd_path.parent.mkdir(exist_ok=True)
+fwd_path.parent.mkdir(exist_ok=True, parents=True)
 write_forward_solution(fwd_path, fwd=fwd, overwrite=True)
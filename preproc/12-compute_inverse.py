@@ -40,5 +40,6 @@ info = read_info(bp.epochs.fpath(subject=subj))
 fwd = read_forward_solution(bp.fwd.fpath(subject=subj))
 
 inv_path = bp.inv.fpath(subject=subj)
+inv_path.parent.mkdir(exist_ok=True, parents=True)
 inverse_operator = make_inverse_operator(info, fwd, noise_cov, rank="info")
 write_inverse_operator(inv_path, inverse_operator)
@@ -1,6 +1,7 @@
 """Compute sources from epochs"""
 from argparse import ArgumentParser
 
+import pandas as pd
 from mne import (
     read_epochs,
     read_forward_solution,
@@ -9,13 +10,15 @@ from mne import (
 )
 from mne.minimum_norm import (
     # source_band_induced_power,
-    compute_source_psd_epochs,
     read_inverse_operator,
 )
 
 from metacog import bp
 from metacog.paths import dirs
 from metacog.config_parser import cfg
+from metacog.morph import iter_apply_morph
+from metacog.source_psd import SourcePSD
+from metacog.source_store import source_trials_prefix, write_source_trials
 from metacog.utils import setup_logging
 
 logger = setup_logging(__file__)
@@ -45,29 +48,8 @@ inverse_operator = read_inverse_operator(inv_path)
 #     baseline=(-1, 0),
 # )
 
-epochs_active = epochs.copy().crop(
-    tmin=cfg.config_sources["active_win"][0], tmax=cfg.config_sources["active_win"][1]
-)
-epochs_base = epochs.copy().crop(
-    tmin=cfg.config_sources["baseline_win"][0],
-    tmax=cfg.config_sources["baseline_win"][1],
-)
-
-stcs_low_act = compute_source_psd_epochs(
-    epochs_active["low"], inverse_operator, fmin=2, fmax=30, lambda2=2
-)
-
-stcs_high_act = compute_source_psd_epochs(
-    epochs_active["high"], inverse_operator, fmin=2, fmax=30, lambda2=2
-)
-
-stcs_low_base = compute_source_psd_epochs(
-    epochs_base["low"], inverse_operator, fmin=2, fmax=30, lambda2=2
-)
-
-stcs_high_base = compute_source_psd_epochs(
-    epochs_base["high"], inverse_operator, fmin=2, fmax=30, lambda2=2
-)
+# one inverse kernel and one set of tapers for both windows and conditions
+engine = SourcePSD(inverse_operator, lambda2=2, fmin=2, fmax=30)
 
 src_path = dirs.fsf_subjects / "fsaverage/bem/fsaverage-oct-6-src.fif"
 src = read_source_spaces(src_path)
@@ -80,13 +62,31 @@ morph = compute_source_morph(
     subjects_dir=dirs.fsf_subjects,
 )
 subj_dir = dirs.sources / f"sub-{subj}"
-subj_dir.mkdir(exist_ok=True)
-
-for i, s in enumerate(stcs_high_act):
-    s /= stcs_high_base[i]
-    morph.apply(s).save(subj_dir / f"sub-{subj}_cond-high_trial-{i}")
-for i, s in enumerate(stcs_low_act):
-    s /= stcs_low_base[i]
-    morph.apply(s).save(subj_dir / f"sub-{subj}_cond-low_trial-{i}")
+
+conditions = ["high", "low"]
+metadata = []
+for cond in conditions:
+    cond_metadata = epochs[cond].metadata.reset_index(drop=True)
+    cond_metadata.insert(0, "cond", cond)
+    metadata.append(cond_metadata)
+
+active_win = cfg.config_sources["active_win"]
+baseline_win = cfg.config_sources["baseline_win"]
+
+
+def iter_ratios():
+    for cond in conditions:
+        _, ratio = engine.ratio(epochs[cond], active_win, baseline_win)
+        yield from ratio
+
+
+write_source_trials(
+    source_trials_prefix(subj_dir, subj),
+    iter_apply_morph(morph, iter_ratios()),
+    fsave_vertices,
+    engine.freqs(epochs, active_win),
+    pd.concat(metadata, ignore_index=True),
+    axis_name="freqs",
+)
 
 # (sum(stcs_high_base) / len(stcs_high_base) / sum(stcs_low_base) * len(stcs_low_base)).plot(subjects_dir=dirs.fsf_subjects, hemi="both")
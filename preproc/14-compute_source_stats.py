@@ -1,11 +1,11 @@
 import numpy as np
-from mne import read_source_estimate, read_source_spaces, spatial_src_adjacency
-from mne.stats import (
-    summarize_clusters_stc, spatio_temporal_cluster_test, ttest_ind_no_p,
-)
+from mne import read_source_spaces, spatial_src_adjacency
+from mne.stats import summarize_clusters_stc
 
+from metacog.cluster_stats import spatio_temporal_cluster_test
 from metacog.paths import dirs
 from metacog.config_parser import cfg
+from metacog.source_store import load_source_trials, source_trials_prefix
 
 # stcs_low = []
 # stcs_high = []
@@ -22,20 +22,13 @@ stcs_high = []
 
 X_high = []  # high confidence
 X_low = []  # low confidence
-for trial_path in dirs.sources.glob("*/*.stc"):
-    if trial_path.match("*cond-high*"):
-        X_high.append(
-            read_source_estimate(str(trial_path)[: -len("-rh.stc")]).data.T
-        )
-    elif trial_path.match("*cond-low*"):
-        X_low.append(
-            read_source_estimate(str(trial_path)[: -len("-rh.stc")]).data.T
-        )
-    else:
-        print(f"NO MATCH FOR {trial_path}")
+for subj, subj_path in zip(cfg.subjects, subj_paths):
+    trials = load_source_trials(source_trials_prefix(subj_path, subj))
+    X_high.append(trials["cond == 'high'"].data.transpose([0, 2, 1]))
+    X_low.append(trials["cond == 'low'"].data.transpose([0, 2, 1]))
 
-X_high = np.array(X_high)
-X_low = np.array(X_low)
+X_high = np.concatenate(X_high)
+X_low = np.concatenate(X_low)
 
 print("X_high.shape = ", X_high.shape)
 print("X_low.shape = ", X_low.shape)
@@ -46,11 +39,13 @@ thresh_pv = 0.02
 F_obs, clusters, cluster_pv, H0 = clu = spatio_temporal_cluster_test(
     [X_high, X_low],
     # threshold=8,
-    n_permutations=100,
+    n_permutations=5000,
     adjacency=adjacency,
     out_type="indices",
-    check_disjoint=True,
-    stat_fun=ttest_ind_no_p,
+    stat="t",
+    seed=42,
+    # checkpointed: an interrupted run resumes when the script is rerun
+    save_path=dirs.cluster_stats / "sources_high_low",
 )
 
 stc_all_cluster_vis = summarize_clusters_stc(
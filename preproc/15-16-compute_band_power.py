@@ -0,0 +1,89 @@
+"""Compute single-trial power in target frequency bands epoch batch by batch"""
+from argparse import ArgumentParser
+from contextlib import ExitStack
+
+import numpy as np
+from mne import read_epochs
+from mne.time_frequency import tfr_morlet
+
+from metacog import bp
+from metacog.config_parser import cfg
+from metacog.tfr_store import TFRWriter, write_tfr_header
+from metacog.utils import setup_logging
+
+logger = setup_logging(__file__)
+
+
+def compute_band_power(ep_path, tfr_av_paths, batch_size=None):
+    """
+    Compute single-trial power averaged within each of cfg.target_bands
+
+    Gives the same result as compute_tfr_epochs followed by average_tfr, but
+    epochs are read and transformed in batches and only freqs within the
+    bands are computed, so the single-trial TFR of all freqs is neither held
+    in memory nor written to disk.
+
+    tfr_av_paths maps band names to output paths. Raises ValueError if there
+    are no answer epochs, since no targets would be written.
+
+    """
+    if batch_size is None:
+        batch_size = cfg.band_power_config["batch_size"]
+    ep = read_epochs(ep_path, preload=False)["answer"]
+    if not len(ep):
+        raise ValueError(f"No answer epochs in {ep_path}")
+
+    freqs = np.arange(**cfg.tfr_config["freqs"])
+    band_masks = {}
+    for band in tfr_av_paths:
+        fmin, fmax = cfg.target_bands[band]
+        band_masks[band] = (freqs >= fmin) & (freqs <= fmax)
+    is_used = np.any(list(band_masks.values()), axis=0)
+    freqs = freqs[is_used]
+    band_masks = {band: mask[is_used] for band, mask in band_masks.items()}
+
+    with ExitStack() as stack:
+        writers = {}
+        for start in range(0, len(ep), batch_size):
+            tfr = tfr_morlet(
+                ep[start:start + batch_size],
+                average=False,
+                return_itc=False,
+                freqs=freqs,
+                n_cycles=freqs / 2.0,
+                decim=cfg.tfr_config["decim"],
+                use_fft=cfg.tfr_config["use_fft"],
+            )
+            if not writers:
+                for band, tfr_av_path in tfr_av_paths.items():
+                    tfr_av_path.parent.mkdir(exist_ok=True, parents=True)
+                    write_tfr_header(
+                        tfr_av_path, tfr.info, tfr.times,
+                        [cfg.target_bands[band][0]], ep.events, ep.event_id,
+                        ep.metadata, tfr.method,
+                    )
+                    writers[band] = stack.enter_context(
+                        TFRWriter(
+                            tfr_av_path, tfr.info, len(ep), 1, len(tfr.times),
+                            **cfg.tfr_store_config,
+                        )
+                    )
+            for band, mask in band_masks.items():
+                band_power = tfr.data[:, :, mask].mean(axis=2, keepdims=True)
+                writers[band].write(start, band_power)
+            logger.info(f"Computed band power of {start + len(tfr)} epochs")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(__doc__)
+    parser.add_argument("subject", help="subject id")
+    subj = parser.parse_args().subject
+
+    # input
+    ep_path = bp.epochs.fpath(subject=subj)
+    # output
+    tfr_av_paths = {
+        band: bp.tfr_av.fpath(subject=subj, acquisition=band)
+        for band in cfg.target_bands
+    }
+    compute_band_power(ep_path, tfr_av_paths)
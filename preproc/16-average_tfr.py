@@ -1,27 +1,45 @@
 """Compute power time course in target frequency bins"""
 from argparse import ArgumentParser
-import numpy as np
-from mne.time_frequency import read_tfrs
 
 from metacog import bp
 from metacog.config_parser import cfg
+from metacog.tfr_store import TFRStore, TFRWriter, write_tfr_header
 
 
-parser = ArgumentParser(__doc__)
-parser.add_argument("subject", help="subject id")
-subj = parser.parse_args().subject
-
-tfr_path = bp.tfr.fpath(subject=subj)
-tfr = read_tfrs(tfr_path)[0]
-fr = tfr.freqs
-for band in cfg.target_bands:
-    fr_inds = np.logical_and(
-        fr >= cfg.target_bands[band][0], fr <= cfg.target_bands[band][1]
-    )
-    data = tfr.data[:, :, fr_inds, :].mean(axis=2, keepdims=True)
-    tfr_band = tfr.copy()
-    tfr_band.data = data
-    tfr_band.freqs = [cfg.target_bands[band][0]]
-    tfr_av_path = bp.tfr_av.fpath(subject=subj, acquisition=band)
-    tfr_av_path.parent.mkdir(exist_ok=True, parents=True)
-    tfr_band.save(tfr_av_path, overwrite=True)
+def average_tfr(tfr_path, tfr_av_paths):
+    """
+    Average single-trial TFR within each of cfg.target_bands
+
+    tfr_av_paths maps band names to output paths. Only freqs of the band are
+    read, one channel type at a time.
+
+    """
+    with TFRStore(tfr_path) as tfr:
+        for band, tfr_av_path in tfr_av_paths.items():
+            tfr_av_path.parent.mkdir(exist_ok=True, parents=True)
+            write_tfr_header(
+                tfr_av_path, tfr.info, tfr.times, [cfg.target_bands[band][0]],
+                tfr.events, tfr.event_id, tfr.metadata, tfr.method,
+            )
+            with TFRWriter(
+                tfr_av_path, tfr.info, len(tfr), 1, len(tfr.times),
+                **cfg.tfr_store_config,
+            ) as writer:
+                for ch_type in tfr.ch_types:
+                    band_slice = tfr.select(ch_type, band=band, exclude=[])
+                    writer.write(
+                        0, band_slice.load(average_freqs=True), ch_type
+                    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(__doc__)
+    parser.add_argument("subject", help="subject id")
+    subj = parser.parse_args().subject
+
+    tfr_path = bp.tfr.fpath(subject=subj)
+    tfr_av_paths = {
+        band: bp.tfr_av.fpath(subject=subj, acquisition=band)
+        for band in cfg.target_bands
+    }
+    average_tfr(tfr_path, tfr_av_paths)
@@ -5,8 +5,6 @@ Note
 requires mne >= 0.20
 
 """
-from operator import attrgetter
-
 import matplotlib.pyplot as plt
 
 import mne
@@ -15,16 +13,24 @@ from mne.io import read_raw_fif
 from mne.chpi import read_head_pos, filter_chpi
 from mne.viz import plot_head_positions
 
+from metacog.manifest import RAWDATA, get_manifest, parse_name
 from metacog.paths import dirs
-from metacog.utils import BidsFname
 
 
 set_log_level(verbose="ERROR")
 
 
+def find(root, subj, **entities):
+    """Indexed files of subject in BIDS root or derivatives folder"""
+    stage = RAWDATA if root == dirs.bids_root else root.name
+    paths = get_manifest().query(
+        stage=stage, subject=subj.name[len("sub-"):], **entities
+    )
+    return sorted(paths, key=lambda p: p.name)
+
+
 def add_head_postions(subj, report):
-    hp_files = list((dirs.hp / subj.name).glob("*_hp.pos"))
-    hp_files = sorted(hp_files, key=attrgetter("name"))
+    hp_files = find(dirs.hp, subj, suffix="hp", extension=".pos")
 
     figs = list()
     captions = list()
@@ -38,8 +44,7 @@ def add_head_postions(subj, report):
 
 
 def add_bad_channels(subj, report):
-    bads_files = list((dirs.bads / subj.name).rglob("*-bads.tsv"))
-    bads_files = sorted(bads_files, key=attrgetter("name"))
+    bads_files = find(dirs.bads, subj, suffix="bads", extension=".tsv")
 
     bads_htmls = list()
     captions = list()
@@ -68,18 +73,18 @@ def prepare_raw_orig_data(fif_file, subj):
     filter_chpi(raw, allow_line_only=allow_line_only)
 
     # set bads and annotations
-    bads_dir = dirs.bads / subj.name
-    if subj.name == "sub-emptyroom":
-        print(fif_file)
-        bids_dict = BidsFname(fif_file.name)
-        bads_dir = bads_dir / ("ses-" + bids_dict["ses"])
-    basename = fif_file.name[: -len("_meg.fif")]
-    bads_fpath = bads_dir / (basename + "-bads.tsv")
+    entities = parse_name(fif_file.name)[0]
+    bids = dict(
+        session=entities.get("ses"),
+        task=entities.get("task"),
+        run=entities.get("run"),
+    )
+    (bads_fpath,) = find(dirs.bads, subj, suffix="bads", **bids)
     with open(bads_fpath, "r") as f:
         bads = f.readline().split("\t")
     raw.info["bads"] = bads
 
-    annotations_fpath = bads_dir / (basename + "-annot.fif")
+    (annotations_fpath,) = find(dirs.bads, subj, suffix="annot", **bids)
     annotations = read_annotations(str(annotations_fpath))
     raw.set_annotations(annotations)
 
@@ -106,11 +111,8 @@ def prepare_raw_tsss_data(fif_file, subj):
 
 def add_maxwell_filtering_figures(subj, report):
     # load original and maxfiltered data
-    orig_fifs = list((dirs.bids_root / subj.name).rglob("*_meg.fif"))
-    orig_fifs = sorted(orig_fifs, key=attrgetter("name"))
-
-    maxwell_fifs = list((dirs.maxfilter / subj.name).glob("*_meg.fif"))
-    maxwell_fifs = sorted(maxwell_fifs, key=attrgetter("name"))
+    orig_fifs = find(dirs.bids_root, subj, suffix="meg", extension=".fif")
+    maxwell_fifs = find(dirs.maxfilter, subj, suffix="meg", extension=".fif")
 
     figs = list()
     captions = list()
@@ -156,15 +158,17 @@ def generate_report(subj):
 
     # -------- save results -------- #
     dest_dir = dirs.reports / subj.name
-    dest_dir.mkdir(exist_ok=True)
+    dest_dir.mkdir(exist_ok=True, parents=True)
     savename = dest_dir / (subj.name + "-report.html")
     report.save(str(savename), open_browser=False, overwrite=True)
     # ------------------------------ #
 
 
 if __name__ == "__main__":
-    subjs = dirs.bids_root.glob("sub-*")
-    # subjs = dirs.bids_root.glob("sub-emptyroom")
+    manifest = get_manifest()
+    manifest.update()
+    subjs = [dirs.bids_root / f"sub-{s}" for s in manifest.subjects()]
+    # subjs = [dirs.bids_root / "sub-emptyroom"]
     for s in subjs:
         print(f"Processing {s.name}")
         generate_report(s)
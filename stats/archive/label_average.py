@@ -7,12 +7,13 @@ from config import DERIVATIVES_DIR, SUBJECTS_DIR
 from argparse import ArgumentParser
 from mne import (
     read_labels_from_annot,
-    read_source_estimate,
     extract_label_time_course,
     read_source_spaces,
 )
 import numpy as np
 
+from metacog.source_store import load_source_trials, source_trials_prefix
+
 parser = ArgumentParser(description=__doc__)
 parser.add_argument("subject", help="subject id")
 args = parser.parse_args()
@@ -28,13 +29,9 @@ labels = read_labels_from_annot(
     "fsaverage", subjects_dir=SUBJECTS_DIR, parc=parc
 )
 
-X = []
-for trial_path in sorted(subj_dir.glob("*-rh.stc")):
-    X.append(
-        read_source_estimate(
-            str(trial_path)[: -len("-rh.stc")], subject=f"sub-{subj}"
-        )
-    )
+# written by stats/report/compute_sources_erp.py
+trials = load_source_trials(source_trials_prefix(subj_dir, subj))
+X = (trials.to_stc(i) for i in range(len(trials)))
 
 src_path = SUBJECTS_DIR / "fsaverage/bem/fsaverage-oct-6-src.fif"
 src = read_source_spaces(src_path)
@@ -1,49 +1,36 @@
 """
 Cluster-based permutation test for correlations
-"""
-
-
-def compte_stat():
-    """
-    Compute cluster-level statistic
-    """
-    pass
 
+The test is implemented in `metacog.cluster_stats`: t values of correlations
+of single-trial data with behaviour are thresholded and clustered over the
+adjacency, and behaviour is permuted between trials within each subject.
 
-def spatio_temporal_cluster_correlation_test(adjacency, n_permutatons=1024):
-    """
-    TODO
-    """
-    # 1. Compute real stats for each data point
-    #   - use t-value for correlation coefficients
-    # 2. Find clusters
-    #   - threshold t-values
-    #   - find clusters using adjacency matrix
-    # 3. For each cluster compute cluster-level statistic
-    # 4. Do permutations
-    #   - leave data in place, permute trials behav data between trials within
-    #     each subject
-    #   - on each permutation compute point-wise stats, find clusters,
-    #     compute stats for each and find maximum-stat cluster
-    #   - store max-stats from each permutation; compute hist at the end
-    pass
+"""
+from metacog.cluster_stats import spatio_temporal_cluster_correlation_test
 
+__all__ = ["spatio_temporal_cluster_correlation_test"]
 
-# _find_clusters(x, threshold, tail=0, adjacency=None, max_step=1, include=None, partitions=None, t_power=1, show_info=False):
 
 if __name__ == "__main__":
-    from tf_analysis import load_data, make_cumulative_df
+    import numpy as np
     from mne.channels import find_ch_adjacency
-    from mne.io import read_info
-
-    from config import bp_epochs
 
-    time_ind = 100
-    ch_ind = 1
-    band = "alpha"
-    dfs, data = load_data(band)
-    cumulative_df = make_cumulative_df(dfs, data, ch_ind, time_ind)
+    from metacog.dataset_specific_utils import assemble_epochs_new
 
-    info_src = bp_epochs.fpath(subject="01")
-    info = read_info(info_src)
+    X, metadata, times, info = assemble_epochs_new("answer")
     adjacency, ch_names = find_ch_adjacency(info, ch_type="grad")
+
+    has_conf = metadata.confidence.notna().values
+    T_obs, clusters, p_values, H0 = spatio_temporal_cluster_correlation_test(
+        X[has_conf].transpose(0, 2, 1),
+        metadata.confidence.values[has_conf],
+        groups=metadata.subject.values[has_conf],
+        n_permutations=5000,
+        adjacency=adjacency,
+    )
+    for i_clu in np.where(p_values < 0.05)[0]:
+        time_inds, space_inds = clusters[i_clu]
+        print(
+            f"{times[time_inds.min()]:.3f}-{times[time_inds.max()]:.3f} s,"
+            f" {len(np.unique(space_inds))} channels, p={p_values[i_clu]}"
+        )
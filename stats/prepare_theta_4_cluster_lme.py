@@ -1,20 +1,45 @@
-from metacog.group_analysis.reproduce_wynn.utils import prepare_band_power
-from metacog.dataset_specific_utils import assemble_epochs_new
+"""
+Cluster-LME of theta-range power: mixed-model z values of confidence over
+channels x frequencies, clustered with the gradiometer adjacency and tested
+by permuting trial labels within subjects
+
+"""
+from mne.channels import find_ch_adjacency
 import numpy as np
-import pickle
+
+from metacog.cluster_stats import spatio_temporal_cluster_lmm_test
+from metacog.group_analysis.reproduce_wynn.utils import prepare_band_power
+from metacog.epoch_store import load_epoch_store
 
 freq_band = (4, 8)
 time_win = (0.4, 0.8)
 ch_group = "parietal"
 psd_params = dict(fmin=0, fmax=30, n_fft=128)
 ch_type = "grad"
+p_accept = 0.05
 
-X, meta, times, info = assemble_epochs_new(ch_type=ch_type)
+X, meta, times, info = load_epoch_store(
+    ch_type, "answer", baseline=(-0.2, 0)
+)
 df, power, freqs = prepare_band_power(
     times, time_win, meta, X, freq_band, info, psd_params
 )
+adjacency, ch_names = find_ch_adjacency(info, ch_type=ch_type)
 
-np.save("theta_power.npy", power)
+# power: trials x freqs x channels
+T_obs, clusters, p_values, H0 = spatio_temporal_cluster_lmm_test(
+    power,
+    df,
+    "~ is_correct * confidence",
+    "confidence",
+    groups="subject",
+    n_permutations=1000,
+    adjacency=adjacency,
+)
 
-with open("theta_power_regressors.pkl", "wb") as f:
-    pickle.dump(df, f)
+for i_clu in np.where(p_values < p_accept)[0]:
+    freq_inds, space_inds = clusters[i_clu]
+    print(
+        f"{freqs[freq_inds.min()]:.1f}-{freqs[freq_inds.max()]:.1f} Hz,"
+        f" {len(np.unique(space_inds))} channels, p={p_values[i_clu]}"
+    )
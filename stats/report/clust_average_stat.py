@@ -99,8 +99,6 @@ Group Var                      4.288    0.162
 """
 import numpy as np
 import pandas as pd
-from joblib import Memory
-from mne import read_epochs
 from tqdm import tqdm
 import scipy.stats as st
 import matplotlib.pyplot as plt
@@ -113,25 +111,26 @@ from statsmodels.stats.diagnostic import het_white
 import matplotlib
 
 from metacog import bp
+from metacog.cache import cached
 from metacog.config_parser import cfg
-
-location = "./cachedir"
-memory = Memory(location, verbose=0)
+from metacog.dataset_specific_utils import epochs_files
+from metacog.utils import read_epochs_selection
 
 ch_type = "grad"
 
 
-@memory.cache
+@cached(inputs=epochs_files, config=["subjects"])
 def load_data_clust_av(times, spaces, task="answer"):
     dfs = []
     data = []
     for subj in tqdm(cfg.subjects):
         ep_path = bp.epochs.fpath(subject=subj)
-        ep = read_epochs(ep_path)[task]["confidence < 100 and confidence > 0"]
-        # ep = read_epochs(ep_path)[task]
+        ep = read_epochs_selection(
+            ep_path, task, "confidence < 100 and confidence > 0", ch_type
+        )
         ep.apply_baseline()
         df = ep.metadata.copy()
-        tmp = ep.pick_types(meg=ch_type).get_data().transpose([0, 2, 1])
+        tmp = ep.get_data().transpose([0, 2, 1])
         data.append(tmp[:, times, spaces].mean(axis=1))
         df["subject"] = subj
         dfs.append(df)
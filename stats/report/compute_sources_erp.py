@@ -17,6 +17,8 @@ from mne.minimum_norm import (
 
 from metacog.paths import dirs
 from metacog import bp
+from metacog.morph import iter_apply_morph
+from metacog.source_store import source_trials_prefix, write_source_trials
 from metacog.utils import setup_logging
 
 logger = setup_logging(__file__)
@@ -39,7 +41,7 @@ inverse_operator = read_inverse_operator(inv_path)
 epochs.apply_baseline()
 
 stcs = apply_inverse_epochs(
-    epochs, inverse_operator, lambda2=1, method="MNE"
+    epochs, inverse_operator, lambda2=1, method="MNE", return_generator=True
 )
 
 
@@ -54,8 +56,11 @@ morph = compute_source_morph(
     subjects_dir=dirs.fsf_subjects,
 )
 subj_dir = SOURCES_PSD_DIR / f"sub-{subj}"
-subj_dir.mkdir(exist_ok=True, parents=True)
 
-for i, s in enumerate(stcs):
-    morph.apply(s).save(subj_dir / f"sub-{subj}_trial-{i:03d}")
-epochs.metadata.to_pickle(subj_dir / f"sub-{subj}_df.pkl")
+write_source_trials(
+    source_trials_prefix(subj_dir, subj),
+    iter_apply_morph(morph, stcs),
+    fsave_vertices,
+    epochs.times,
+    epochs.metadata,
+)
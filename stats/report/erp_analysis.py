@@ -8,17 +8,17 @@ Oddly, gradiometers and magnetometers show completely different clusters
 Gradiometer cluster is around 300 ms.
 
 """
-import numpy as np
 from mne import EpochsArray, pick_types
 from mne.io import read_info
 from mne import set_log_level
-from mne.stats import spatio_temporal_cluster_test
 from mne.channels import find_ch_adjacency
 import matplotlib
 from mne import combine_evoked
 
+from metacog.cluster_stats import spatio_temporal_cluster_test
 from metacog import bp
-from metacog.utils import plot_temporal_clusters
+from metacog.paths import dirs
+from metacog.utils import plot_stored_clusters
 from metacog.dataset_specific_utils import (
     assemble_epochs,
     LOW_CONF_EPOCH,
@@ -72,19 +72,18 @@ X_high = X[y == HIGH_CONF_EPOCH, ...].transpose(0, 2, 1)
 threshold = 6.0
 # set family-wise p-value
 p_accept = 0.05
-cluster_stats = spatio_temporal_cluster_test(
+# results store, resumed or reused on reruns
+save_path = dirs.cluster_stats / f"erp_high_low_{ch_type}"
+spatio_temporal_cluster_test(
     [X_low, X_high],
-    n_permutations=100,
+    n_permutations=1000,
     threshold=threshold,
     tail=0,
-    n_jobs=1,
-    buffer_size=None,
     adjacency=adjacency,
+    p_accept=p_accept,
+    save_path=save_path,
 )
 
-T_obs, clusters, p_values, _ = cluster_stats
-good_cluster_inds = np.where(p_values < p_accept)[0]
-
 
 # organize data for plotting
 evokeds = {"low": erf_low, "high": erf_high}
@@ -94,6 +93,4 @@ font = {'family' : 'normal',
         'weight' : 'bold',
         'size'   : 15}
 matplotlib.rc('font', **font)
-plot_temporal_clusters(
-    good_cluster_inds, evokeds, T_obs, clusters, erf_low.times, info
-)
+plot_stored_clusters(save_path, evokeds, erf_low.times, info, p_accept)
@@ -1,15 +1,15 @@
 """Do erp stats on each subject separately"""
 from tqdm import tqdm
 import numpy as np
-from mne import read_epochs, combine_evoked, pick_types
+from mne import combine_evoked, pick_types
 from mne.io import read_info
-from mne.stats import spatio_temporal_cluster_test
 from mne.channels import find_ch_adjacency
 import matplotlib.pyplot as plt
 
+from metacog.cluster_stats import spatio_temporal_cluster_test
 from metacog.config_parser import cfg
 from metacog import bp
-from metacog.utils import plot_temporal_clusters
+from metacog.utils import plot_temporal_clusters, read_epochs_selection
 
 LOW_CONF_EPOCH = 24
 HIGH_CONF_EPOCH = 44
@@ -24,11 +24,7 @@ X = np.empty((0, n_channels, n_times))
 y = np.empty(0)
 for subj in tqdm(cfg.subjects[1:], desc="Loading epochs"):
     ep_path = bp.epochs.fpath(subject=subj)
-    ep = (
-        read_epochs(ep_path)
-        .interpolate_bads()
-        .pick_types(meg="grad")[ep_type]
-    )
+    ep = read_epochs_selection(ep_path, ep_type, meg="grad")
     ep.apply_baseline()
 
     # required to merge epochs from differen subjects together
@@ -44,12 +40,11 @@ for subj in tqdm(cfg.subjects[1:], desc="Loading epochs"):
     p_accept = 0.05
     cluster_stats = spatio_temporal_cluster_test(
         [X_low, X_high],
-        n_permutations=100,
+        n_permutations=1000,
         # threshold=threshold,
         tail=0,
-        n_jobs=1,
-        buffer_size=None,
         adjacency=adjacency,
+        p_accept=p_accept,
     )
 
     T_obs, clusters, p_values, _ = cluster_stats
@@ -6,7 +6,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 from mne.io import read_info
 from mne import EpochsArray, pick_types, EvokedArray
-from mne.stats import spatio_temporal_cluster_test
 from mne.channels import find_ch_adjacency
 
 from mne.viz.topomap import (
@@ -23,6 +22,7 @@ from mne.time_frequency import psd_multitaper, psd_welch
 from mne.viz import plot_compare_evokeds, tight_layout
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
+from metacog.cluster_stats import spatio_temporal_cluster_test
 from metacog import bp
 from metacog.dataset_specific_utils import (
     assemble_epochs,
@@ -103,12 +103,12 @@ psds_high_t = psds_high.transpose(0, 2, 1)
 
 cluster_stats = spatio_temporal_cluster_test(
     [psds_low_t, psds_high_t],
-    n_permutations=500,
+    n_permutations=1000,
     threshold=threshold,
     tail=1,
     n_jobs=8,
-    buffer_size=None,
     adjacency=adjacency,
+    p_accept=p_accept,
 )
 
 T_obs, clusters, p_values, _ = cluster_stats
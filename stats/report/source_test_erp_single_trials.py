@@ -41,31 +41,37 @@ S_temporal_transverse-lh
 
 """
 import numpy as np
-from joblib import Memory
 import pandas as pd
 from mne import read_labels_from_annot, read_source_spaces
-from mne.stats import spatio_temporal_cluster_test
 import os
 from scipy.sparse import coo_matrix
 from tqdm import tqdm
 
+from metacog.cache import cached
+from metacog.cluster_stats import spatio_temporal_cluster_test
 from metacog.paths import dirs
 from metacog.config_parser import cfg
-
-memory = Memory(location="./cachedir", verbose=0)
+from metacog.source_store import load_source_trials, source_trials_prefix
 
 SOURCES_LABEL_AV = dirs.derivatives / "sources_label_av"
 SOURCES_PSD_DIR = dirs.derivatives / "sources_epochs"
 
 
-@memory.cache
+def source_dirs():
+    return [
+        d / f"sub-{s}"
+        for d in (SOURCES_LABEL_AV, SOURCES_PSD_DIR)
+        for s in cfg.subjects
+    ]
+
+
+@cached(inputs=source_dirs, config=["subjects"])
 def load_source_data():
     X = []
     dfs = []
     for subj in tqdm(cfg.subjects):
-        df = pd.read_pickle(
-            SOURCES_PSD_DIR / f"sub-{subj}" / f"sub-{subj}_df.pkl"
-        )
+        prefix = source_trials_prefix(SOURCES_PSD_DIR / f"sub-{subj}", subj)
+        df = load_source_trials(prefix).metadata
         df["subject"] = subj
         dfs.append(df)
         subj_dir = SOURCES_LABEL_AV / f"sub-{subj}"
@@ -102,11 +108,15 @@ if __name__ == "__main__":
     X_high = X[high_mask, :, :].transpose(0, 2, 1)
     adj, labels = get_label_adjacency()
 
+    thresh = 0.05
     cluster_stats = spatio_temporal_cluster_test(
-        [X_low, X_high], adjacency=adj, n_permutations=100, threshold=6
+        [X_low, X_high],
+        adjacency=adj,
+        n_permutations=1000,
+        threshold=6,
+        p_accept=thresh,
     )
     T_obs, clusters, p_values, _ = cluster_stats
-    thresh = 0.05
     good_cluster_inds = (p_values < thresh).nonzero()[0]
 
     times = np.arange(-1, 1.002, 0.002)
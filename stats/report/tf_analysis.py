@@ -1,25 +1,32 @@
 """Initially """
 import pandas as pd
-import statsmodels.formula.api as smf
-from joblib import Memory
-from mne.time_frequency import read_tfrs
 
 from metacog import bp
+from metacog.cache import cached
 from metacog.config_parser import cfg
+from metacog.lmm import RandomInterceptLMM
+from metacog.tfr_store import TFRStore
 
-location = "./cachedir"
-memory = Memory(location, verbose=0)
 
+def tfr_av_files(band):
+    return [bp.tfr_av.fpath(subject=s, acquisition=band) for s in cfg.subjects]
 
-@memory.cache
+
+@cached(inputs=tfr_av_files, config=["subjects"])
 def load_data(band):
     dfs = []
     data = []
     for subj in cfg.subjects:
         tfr_path = bp.tfr_av.fpath(subject=subj, acquisition=band)
-        tfr = read_tfrs(tfr_path)[0]["confidence < 100 and confidence > 0"]
+        with TFRStore(tfr_path) as store:
+            # all stored channels, so that subjects can be concatenated
+            tfr = store.select(
+                "grad",
+                query="confidence < 100 and confidence > 0",
+                exclude=[],
+            )
+            data.append(tfr.load()[:, :, 0, :])
         df = tfr.metadata.copy()
-        data.append(tfr.pick_types(meg="grad").data[:, :, 0, :])
         df["subject"] = subj
         dfs.append(df)
     return dfs, data
@@ -54,33 +61,21 @@ if __name__ == "__main__":
 
     # np.save(f"data_{band}", all_data)
 
-    # from time import time
-    # t1 = time()
-    # cumulative_df = make_cumulative_df(dfs, data, ch_ind, time_ind)
-    # for ch_ind in range(204):
-
-    #     # info_src = bp_epochs.fpath(subject="01")
-    #     # info = read_info(info_src)
-    #     # sel_idx = pick_types(info, meg="grad")
-
-    #     md = smf.mixedlm(
-    #         "data ~ is_correct * confidence",
-    #         data=cumulative_df,
-    #         groups=cumulative_df["subject"],
-    #     )
-    #     mdf = md.fit()
-    #     sum = mdf.summary()
-    #     is_corr_p = sum.tables[1]["P>|z|"]["is_correct[T.True]"]
-    #     conf_p = sum.tables[1]["P>|z|"]["confidence"]
-
-    #     if float(is_corr_p) < 0.05 or float(conf_p) < 0.05:
-    #         print("!!!!!!!!!!!!!!!!!!!!")
-    #     print(
-    #         f"ch_ind={ch_ind}, time_ind={time_ind}:: corr_p={is_corr_p}, conf_p={conf_p}"
-    #     )
-
-    # t2 = time()
-    # print(t2 - t1)
+    # one random-intercept model per channel x time point
+    all_dfs.is_correct = all_dfs.is_correct.astype(bool)
+    model = RandomInterceptLMM.from_formula(
+        "data ~ is_correct * confidence", all_dfs, groups="subject"
+    )
+    res = model.fit(all_data)
+    is_corr_p = res["is_correct[T.True]"]["pvalues"]  # channels x times
+    conf_p = res["confidence"]["pvalues"]
+    significant = (is_corr_p < 0.05) | (conf_p < 0.05)
+    for ch_ind, time_ind in zip(*np.nonzero(significant)):
+        print(
+            f"ch_ind={ch_ind}, time_ind={time_ind}::"
+            f" corr_p={is_corr_p[ch_ind, time_ind]},"
+            f" conf_p={conf_p[ch_ind, time_ind]}"
+        )
 
 
     # diff_tfr = avg_low.copy()
@@ -53,7 +53,7 @@ from statsmodels.stats.diagnostic import het_white
 import matplotlib.pyplot as plt
 import numpy as np
 
-from metacog.dataset_specific_utils import assemble_epochs_new
+from metacog.epoch_store import load_epoch_store
 from metacog.group_analysis.reproduce_wynn.utils import prepare_erp
 import scipy.stats as st
 import seaborn as sns
@@ -63,7 +63,7 @@ time_window = (0.4, 0.8)
 ch_group = "parietal"
 ch_type = "grad"
 
-X, meta, times, info = assemble_epochs_new(ch_type=ch_type, baseline=None)
+X, meta, times, info = load_epoch_store(ch_type, "answer", baseline=None)
 df, data = prepare_erp(times, time_window, ch_group, meta, X, info)
 if ch_type == "mag":
     df.data *= 1e14
@@ -12,7 +12,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from mne.time_frequency import psd_array_welch
 
-from metacog.dataset_specific_utils import assemble_epochs_new
+from metacog.epoch_store import load_epoch_store
 from metacog.group_analysis.reproduce_wynn.utils import prepare_erp
 
 time_window = (0.4, 0.8)
@@ -21,7 +21,7 @@ ch_type = "grad"
 freq_band = (4, 8)
 baseline = (-0.2, 0)
 
-X, meta, times, info = assemble_epochs_new(ch_type=ch_type, baseline=baseline)
+X, meta, times, info = load_epoch_store(ch_type, "answer", baseline=baseline)
 
 df, data = prepare_erp(times, time_window, ch_group, meta, X, info)
 
@@ -33,7 +33,7 @@ import statsmodels.formula.api as smf
 import matplotlib.pyplot as plt
 import numpy as np
 
-from metacog.dataset_specific_utils import assemble_epochs_new
+from metacog.epoch_store import load_epoch_store
 from metacog.group_analysis.reproduce_wynn.utils import (
     _drop_by_confidence,
     add_condition,
@@ -47,7 +47,7 @@ time_window = (0.4, 0.8)
 ch_group = "parietal"
 ch_type = "grad"
 
-X, meta, times, info = assemble_epochs_new(ch_type=ch_type, baseline=None)
+X, meta, times, info = load_epoch_store(ch_type, "answer", baseline=None)
 df, data = _drop_by_confidence(meta, X, 0, 30, 70, 100)
 df = add_condition(df, 30, 70)
 time_inds, ch_inds = _get_masks(
@@ -16,7 +16,7 @@ Plan
 import statsmodels.formula.api as smf
 import matplotlib.pyplot as plt
 
-from metacog.dataset_specific_utils import assemble_epochs_new
+from metacog.epoch_store import load_epoch_store
 from metacog.group_analysis.reproduce_wynn.utils import prepare_psd
 import numpy as np
 
@@ -26,7 +26,9 @@ ch_group = "parietal"
 psd_params = dict(fmin=0, fmax=30, n_fft=128)
 ch_type = "grad"
 
-X, meta, times, info = assemble_epochs_new(ch_type=ch_type)
+X, meta, times, info = load_epoch_store(
+    ch_type, "answer", baseline=(-0.2, 0)
+)
 
 df, psd, freqs = prepare_psd(
     times, time_win, ch_group, meta, X, freq_band, info, psd_params
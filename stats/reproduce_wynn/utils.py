@@ -116,7 +116,9 @@ def _get_masks(times, t_lo, t_hi, ch_group, info):
 
 
 if __name__ == "__main__":
-    from metacog.dataset_specific_utils import assemble_epochs_new
+    from metacog.epoch_store import load_epoch_store
 
-    X, meta, times, info = assemble_epochs_new()
+    X, meta, times, info = load_epoch_store(
+        "grad", "answer", baseline=(-0.2, 0)
+    )
     df, data = prepare_erp(times, (0.4, 0.8), "parietal", meta, X, info)
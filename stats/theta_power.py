@@ -3,7 +3,6 @@ import matplotlib.pyplot as plt
 from mne import EpochsArray, pick_types
 from mne.io import read_info
 from mne import set_log_level
-from mne.stats import spatio_temporal_cluster_test
 from mne.channels import find_ch_adjacency
 from mne.time_frequency import psd_multitaper
 from mne.channels.layout import _merge_ch_data
@@ -13,6 +12,7 @@ from mne.viz.topomap import (
     _prepare_topomap_plot,
     _make_head_outlines,
 )
+from metacog.cluster_stats import spatio_temporal_cluster_test
 from metacog import bp
 from metacog.utils import plot_temporal_clusters
 from metacog.dataset_specific_utils import (
@@ -89,12 +89,11 @@ p_accept = 0.05
 # X_high = X[y == HIGH_CONF_EPOCH, ...].transpose(0, 2, 1)
 cluster_stats = spatio_temporal_cluster_test(
     [theta_power_low[:, np.newaxis, :], theta_power_high[:, np.newaxis, :]],
-    n_permutations=100,
+    n_permutations=1000,
     threshold=threshold,
     tail=1,
-    n_jobs=1,
-    buffer_size=None,
     adjacency=adjacency,
+    p_accept=p_accept,
 )
 
 T_obs, clusters, p_values, _ = cluster_stats
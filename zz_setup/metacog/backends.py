@@ -0,0 +1,543 @@
+"""
+Execution backends for the tasks in dodo.py
+
+All backends take the same `Pipeline`: tasks selected from dodo.py with
+dependencies resolved by doit (task_dep and file_dep -> targets) and checked
+against doit's dependency database. Backends differ only in where the tasks
+run:
+
+- `SerialBackend` runs one task at a time in this process
+- `ProcessPoolBackend` runs tasks on a memory-aware pool of forked workers
+  (see metacog.scheduler)
+- `JobArrayBackend` writes a job array script per pipeline stage, a
+  submission script and a dependency manifest for a batch scheduler (SLURM),
+  so fan-out stages like apply_maxfilter or compute_tfr_epochs run on many
+  nodes at once
+
+`LocalJobArrayRunner` runs emitted job arrays stage by stage on the local
+machine instead of the batch scheduler, e.g. to test the scripts.
+
+Usage (from the folder with dodo.py)::
+
+    python -m metacog.backends run [task ...] --backend serial|pool|job-array
+    python -m metacog.backends run-local <manifest>
+
+Job array elements call ``exec`` and the last job calls ``collect`` to save
+results of the array jobs to doit database.
+
+"""
+from argparse import ArgumentParser
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from metacog.config_parser import cfg
+from metacog.ledger import RUN_ID_VAR
+from metacog.paths import dirs
+from metacog.scheduler import (
+    get_budget,
+    load_dodo_tasks,
+    make_jobs,
+    run_jobs,
+    select_tasks,
+)
+
+_tasks = {}
+
+
+class Pipeline:
+    """
+    Selected tasks from dodo file together with doit dependency database
+
+    Parameters
+    ----------
+    selected : list of str
+        tasks to run; all tasks they depend on are included. Defaults to
+        DOIT_CONFIG["default_tasks"] or all tasks.
+    dodo_path : str | Path
+        path to dodo file; current directory is changed to its folder
+
+    """
+
+    def __init__(self, selected=(), dodo_path="dodo.py"):
+        self.dodo_path = Path(dodo_path).resolve()
+        self.tasks, self.doit_config = load_dodo_tasks(str(self.dodo_path))
+        selected = (
+            selected
+            or self.doit_config.get("default_tasks")
+            or list(self.tasks)
+        )
+        self.jobs = make_jobs(self.tasks, select_tasks(self.tasks, selected))
+        self._dep_manager = None
+        _tasks.clear()
+        _tasks.update(self.tasks)
+
+    @property
+    def dep_manager(self):
+        if self._dep_manager is None:
+            from doit.dependency import DbmDB, Dependency, MD5Checker
+
+            self._dep_manager = Dependency(
+                DbmDB,
+                self.doit_config.get("dep_file", ".doit.db"),
+                checker_cls=self.doit_config.get(
+                    "check_file_uptodate", MD5Checker
+                ),
+            )
+        return self._dep_manager
+
+    def close(self):
+        if self._dep_manager is not None:
+            self._dep_manager.close()
+            self._dep_manager = None
+
+    def get_status(self, name):
+        """doit status of the task: "up-to-date", "run" or "error" """
+        return self.dep_manager.get_status(self.tasks[name], self.tasks).status
+
+    def skip(self, name):
+        """Check if task can be skipped; to be called when its deps are done"""
+        task = self.tasks[name]
+        if self.get_status(name) == "up-to-date":
+            print(f"-- {name}")
+            task.values = self.dep_manager.get_values(name)
+            return True
+        if not task.actions:
+            self.save_success(name, {}, None)
+            return True
+        print(f".  {name}")
+        return False
+
+    def save_success(self, name, values, result):
+        task = self.tasks[name]
+        task.values, task.result = values, result
+        task.save_extra_values()
+        self.dep_manager.save_success(task)
+
+    def on_done(self, name, result):
+        if isinstance(result, Exception):
+            print(f"ERROR: task {name} failed:\n{result}")
+        else:
+            self.save_success(name, *result)
+
+
+def execute_task(job):
+    """Execute doit task of the job; returns (values, result)"""
+    from doit.task import Stream
+
+    task = _tasks[job.name]
+    threads = str(max(job.threads, 1))
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = threads  # for command actions
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        failure = task.execute(Stream(0))
+    else:
+        with threadpool_limits(limits=int(threads)):
+            failure = task.execute(Stream(0))
+    if failure is not None:
+        raise RuntimeError(failure.get_msg())
+    return task.values, task.result
+
+
+class SerialExecutor(Executor):
+    """Executor running submitted calls immediately in this process"""
+
+    def submit(self, fn, *pargs, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*pargs, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+def _report(failed):
+    for name in failed:
+        print(f"FAILED: {name}")
+    return not failed
+
+
+class SerialBackend:
+    """Run tasks one by one in this process"""
+
+    def run(self, pipeline):
+        try:
+            failed = run_jobs(
+                pipeline.jobs,
+                SerialExecutor(),
+                execute_task,
+                float("inf"),
+                1,
+                skip=pipeline.skip,
+                on_done=pipeline.on_done,
+            )
+        finally:
+            pipeline.close()
+        return _report(failed)
+
+
+class ProcessPoolBackend:
+    """
+    Run tasks on a pool of forked workers under memory and cores budget
+
+    Parameters
+    ----------
+    mem_budget_gb : float | None
+        memory for tasks running at once; see `metacog.scheduler.get_budget`
+    n_cores : int | None
+        cores for tasks running at once; also the number of workers
+
+    """
+
+    def __init__(self, mem_budget_gb=None, n_cores=None):
+        self.mem_budget_gb, self.n_cores = get_budget(mem_budget_gb, n_cores)
+
+    def run(self, pipeline):
+        # fork: workers inherit loaded tasks and the imported stack
+        context = multiprocessing.get_context("fork")
+        try:
+            with ProcessPoolExecutor(self.n_cores, mp_context=context) as ex:
+                failed = run_jobs(
+                    pipeline.jobs,
+                    ex,
+                    execute_task,
+                    self.mem_budget_gb,
+                    self.n_cores,
+                    skip=pipeline.skip,
+                    on_done=pipeline.on_done,
+                )
+        finally:
+            pipeline.close()
+        return _report(failed)
+
+
+STAGE_TEMPLATE = """#!/bin/bash
+#SBATCH --job-name=metacog-{stage}
+#SBATCH --array=0-{last_index}
+#SBATCH --mem={mem_mb}M
+#SBATCH --cpus-per-task={threads}
+#SBATCH --output={log_dir}/{stage}-%a.out
+{options}
+cd {dodo_dir}
+{python} -m metacog.backends exec {manifest} {stage} "$SLURM_ARRAY_TASK_ID"
+"""
+
+COLLECT_TEMPLATE = """#!/bin/bash
+#SBATCH --job-name=metacog-collect
+#SBATCH --output={log_dir}/collect.out
+cd {dodo_dir}
+{python} -m metacog.backends collect {manifest}
+"""
+
+
+class JobArrayBackend:
+    """
+    Write job array scripts and dependency manifest for out-of-date tasks
+
+    Tasks are grouped into stages by task name (e.g. all apply_maxfilter
+    subtasks) and depth in the dependency graph; each stage becomes one job
+    array which starts after all stages it depends on succeed. A task is
+    included if doit considers it out-of-date or if any task it depends on
+    is included.
+
+    Parameters
+    ----------
+    out_dir : str | Path
+        folder for the scripts, manifest.json, logs and task statuses
+
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir).resolve()
+
+    def run(self, pipeline):
+        manifest = self.emit(pipeline)
+        print(f"Submit with: bash {self.out_dir / 'submit.sh'}")
+        print(
+            "Run locally with: python -m metacog.backends run-local",
+            manifest,
+        )
+        return True
+
+    def emit(self, pipeline):
+        """Write scripts and manifest; returns path to manifest"""
+        try:
+            stages, task_stage = self._make_stages(pipeline)
+        finally:
+            pipeline.close()
+
+        log_dir = self.out_dir / "logs"
+        log_dir.mkdir(exist_ok=True, parents=True)
+        (self.out_dir / "status").mkdir(exist_ok=True)
+        manifest_path = self.out_dir / "manifest.json"
+        python = cfg.job_array_config["python"] or sys.executable
+        fmt = dict(
+            log_dir=log_dir,
+            dodo_dir=pipeline.dodo_path.parent,
+            python=python,
+            manifest=manifest_path,
+        )
+        options = "\n".join(
+            f"#SBATCH {o}" for o in cfg.job_array_config["sbatch_options"]
+        )
+
+        submit = [
+            "#!/bin/bash",
+            "set -e",
+            f"cd {self.out_dir}",
+            # all jobs of the submission share one run id in the ledger
+            f"export {RUN_ID_VAR}=$(date +%Y%m%dT%H%M%S)-$$",
+        ]
+        for i, stage in enumerate(stages):
+            stage["script"] = str(self.out_dir / f"{stage['name']}.sh")
+            with open(stage["script"], "w") as f:
+                f.write(
+                    STAGE_TEMPLATE.format(
+                        stage=stage["name"],
+                        last_index=len(stage["tasks"]) - 1,
+                        mem_mb=max(int(stage["mem_gb"] * 1024), 1),
+                        threads=max(stage["threads"], 1),
+                        options=options,
+                        **fmt,
+                    )
+                )
+            dep_ids = ":".join(
+                f"$jid_{stages_index}"
+                for stages_index, s in enumerate(stages)
+                if s["name"] in stage["deps"]
+            )
+            dependency = f" --dependency=afterok:{dep_ids}" if dep_ids else ""
+            submit.append(
+                f"jid_{i}=$(sbatch --parsable{dependency} {stage['script']})"
+            )
+
+        collect_script = self.out_dir / "collect.sh"
+        with open(collect_script, "w") as f:
+            f.write(COLLECT_TEMPLATE.format(**fmt))
+        all_ids = ":".join(f"$jid_{i}" for i in range(len(stages)))
+        dependency = f" --dependency=afterany:{all_ids}" if all_ids else ""
+        submit.append(f"sbatch{dependency} {collect_script}")
+        with open(self.out_dir / "submit.sh", "w") as f:
+            f.write("\n".join(submit) + "\n")
+
+        manifest = dict(
+            dodo=str(pipeline.dodo_path),
+            stages=stages,
+            tasks=task_stage,
+            collect_script=str(collect_script),
+        )
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest_path
+
+    def _make_stages(self, pipeline):
+        tasks, jobs = pipeline.tasks, pipeline.jobs
+
+        def action_deps(name):
+            # dependencies through group tasks which have no actions
+            res = set()
+            for dep in jobs[name].deps:
+                res |= {dep} if tasks[dep].actions else action_deps(dep)
+            return res
+
+        to_run, level = {}, {}
+
+        def visit(name):
+            if name in level:
+                return
+            deps = action_deps(name)
+            for dep in deps:
+                visit(dep)
+            deps = {d for d in deps if to_run[d]}
+            if deps:
+                to_run[name] = True
+            else:
+                status = pipeline.get_status(name)
+                if status == "error":
+                    print(f"WARNING: checking {name} failed; scheduling it")
+                to_run[name] = status != "up-to-date"
+            level[name] = 1 + max((level[d] for d in deps), default=-1)
+
+        action_tasks = sorted(n for n in jobs if tasks[n].actions)
+        for name in action_tasks:
+            visit(name)
+
+        stages, task_stage = {}, {}
+        for name in action_tasks:
+            if not to_run[name]:
+                continue
+            stage_name = f"{level[name]:02d}-{name.split(':')[0]}"
+            stage = stages.setdefault(
+                stage_name,
+                dict(
+                    name=stage_name,
+                    tasks=[],
+                    deps=set(),
+                    mem_gb=0.0,
+                    threads=0,
+                ),
+            )
+            task_stage[name] = dict(
+                stage=stage_name,
+                index=len(stage["tasks"]),
+                deps=sorted(d for d in action_deps(name) if to_run[d]),
+            )
+            stage["tasks"].append(name)
+            stage["mem_gb"] = max(stage["mem_gb"], jobs[name].mem_gb)
+            stage["threads"] = max(stage["threads"], jobs[name].threads)
+
+        for name, info in task_stage.items():
+            stages[info["stage"]]["deps"] |= {
+                task_stage[d]["stage"] for d in info["deps"]
+            }
+        stages = [stages[k] for k in sorted(stages)]
+        for stage in stages:
+            stage["deps"] = sorted(stage["deps"])
+        return stages, task_stage
+
+
+def read_manifest(manifest_path):
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _status_path(manifest_path, stage, index):
+    return Path(manifest_path).parent / "status" / f"{stage}-{index}.json"
+
+
+def exec_array_task(manifest_path, stage_name, index):
+    """Execute one job array element; status is saved for `collect`"""
+    manifest = read_manifest(manifest_path)
+    (stage,) = [s for s in manifest["stages"] if s["name"] == stage_name]
+    name = stage["tasks"][int(index)]
+    pipeline = Pipeline([name], manifest["dodo"])
+    status = dict(task=name)
+    try:
+        values, _ = execute_task(pipeline.jobs[name])
+    except Exception as exc:
+        status.update(ok=False, error=str(exc))
+    else:
+        status.update(ok=True, values=values)
+    with open(_status_path(manifest_path, stage_name, index), "w") as f:
+        json.dump(status, f)
+    if not status["ok"]:
+        print(f"ERROR: task {name} failed:\n{status['error']}")
+    return status["ok"]
+
+
+def collect(manifest_path):
+    """Save successful job array tasks to doit database"""
+    manifest = read_manifest(manifest_path)
+    pipeline = Pipeline(list(manifest["tasks"]), manifest["dodo"])
+    n_ok = 0
+    try:
+        for name, info in manifest["tasks"].items():
+            path = _status_path(manifest_path, info["stage"], info["index"])
+            if not path.exists():
+                continue
+            with open(path, "r") as f:
+                status = json.load(f)
+            if status["ok"]:
+                # computes values saved along, e.g. by config_changed
+                pipeline.get_status(name)
+                pipeline.save_success(name, status["values"], None)
+                n_ok += 1
+    finally:
+        pipeline.close()
+    print(f"Collected {n_ok} of {len(manifest['tasks'])} tasks")
+    return n_ok == len(manifest["tasks"])
+
+
+class LocalJobArrayRunner:
+    """
+    Run job arrays emitted by `JobArrayBackend` on the local machine
+
+    Stands in for the batch scheduler: runs the stage scripts in dependency
+    order with SLURM_ARRAY_TASK_ID set for each array element, skips stages
+    whose dependencies failed and finally runs the collect script.
+
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+
+    def run(self):
+        manifest = read_manifest(self.manifest_path)
+        failed = set()
+        for stage in manifest["stages"]:
+            if failed & set(stage["deps"]):
+                print(f"SKIPPED: {stage['name']}")
+                failed.add(stage["name"])
+                continue
+            for index in range(len(stage["tasks"])):
+                env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(index))
+                res = subprocess.run(["bash", stage["script"]], env=env)
+                if res.returncode:
+                    failed.add(stage["name"])
+        subprocess.run(["bash", manifest["collect_script"]])
+        return _report(sorted(failed))
+
+
+def get_backend(name, out_dir=None, mem_budget_gb=None, n_cores=None):
+    if name == "serial":
+        return SerialBackend()
+    elif name == "pool":
+        return ProcessPoolBackend(mem_budget_gb, n_cores)
+    elif name == "job-array":
+        out_dir = (
+            out_dir
+            or cfg.job_array_config["out_dir"]
+            or dirs.derivatives / "job_arrays"
+        )
+        return JobArrayBackend(out_dir)
+    raise ValueError(f"Unknown backend: {name}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run tasks")
+    run_parser.add_argument("tasks", nargs="*", help="tasks to run")
+    run_parser.add_argument(
+        "--backend", choices=["serial", "pool", "job-array"], default="pool"
+    )
+    run_parser.add_argument("--dodo", default="dodo.py")
+    run_parser.add_argument("--out-dir", help="job array scripts folder")
+    run_parser.add_argument("--mem-gb", type=float, help="pool memory, GB")
+    run_parser.add_argument("--cores", type=int, help="pool cores")
+
+    exec_parser = subparsers.add_parser("exec", help="run job array element")
+    exec_parser.add_argument("manifest")
+    exec_parser.add_argument("stage")
+    exec_parser.add_argument("index", type=int)
+
+    collect_parser = subparsers.add_parser(
+        "collect", help="save job array results to doit db"
+    )
+    collect_parser.add_argument("manifest")
+
+    local_parser = subparsers.add_parser(
+        "run-local", help="run emitted job arrays locally"
+    )
+    local_parser.add_argument("manifest")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        backend = get_backend(
+            args.backend, args.out_dir, args.mem_gb, args.cores
+        )
+        ok = backend.run(Pipeline(args.tasks, args.dodo))
+    elif args.command == "exec":
+        ok = exec_array_task(args.manifest, args.stage, args.index)
+    elif args.command == "collect":
+        ok = collect(args.manifest)
+    else:
+        ok = LocalJobArrayRunner(args.manifest).run()
+    raise SystemExit(0 if ok else 1)
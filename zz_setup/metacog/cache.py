@@ -0,0 +1,342 @@
+"""
+Cache of function results keyed by arguments, input files and config
+
+Group-level loaders read the same epochs, TFRs and source estimates over and
+over. Decorating them with `cached` stores their results in
+derivatives/cache/results. The cache key covers:
+
+- the source of the module defining the function, so that edits of helpers
+  it calls from the same module recompute results, and its arguments
+- ``version``, to bump after editing helpers in other modules
+- fingerprints of the input files returned by ``inputs(**arguments)``
+  (see `metacog.fingerprint`), so results are recomputed after re-epoching
+- values of the configuration entries named in ``config``
+
+Entries are evicted least recently used first when the cache grows beyond
+``cfg.result_cache_config["quota_gb"]``; a result larger than the quota is
+not cached. Hits, misses and sizes are kept in
+derivatives/cache/results.sqlite::
+
+    python -m metacog.cache stats
+    python -m metacog.cache clear [--func <name>]
+
+"""
+from argparse import ArgumentParser
+from functools import wraps
+import hashlib
+import inspect
+import os
+from pathlib import Path
+import sqlite3
+import time
+import warnings
+
+from metacog.config_parser import cfg
+from metacog.fingerprint import get_cache
+from metacog.paths import dirs
+
+
+def _input_files(paths):
+    """Files of paths; folders are expanded to all files inside"""
+    for path in map(Path, paths):
+        if path.is_dir():
+            for dirpath, _, filenames in sorted(os.walk(path)):
+                for name in sorted(filenames):
+                    yield Path(dirpath, name)
+        else:
+            yield path
+
+
+def _code_hash(func):
+    """Hash of the source of func's module, or of func if not available"""
+    try:
+        code = inspect.getsource(inspect.getmodule(func))
+    except (OSError, TypeError):
+        try:
+            code = inspect.getsource(func)
+        except (OSError, TypeError):
+            code = func.__code__.co_code.hex()
+    return hashlib.sha1(code.encode()).hexdigest()
+
+
+class _QuotaExceeded(Exception):
+    pass
+
+
+class _LimitedWriter:
+    """File wrapper raising _QuotaExceeded once limit bytes are exceeded"""
+
+    def __init__(self, file, limit):
+        self._file = file
+        self.limit = limit
+        self.size = 0
+
+    def write(self, data):
+        self.size += memoryview(data).nbytes
+        if self.limit is not None and self.size > self.limit:
+            raise _QuotaExceeded
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class ResultCache:
+    """
+    Size-bounded store of pickled function results
+
+    Parameters
+    ----------
+    location : str | Path
+        folder for results; the index is kept next to it
+    quota_gb : float | None
+        total size of results above which least recently used entries are
+        evicted; None for no limit
+
+    """
+
+    def __init__(self, location, quota_gb=None):
+        self.location = Path(location)
+        self.db_path = self.location.with_suffix(".sqlite")
+        self.quota_gb = quota_gb
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # sqlite connections must not be shared by forked workers
+        if self._conn is None or self._pid != os.getpid():
+            self.location.mkdir(exist_ok=True, parents=True)
+            self._conn = sqlite3.connect(str(self.db_path), timeout=60)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, func TEXT, size INTEGER,"
+                " created REAL, last_access REAL, hits INTEGER)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS calls ("
+                "func TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)"
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def path(self, key):
+        return self.location / key[:2] / f"{key}.pkl"
+
+    def key(self, func_id, code, arguments, input_paths=(), config=()):
+        """Hash of function, arguments, input fingerprints and config"""
+        import joblib
+
+        fingerprints = []
+        for path in _input_files(input_paths):
+            try:
+                digest = get_cache().digest(path)
+            except FileNotFoundError:
+                digest = None
+            fingerprints.append((str(path), digest))
+        config_values = {name: getattr(cfg, name) for name in config}
+        return joblib.hash(
+            (func_id, code, arguments, fingerprints, config_values)
+        )
+
+    def get(self, key, func_id):
+        """Load stored result; returns (True, result) or (False, None)"""
+        import joblib
+
+        path = self.path(key)
+        found = path.exists()
+        if found:
+            try:
+                result = joblib.load(path)
+            except (EOFError, OSError, ValueError):
+                found = False
+        with self.conn:
+            if found:
+                self.conn.execute(
+                    "UPDATE entries SET last_access = ?, hits = hits + 1"
+                    " WHERE key = ?",
+                    (time.time(), key),
+                )
+            self._count(func_id, hit=found)
+        return (True, result) if found else (False, None)
+
+    def set(self, key, func_id, result):
+        """
+        Store result and evict old entries if over quota
+
+        A result larger than the quota is not stored: writing it stops as
+        soon as it exceeds the quota, and a warning is issued.
+
+        """
+        import joblib
+
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        limit = None if self.quota_gb is None else self.quota_gb * 1024 ** 3
+        try:
+            with open(tmp, "wb") as f:
+                joblib.dump(result, _LimitedWriter(f, limit))
+        except _QuotaExceeded:
+            tmp.unlink()
+            warnings.warn(
+                f"Result of {func_id} is larger than the cache quota of"
+                f" {self.quota_gb} GB and is not cached"
+            )
+            return
+        os.replace(tmp, path)
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, 0)",
+                (key, func_id, path.stat().st_size, now, now),
+            )
+        self.evict()
+
+    def _count(self, func_id, hit):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO calls VALUES (?, 0, 0)", (func_id,)
+        )
+        column = "hits" if hit else "misses"
+        self.conn.execute(
+            f"UPDATE calls SET {column} = {column} + 1 WHERE func = ?",
+            (func_id,),
+        )
+
+    def evict(self, quota_gb=None):
+        """Remove least recently used entries until total size fits quota"""
+        quota_gb = self.quota_gb if quota_gb is None else quota_gb
+        if quota_gb is None:
+            return []
+        quota = quota_gb * 1024 ** 3
+        rows = self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access DESC"
+        ).fetchall()
+        total, evicted = 0, []
+        for key, size in rows:
+            total += size
+            if total > quota:
+                evicted.append(key)
+        self._remove(evicted)
+        return evicted
+
+    def clear(self, func_id=None):
+        """Remove all entries, or entries of one function"""
+        query = "SELECT key FROM entries"
+        params = ()
+        if func_id is not None:
+            query += " WHERE func = ?"
+            params = (func_id,)
+        keys = [r[0] for r in self.conn.execute(query, params)]
+        self._remove(keys)
+        return keys
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                self.path(key).unlink()
+            except FileNotFoundError:
+                pass
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM entries WHERE key = ?", [(k,) for k in keys]
+            )
+
+    def stats(self):
+        """Hits, misses, number of entries and size in MB by function"""
+        res = {
+            func: dict(hits=hits, misses=misses, n_entries=0, size_mb=0.0)
+            for func, hits, misses in self.conn.execute("SELECT * FROM calls")
+        }
+        for func, n_entries, size in self.conn.execute(
+            "SELECT func, COUNT(*), SUM(size) FROM entries GROUP BY func"
+        ):
+            res.setdefault(func, dict(hits=0, misses=0))
+            res[func].update(n_entries=n_entries, size_mb=size / 1024 ** 2)
+        return res
+
+
+_cache = None
+
+
+def get_result_cache():
+    """Result cache shared by all loaders, located in derivatives"""
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(
+            dirs.cache / "results", cfg.result_cache_config["quota_gb"]
+        )
+    return _cache
+
+
+def cached(inputs=None, config=(), ignore=(), version=None):
+    """
+    Decorator caching function results in the shared result cache
+
+    Parameters
+    ----------
+    inputs : callable | None
+        called with the function arguments (defaults applied) as keywords;
+        returns files or folders the result depends on
+    config : list of str
+        names of configuration entries (see config.py) the result depends on
+    ignore : list of str
+        arguments not affecting the result, e.g. n_jobs
+    version : str | int | None
+        part of the key; change it after editing helpers the function calls
+        from other modules (edits of its own module are detected)
+
+    Notes
+    -----
+    The undecorated function is available as ``func.func``.
+
+    """
+
+    def decorator(func):
+        module = func.__module__
+        if module == "__main__":
+            module = Path(inspect.getfile(func)).stem
+        func_id = f"{module}.{func.__qualname__}"
+        code = (_code_hash(func), version)
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                k: v for k, v in bound.arguments.items() if k not in ignore
+            }
+            input_paths = inputs(**bound.arguments) if inputs else ()
+            cache = get_result_cache()
+            key = cache.key(func_id, code, arguments, input_paths, config)
+            found, result = cache.get(key, func_id)
+            if not found:
+                result = func(*args, **kwargs)
+                cache.set(key, func_id, result)
+            return result
+
+        wrapper.func = func
+        return wrapper
+
+    return decorator
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="hits, misses and size by function")
+    clear_parser = subparsers.add_parser("clear", help="remove entries")
+    clear_parser.add_argument("--func", help="only entries of this function")
+    args = parser.parse_args()
+
+    cache = get_result_cache()
+    if args.command == "stats":
+        print(f"{'function':<60} {'hits':>6} {'misses':>6} {'n':>4} {'MB':>9}")
+        for func, s in sorted(cache.stats().items()):
+            print(
+                f"{func:<60} {s['hits']:>6} {s['misses']:>6}"
+                f" {s['n_entries']:>4} {s['size_mb']:>9.1f}"
+            )
+    else:
+        print(f"Removed {len(cache.clear(args.func))} entries")
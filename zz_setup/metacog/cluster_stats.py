@@ -0,0 +1,957 @@
+"""
+Cluster-level permutation tests evaluating permutations in blocks
+
+`mne.stats.spatio_temporal_cluster_test` shuffles the data, computes the
+statistic and clusters it one permutation at a time, so thousands of
+permutations of single-trial data (thousands of epochs x 204 channels x 1001
+times) take hours. `spatio_temporal_cluster_test` here returns the same
+``(T_obs, clusters, p_values, H0)``, but
+
+- only group sums change between permutations, so the F or t statistic of a
+  block of permutations is one product of group indicators and the data
+- the spatio-temporal graph is built once, and supra-threshold points of all
+  permutations of a block are labelled with one connected_components call
+- blocks run on forked worker processes sharing the data
+
+With the same seed, permutations are the ones mne draws.
+
+With ``p_accept``, tests run sequentially: blocks stop once the confidence
+interval of every cluster's p-value is on one side of p_accept, and
+n_permutations only caps the run.
+
+`spatio_temporal_cluster_correlation_test` tests the correlation of the data
+with a continuous predictor such as confidence the same way: correlations of
+all points with a block of within-subject permutations of the predictor are
+one product of the standardized predictor and data.
+
+`spatio_temporal_cluster_lmm_test` (cluster-LME) clusters z values of a fixed
+effect of random-intercept mixed models (`metacog.lmm`), permuting trial
+labels within subjects; permuted fits reuse the observed fit.
+
+The number of workers and the block size are set in ``cfg.cluster_config``.
+
+"""
+from functools import partial
+import multiprocessing as mp
+
+import numpy as np
+
+# data shared with forked workers
+_shared = {}
+
+
+def cluster_graph(adjacency, n_times, max_step=1):
+    """
+    Edges of the graph of spatio-temporal points
+
+    Points are flattened in (time, space) order, as the tests of
+    spatio-temporal data of shape (n_times, n_space).
+
+    Parameters
+    ----------
+    adjacency : scipy.sparse matrix, shape (n_space, n_space)
+        spatial neighbours
+    n_times : int
+    max_step : int
+        points of the same spatial index up to max_step samples apart are
+        connected
+
+    Returns
+    -------
+    row, col : array, shape (n_edges,)
+        points connected by each edge, each edge listed once
+
+    """
+    from scipy import sparse
+
+    adjacency = sparse.coo_matrix(adjacency)
+    n_space = adjacency.shape[0]
+    adjacency = sparse.coo_matrix(adjacency + adjacency.T)
+    upper = adjacency.row < adjacency.col
+    offsets = np.arange(n_times)[:, np.newaxis] * n_space
+    rows = [(offsets + adjacency.row[upper]).ravel()]
+    cols = [(offsets + adjacency.col[upper]).ravel()]
+    for step in range(1, max_step + 1):
+        points = np.arange(max(n_times - step, 0) * n_space)
+        rows.append(points)
+        cols.append(points + step * n_space)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def _label_clusters(mask, graph):
+    """
+    Connected components of supra-threshold points of each row of mask
+
+    Returns
+    -------
+    idx : array
+        flat indices of the points of mask, in (row, point) order
+    labels : array
+        component of each point of idx; components never span rows
+    n_labels : int
+
+    """
+    from scipy import sparse
+    from scipy.sparse.csgraph import connected_components
+
+    row, col = graph
+    n_rows, n_points = mask.shape
+    flat = mask.ravel()
+    idx = np.flatnonzero(flat)
+    if not len(idx):
+        return idx, idx, 0
+    # position of each point among supra-threshold points
+    pos = np.cumsum(flat) - 1
+    i_row, i_edge = np.nonzero(mask[:, row] & mask[:, col])
+    offsets = i_row * n_points
+    edges = sparse.coo_matrix(
+        (
+            np.ones(len(i_edge), dtype=bool),
+            (pos[offsets + row[i_edge]], pos[offsets + col[i_edge]]),
+        ),
+        shape=(len(idx), len(idx)),
+    )
+    n_labels, labels = connected_components(edges, directed=False)
+    return idx, labels, n_labels
+
+
+def _tail_signs(tail):
+    return {0: (1, -1), 1: (1,), -1: (-1,)}[tail]
+
+
+def find_clusters(stat, threshold, tail, graph, t_power=1):
+    """
+    Clusters of a statistic over the spatio-temporal graph
+
+    Parameters
+    ----------
+    stat : array, shape (n_points,)
+    threshold : float
+        cluster forming threshold; negative for tail == -1
+    tail : -1 | 0 | 1
+        clusters of stat below -|threshold|, above |threshold| or both
+    graph : tuple of array
+        see `cluster_graph`
+    t_power : float
+        power of the statistic summed over cluster points, sign retained
+
+    Returns
+    -------
+    clusters : list of array
+        flat indices of cluster points, positive clusters first
+    sums : array, shape (n_clusters,)
+
+    """
+    clusters, sums = [], []
+    for sign in _tail_signs(tail):
+        x = sign * stat
+        idx, labels, n_labels = _label_clusters(
+            (x > abs(threshold))[np.newaxis], graph
+        )
+        if not n_labels:
+            continue
+        order = np.argsort(labels, kind="stable")
+        bounds = np.cumsum(np.bincount(labels, minlength=n_labels))[:-1]
+        clusters += np.split(idx[order], bounds)
+        weights = x[idx] ** t_power
+        sums.append(sign * np.bincount(labels, weights, minlength=n_labels))
+    return clusters, np.concatenate(sums) if sums else np.array([])
+
+
+def max_cluster_sums(stats, threshold, tail, graph, t_power=1):
+    """
+    Largest cluster sum of each row of stats, for the H0 distribution
+
+    Parameters
+    ----------
+    stats : array, shape (n_permutations, n_points)
+    threshold, tail, graph, t_power
+        see `find_clusters`
+
+    Returns
+    -------
+    array, shape (n_permutations,)
+        largest cluster sum, smallest for tail == -1, largest absolute for
+        tail == 0; 0 if there are no clusters
+
+    """
+    n_perms, n_points = stats.shape
+    out = np.zeros(n_perms)
+    for sign in _tail_signs(tail):
+        x = sign * stats
+        idx, labels, n_labels = _label_clusters(x > abs(threshold), graph)
+        weights = x.ravel()[idx] ** t_power
+        sums = np.bincount(labels, weights, minlength=n_labels)
+        perm = np.empty(n_labels, dtype=int)
+        perm[labels] = idx // n_points
+        np.maximum.at(out, perm, sums)
+    return -out if tail == -1 else out
+
+
+def count_extreme(sums, H0, tail):
+    """Number of H0 values at least as extreme as each cluster sum"""
+    if tail == -1:
+        return (H0 <= sums[:, np.newaxis]).sum(axis=1)
+    if tail == 1:
+        return (H0 >= sums[:, np.newaxis]).sum(axis=1)
+    return (np.abs(H0) >= np.abs(sums)[:, np.newaxis]).sum(axis=1)
+
+
+def pvalues_from_h0(sums, H0, tail):
+    """Fraction of H0 at least as extreme as each cluster sum"""
+    return count_extreme(sums, H0, tail) / len(H0)
+
+
+def pvalue_interval(counts, n, level):
+    """Clopper-Pearson interval of p-values estimated as counts / n"""
+    from scipy import stats
+
+    alpha = 1 - level
+    with np.errstate(invalid="ignore"):
+        lower = stats.beta.ppf(alpha / 2, counts, n - counts + 1)
+        upper = stats.beta.ppf(1 - alpha / 2, counts + 1, n - counts)
+    lower = np.where(counts == 0, 0.0, lower)
+    upper = np.where(counts == n, 1.0, upper)
+    return lower, upper
+
+
+class SequentialStop:
+    """
+    Stop permutations once every cluster is settled at p_accept
+
+    Called by `run_blocks` with the H0 of each block in order. Counts of
+    permutations at least as extreme as each observed cluster accumulate,
+    and permutations stop once the confidence interval of every cluster's
+    p-value lies either below or above p_accept.
+
+    Parameters
+    ----------
+    sums : array, shape (n_clusters,)
+        observed cluster sums
+    observed : float
+        H0 value of the observed order
+    tail : -1 | 0 | 1
+    p_accept : float
+    level : float
+        confidence level of the p-value intervals
+
+    """
+
+    def __init__(self, sums, observed, tail, p_accept, level):
+        self.sums = sums
+        self.tail = tail
+        self.p_accept = p_accept
+        self.level = level
+        self.counts = count_extreme(sums, np.array([observed]), tail)
+        self.n = 1
+
+    def __call__(self, H0):
+        self.counts = self.counts + count_extreme(self.sums, H0, self.tail)
+        self.n += len(H0)
+        lower, upper = pvalue_interval(self.counts, self.n, self.level)
+        return bool(np.all((upper < self.p_accept) | (lower > self.p_accept)))
+
+
+def run_blocks(
+    func, blocks, n_blocks, n_jobs, shared, desc="Permutations", stop=None
+):
+    """
+    Apply func to each block, in forked worker processes if n_jobs > 1
+
+    Arrays in `shared` are inherited by the workers without being copied,
+    and are available to func as ``_shared[key]``.
+
+    Parameters
+    ----------
+    stop : callable | None
+        called with each result in order of blocks; remaining blocks are
+        dropped once it returns True, e.g. `SequentialStop`
+
+    Returns
+    -------
+    list
+        results of func, in order of blocks
+
+    """
+    _shared.update(shared)
+    try:
+        if n_jobs > 1 and "fork" in mp.get_all_start_methods():
+            with mp.get_context("fork").Pool(n_jobs) as pool:
+                return _collect(pool.imap(func, blocks), n_blocks, desc, stop)
+        return _collect(map(func, blocks), n_blocks, desc, stop)
+    finally:
+        _shared.clear()
+
+
+def _collect(results, n_blocks, desc, stop):
+    from tqdm import tqdm
+
+    out = []
+    with tqdm(total=n_blocks, desc=desc) as pbar:
+        for result in results:
+            out.append(result)
+            pbar.update()
+            if stop is not None and stop(result):
+                break
+    return out
+
+
+def iter_blocks(items, block_size):
+    """Consecutive blocks of items, stacked"""
+    block = []
+    for item in items:
+        block.append(item)
+        if len(block) == block_size:
+            yield np.stack(block)
+            block = []
+    if block:
+        yield np.stack(block)
+
+
+def iter_shuffles(rng, n_obs, n_permutations, block_size):
+    """Blocks of permutations of all observations, drawn as mne draws them"""
+    orders = (rng.permutation(n_obs) for _ in range(n_permutations))
+    return iter_blocks(orders, block_size)
+
+
+def group_stats(X, ss_total, sizes, orders, stat="f"):
+    """
+    F or t statistic of groups of permuted observations
+
+    Parameters
+    ----------
+    X : array, shape (n_observations, n_points)
+        observations of all groups, centered on the grand mean
+    ss_total : array, shape (n_points,)
+        sum of squares of X
+    sizes : list of int
+        number of observations of each group
+    orders : array, shape (n_orders, n_observations)
+        permutations of observations; group g of order is
+        X[order[sum(sizes[:g]):sum(sizes[:g + 1])]]
+    stat : "f" | "t"
+        one-way ANOVA F as `mne.stats.f_oneway`, or for two groups
+        Student's t with pooled variance as `mne.stats.ttest_ind_no_p`
+
+    Returns
+    -------
+    array, shape (n_orders, n_points)
+
+    """
+    n_orders, n_obs = orders.shape
+    n_groups = len(sizes)
+    bounds = np.cumsum([0] + list(sizes))
+    # indicators of all groups but the last; X sums to 0 over observations,
+    # so the sum of the last group is minus the sum of the others
+    G = np.zeros((n_orders, n_groups - 1, n_obs), dtype=X.dtype)
+    for g in range(n_groups - 1):
+        members = orders[:, bounds[g]:bounds[g + 1]]
+        np.put_along_axis(G[:, g], members, 1, axis=1)
+    sums = (G.reshape(-1, n_obs) @ X).reshape(n_orders, n_groups - 1, -1)
+
+    ss_between = (sums ** 2 / np.reshape(sizes[:-1], (-1, 1))).sum(axis=1)
+    ss_between += sums.sum(axis=1) ** 2 / sizes[-1]
+    ss_within = ss_total - ss_between
+    if stat == "f":
+        df_between, df_within = n_groups - 1, n_obs - n_groups
+        return (ss_between / df_between) / (ss_within / df_within)
+    if stat == "t":
+        if n_groups != 2:
+            raise ValueError(f"t statistic needs 2 groups, got {n_groups}")
+        scale = 1 / sizes[0] + 1 / sizes[1]
+        var = ss_within / (n_obs - 2) * scale
+        return sums[:, 0] * scale / np.sqrt(var)
+    raise ValueError(f"stat must be 'f' or 't', got {stat!r}")
+
+
+def _group_block(orders):
+    s = _shared
+    stats = group_stats(s["X"], s["ss_total"], s["sizes"], orders, s["stat"])
+    return max_cluster_sums(
+        stats, s["threshold"], s["tail"], s["graph"], s["t_power"]
+    )
+
+
+def default_threshold(stat, sizes, tail, p=0.05):
+    """Cluster forming threshold at p, as mne's default"""
+    from scipy import stats
+
+    n_obs, n_groups = sum(sizes), len(sizes)
+    if stat == "f":
+        return stats.f.ppf(1 - p, n_groups - 1, n_obs - n_groups)
+    threshold = stats.t.ppf(1 - p / (1 + (tail == 0)), n_obs - 2)
+    return -threshold if tail == -1 else threshold
+
+
+def reshape_clusters(clusters, sample_shape, out_type):
+    """Flat cluster indices as index tuples or masks of sample_shape"""
+    if out_type == "indices":
+        return [np.unravel_index(c, sample_shape) for c in clusters]
+    masks = []
+    for c in clusters:
+        mask = np.zeros(int(np.prod(sample_shape)), dtype=bool)
+        mask[c] = True
+        masks.append(mask.reshape(sample_shape))
+    return masks
+
+
+def spatio_temporal_cluster_test(
+    X,
+    threshold=None,
+    n_permutations=1024,
+    tail=0,
+    stat="f",
+    adjacency=None,
+    n_jobs=None,
+    seed=None,
+    max_step=1,
+    t_power=1,
+    out_type="indices",
+    block_size=None,
+    p_accept=None,
+    save_path=None,
+):
+    """
+    Cluster-level permutation test of groups of spatio-temporal data
+
+    Same test as `mne.stats.spatio_temporal_cluster_test` with stat_fun
+    f_oneway (stat="f") or ttest_ind_no_p (stat="t"). Step-down, TFCE and
+    spatial_exclude are not supported.
+
+    Parameters
+    ----------
+    X : list of array, shape (n_observations, n_times, n_space)
+        observations of each group
+    threshold : float | None
+        cluster forming threshold; defaults to p < 0.05 of the statistic
+    n_permutations : int
+        number of permutations, including the observed order
+    tail : -1 | 0 | 1
+    stat : "f" | "t"
+    adjacency : scipy.sparse matrix, shape (n_space, n_space) | None
+        spatial neighbours, e.g. from `mne.channels.find_ch_adjacency`;
+        None connects consecutive spatial indices
+    n_jobs : int | None
+        number of worker processes; defaults to cfg.cluster_config["n_jobs"]
+    seed : int | None
+    max_step : int
+        see `cluster_graph`
+    t_power : float
+    out_type : "indices" | "mask"
+    block_size : int | None
+        permutations evaluated at once by a worker; defaults to
+        cfg.cluster_config["block_size"]
+    p_accept : float | None
+        sequential mode: stop drawing permutations once the
+        cfg.cluster_config["ci_level"] confidence interval of every
+        cluster's p-value lies below or above p_accept, so that decisions
+        at p_accept are settled; n_permutations is then the maximum
+    save_path : str | Path | None
+        path prefix of a results store and a checkpoint of the run, see
+        `metacog.cluster_store`; a rerun of the same test returns the
+        stored results, or resumes an interrupted run. seed must then be an
+        int (or None, resuming with the checkpointed RNG state)
+
+    Returns
+    -------
+    T_obs : array, shape (n_times, n_space)
+    clusters : list
+        (time_inds, space_inds) tuples, or boolean masks of T_obs shape
+    p_values : array, shape (n_clusters,)
+    H0 : array, shape (n_permutations,)
+        largest cluster sum of each permutation, the observed one first;
+        shorter if permutations stopped early
+
+    """
+    from mne.utils import check_random_state
+    from metacog.config_parser import cfg
+
+    n_jobs = n_jobs or cfg.cluster_config["n_jobs"]
+    block_size = block_size or cfg.cluster_config["block_size"]
+    sample_shape = X[0].shape[1:]
+    if any(x.shape[1:] != sample_shape for x in X):
+        raise ValueError("All groups must have the same sample shape")
+    sample_shape, graph = _setup_graph(sample_shape, adjacency, max_step)
+    sizes = [len(x) for x in X]
+    if threshold is None:
+        threshold = default_threshold(stat, sizes, tail)
+
+    X_full = np.concatenate([np.reshape(x, (len(x), -1)) for x in X])
+    X_full = X_full.astype(np.float64, copy=False)
+    X_full -= X_full.mean(axis=0)
+    ss_total = np.einsum("ij,ij->j", X_full, X_full)
+    n_obs = len(X_full)
+    observed_order = np.arange(n_obs)[np.newaxis]
+    T_obs = group_stats(X_full, ss_total, sizes, observed_order, stat)[0]
+
+    rng = check_random_state(seed)
+    shared = dict(
+        X=X_full, ss_total=ss_total, sizes=sizes, stat=stat,
+        threshold=threshold, tail=tail, graph=graph, t_power=t_power,
+    )
+    config = dict(
+        test="groups", stat=stat, sizes=sizes, seed=seed, max_step=max_step
+    )
+    return _permutation_test(
+        T_obs, sample_shape, shared, _group_block,
+        partial(iter_shuffles, rng, n_obs, block_size=block_size), rng,
+        config, n_permutations, block_size, n_jobs, out_type, p_accept,
+        save_path,
+    )
+
+
+def _setup_graph(sample_shape, adjacency, max_step):
+    """(n_times, n_space) sample shape and the graph of its points"""
+    from scipy import sparse
+
+    if len(sample_shape) == 1:
+        sample_shape = (1,) + sample_shape
+    n_times, n_space = sample_shape
+    if adjacency is None:
+        adjacency = sparse.eye(n_space, k=1)
+    if adjacency.shape != (n_space, n_space):
+        raise ValueError(
+            f"adjacency has shape {adjacency.shape}, data have {n_space}"
+            " spatial points"
+        )
+    return sample_shape, cluster_graph(adjacency, n_times, max_step)
+
+
+def _permutation_test(
+    T_obs, sample_shape, shared, block_func, draw_blocks, rng, config,
+    n_permutations, block_size, n_jobs, out_type, p_accept=None,
+    save_path=None,
+):
+    """
+    Observed clusters, H0 from blocks of permutations and p-values
+
+    draw_blocks(n) yields blocks of n permutations drawn with rng. With
+    save_path, runs are checkpointed and resumed, and end in a results store
+    (see `metacog.cluster_store`) keyed by config and the observed data.
+
+    """
+    from metacog.config_parser import cfg
+
+    threshold, tail = shared["threshold"], shared["tail"]
+    if tail not in (-1, 0, 1):
+        raise ValueError(f"tail must be -1, 0 or 1, got {tail}")
+    if out_type not in ("indices", "mask"):
+        raise ValueError(
+            f"out_type must be 'indices' or 'mask', got {out_type}"
+        )
+    clusters, sums = find_clusters(
+        T_obs, threshold, tail, shared["graph"], shared["t_power"]
+    )
+    T_obs = T_obs.reshape(sample_shape)
+
+    checkpoint = None
+    if save_path is not None:
+        from metacog import cluster_store as store
+
+        config = dict(
+            config, threshold=float(threshold), tail=tail,
+            t_power=shared["t_power"],
+        )
+        key = store.config_hash(config, T_obs, *shared["graph"])
+        config.update(n_permutations=n_permutations, p_accept=p_accept)
+        results_path, checkpoint_path = store.cluster_store_files(save_path)
+        results = None
+        if results_path.exists():
+            results = store.load_cluster_results(save_path)
+            if results.config_hash == key and results.config == config:
+                return results.as_tuple(out_type)
+        checkpoint = store.PermutationCheckpoint(
+            checkpoint_path, key, rng, cfg.cluster_config["checkpoint_s"],
+            results=results,
+        )
+    if not clusters:
+        H0 = np.array([])
+    else:
+        H0 = _run_permutations(
+            sums, tail, shared, block_func, draw_blocks, n_permutations,
+            block_size, n_jobs, p_accept, checkpoint,
+        )
+    p_values = pvalues_from_h0(sums, H0, tail) if clusters else np.array([])
+    if save_path is not None:
+        store.write_cluster_results(
+            save_path,
+            store.ClusterResults(
+                T_obs, clusters, p_values, H0, config, key,
+                checkpoint.state(),
+            ),
+        )
+        checkpoint.discard()
+    clusters = reshape_clusters(clusters, sample_shape, out_type)
+    return T_obs, clusters, p_values, H0
+
+
+def _run_permutations(
+    sums, tail, shared, block_func, draw_blocks, n_permutations, block_size,
+    n_jobs, p_accept=None, checkpoint=None,
+):
+    """H0 of the observed order and permutations, resuming a checkpoint"""
+    from metacog.config_parser import cfg
+
+    if tail == -1:
+        observed = sums.min()
+    elif tail == 1:
+        observed = sums.max()
+    else:
+        observed = np.abs(sums).max()
+    stop = None
+    if p_accept is not None:
+        stop = SequentialStop(
+            sums, observed, tail, p_accept, cfg.cluster_config["ci_level"]
+        )
+    if checkpoint is None:
+        blocks = draw_blocks(n_permutations - 1)
+        n_blocks = -(-(n_permutations - 1) // block_size)
+        H0 = run_blocks(
+            block_func, blocks, n_blocks, n_jobs, shared, stop=stop
+        )
+        return np.concatenate([[observed]] + H0)
+
+    n_todo = n_permutations - 1 - checkpoint.resume()
+    settled = stop is not None and checkpoint.H0 and stop(checkpoint.H0[0])
+    if n_todo > 0 and not settled:
+
+        def on_result(H0):
+            checkpoint.add(H0)
+            return stop is not None and stop(H0)
+
+        blocks = checkpoint.track(draw_blocks(n_todo))
+        n_blocks = -(-n_todo // block_size)
+        try:
+            run_blocks(
+                block_func, blocks, n_blocks, n_jobs, shared, stop=on_result
+            )
+        finally:
+            checkpoint.save()
+    return np.concatenate([[observed]] + checkpoint.H0)[:n_permutations]
+
+
+def standardize(X, groups=None):
+    """
+    Center columns of X, within groups if given, and scale them to unit norm
+
+    Columns without variance are left at 0.
+
+    """
+    X = np.array(X, dtype=np.float64)
+    if groups is None:
+        X -= X.mean(axis=0)
+    else:
+        codes = np.unique(groups, return_inverse=True)[1]
+        counts = np.bincount(codes)
+        means = np.zeros((len(counts),) + X.shape[1:])
+        np.add.at(means, codes, X)
+        means /= counts.reshape((-1,) + (1,) * (X.ndim - 1))
+        X -= means[codes]
+    norm = np.sqrt(np.einsum("i...,i...->...", X, X))
+    X /= np.where(norm > 0, norm, 1)
+    return X
+
+
+def iter_within_permutations(groups, n_permutations, block_size, seed=None):
+    """
+    Blocks of permutations of observations within groups
+
+    Yields
+    ------
+    array, shape (n_block, n_observations)
+        indices of observations; each row maps every observation to one of
+        the same group
+
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.unique(groups, return_inverse=True)[1]
+    by_group = np.argsort(codes, kind="stable")
+    for start in range(0, n_permutations, block_size):
+        n_block = min(block_size, n_permutations - start)
+        # random keys sort observations within their group only
+        keys = codes[by_group] + rng.random((n_block, len(codes)))
+        orders = np.empty((n_block, len(codes)), dtype=int)
+        orders[:, by_group] = by_group[np.argsort(keys, axis=1)]
+        yield orders
+
+
+def correlation_stats(Z, y_blocks, df):
+    """
+    t values of correlations of standardized y with columns of Z
+
+    Parameters
+    ----------
+    Z : array, shape (n_observations, n_points)
+        standardized data, see `standardize`
+    y_blocks : array, shape (n_y, n_observations)
+        standardized behaviour, e.g. permuted
+    df : int
+        degrees of freedom of the t values
+
+    Returns
+    -------
+    array, shape (n_y, n_points)
+
+    """
+    r = y_blocks @ Z
+    np.clip(r, -1, 1, out=r)
+    with np.errstate(divide="ignore"):
+        return r * np.sqrt(df / (1 - r ** 2))
+
+
+def _correlation_block(orders):
+    s = _shared
+    stats = correlation_stats(s["X"], s["y"][orders], s["df"])
+    return max_cluster_sums(
+        stats, s["threshold"], s["tail"], s["graph"], s["t_power"]
+    )
+
+
+def spatio_temporal_cluster_correlation_test(
+    X,
+    y,
+    groups=None,
+    threshold=None,
+    n_permutations=1024,
+    tail=0,
+    adjacency=None,
+    n_jobs=None,
+    seed=None,
+    max_step=1,
+    t_power=1,
+    out_type="indices",
+    block_size=None,
+    p_accept=None,
+    save_path=None,
+):
+    """
+    Cluster-level permutation test of correlation with a continuous predictor
+
+    Pearson correlation of y with the data at every spatio-temporal point,
+    computed for all points at once as a product of standardized y and data
+    and thresholded as t values. Behaviour is permuted between observations
+    of the same group (subject), so that clusters are tested against
+    within-subject exchangeability.
+
+    Parameters
+    ----------
+    X : array, shape (n_observations, n_times, n_space)
+        single-trial data, e.g. from `assemble_epochs_new` transposed to
+        (epochs, times, channels)
+    y : array, shape (n_observations,)
+        continuous predictor, e.g. confidence
+    groups : array, shape (n_observations,) | None
+        subject of each observation; X and y are centered within subjects,
+        so subject means don't contribute to the correlation
+    threshold : float | None
+        cluster forming t value; defaults to p < 0.05
+    n_permutations : int
+        number of permutations, including the observed order
+    tail : -1 | 0 | 1
+    adjacency : scipy.sparse matrix, shape (n_space, n_space) | None
+    n_jobs, seed, max_step, t_power, out_type, block_size, p_accept,
+    save_path
+        see `spatio_temporal_cluster_test`
+
+    Returns
+    -------
+    T_obs : array, shape (n_times, n_space)
+        t values of correlations
+    clusters : list
+    p_values : array, shape (n_clusters,)
+    H0 : array, shape (n_permutations,)
+
+    """
+    from scipy import stats
+    from metacog.config_parser import cfg
+
+    n_jobs = n_jobs or cfg.cluster_config["n_jobs"]
+    block_size = block_size or cfg.cluster_config["block_size"]
+    y = np.asarray(y, dtype=np.float64)
+    if not np.isfinite(y).all():
+        raise ValueError("y has missing values; drop those observations")
+    if len(y) != len(X):
+        raise ValueError(
+            f"Got {len(y)} values of y for {len(X)} observations"
+        )
+    if groups is None:
+        groups = np.zeros(len(y), dtype=int)
+        n_groups = 1
+    else:
+        n_groups = len(np.unique(groups))
+    sample_shape, graph = _setup_graph(X.shape[1:], adjacency, max_step)
+    df = len(y) - n_groups - 1
+    if threshold is None:
+        threshold = stats.t.ppf(1 - 0.05 / (1 + (tail == 0)), df)
+        threshold = -threshold if tail == -1 else threshold
+
+    Z = standardize(np.reshape(X, (len(X), -1)), groups)
+    y = standardize(y, groups)
+    T_obs = correlation_stats(Z, y[np.newaxis], df)[0]
+
+    rng = np.random.default_rng(seed)
+    shared = dict(
+        X=Z, y=y, df=df, threshold=threshold, tail=tail, graph=graph,
+        t_power=t_power,
+    )
+    config = dict(test="correlation", seed=seed, max_step=max_step)
+    return _permutation_test(
+        T_obs, sample_shape, shared, _correlation_block,
+        partial(iter_within_permutations, groups, block_size=block_size,
+                seed=rng),
+        rng, config, n_permutations, block_size, n_jobs, out_type, p_accept,
+        save_path,
+    )
+
+
+def lmm_zvalues(
+    model, stats, i_effect, rho0=None, tol=None, batch_size=None
+):
+    """
+    z values of one fixed effect for all columns of sufficient statistics
+
+    See `metacog.lmm.RandomInterceptLMM.fit_stats` for rho0 and tol.
+
+    Returns
+    -------
+    z : array, shape (n_columns,)
+    rho : array, shape (n_columns,)
+        gamma / (1 + gamma) of the fits
+
+    """
+    from metacog.config_parser import cfg
+
+    batch_size = batch_size or cfg.lmm_config["batch_size"]
+    n_columns = len(stats["yty"])
+    z, rho = np.empty(n_columns), np.empty(n_columns)
+    for start in range(0, n_columns, batch_size):
+        cols = slice(start, start + batch_size)
+        sub = {k: v[..., cols] for k, v in stats.items()}
+        params, bse, _, rho[cols] = model.fit_stats(
+            sub, tol, None if rho0 is None else rho0[cols]
+        )
+        z[cols] = params[i_effect] / bse[i_effect]
+    return z, rho
+
+
+def _lmm_block(orders):
+    s = _shared
+    model = s["model"]
+    n_params = len(model.exog_names)
+    # X'Y of the designs of all permutations of the block at once; group
+    # sums of the data and y'y don't change within groups
+    exog = model.exog[orders].transpose(0, 2, 1).reshape(-1, len(orders[0]))
+    xty = (exog @ s["X"]).reshape(len(orders), n_params, -1)
+    stats = np.empty((len(orders), xty.shape[-1]))
+    for i, perm_xty in enumerate(xty):
+        perm_stats = dict(
+            xty=perm_xty, group_sums=s["group_sums"], yty=s["yty"]
+        )
+        stats[i] = lmm_zvalues(
+            model, perm_stats, s["i_effect"], s["rho"], s["tol"]
+        )[0]
+    return max_cluster_sums(
+        stats, s["threshold"], s["tail"], s["graph"], s["t_power"]
+    )
+
+
+def spatio_temporal_cluster_lmm_test(
+    X,
+    metadata,
+    formula,
+    effect,
+    groups="subject",
+    threshold=None,
+    n_permutations=1024,
+    tail=0,
+    adjacency=None,
+    n_jobs=None,
+    seed=None,
+    max_step=1,
+    t_power=1,
+    out_type="indices",
+    block_size=None,
+    p_accept=None,
+    save_path=None,
+):
+    """
+    Cluster-level permutation test of a mixed-model fixed effect (cluster-LME)
+
+    A random-intercept model (see `metacog.lmm`) is fit at every point, and
+    z values of `effect` are clustered. For the null distribution, rows of
+    the design (trial labels) are permuted within groups and the model is
+    refit, warm-started from the observed fit: the group sums of the data
+    are reused, and the variance ratio is searched near the observed one
+    with the looser cfg.lmm_config["perm_tol"], which changes z values by
+    about 1e-5.
+
+    Parameters
+    ----------
+    X : array, shape (n_observations, n_times, n_space)
+        single-trial data, e.g. times or freqs x channels
+    metadata : pandas.DataFrame
+        one row per observation, with the regressors and the groups
+    formula : str
+        fixed effects, e.g. "~ is_correct * confidence"
+    effect : str
+        name of the tested fixed effect, e.g. "confidence"
+    groups : str
+        column of metadata with the random intercept groups (subjects)
+    threshold : float | None
+        cluster forming z value; defaults to p < 0.05
+    n_permutations, tail, adjacency, n_jobs, seed, max_step, t_power,
+    out_type, block_size, p_accept, save_path
+        see `spatio_temporal_cluster_test`
+
+    Returns
+    -------
+    T_obs : array, shape (n_times, n_space)
+        z values of effect
+    clusters : list
+    p_values : array, shape (n_clusters,)
+    H0 : array, shape (n_permutations,)
+
+    """
+    from scipy import stats
+    from metacog.config_parser import cfg
+    from metacog.lmm import RandomInterceptLMM
+
+    n_jobs = n_jobs or cfg.cluster_config["n_jobs"]
+    block_size = block_size or cfg.cluster_config["block_size"]
+    if len(metadata) != len(X):
+        raise ValueError(
+            f"Got {len(metadata)} rows of metadata for {len(X)} observations"
+        )
+    sample_shape, graph = _setup_graph(X.shape[1:], adjacency, max_step)
+    if threshold is None:
+        threshold = stats.norm.ppf(1 - 0.05 / (1 + (tail == 0)))
+        threshold = -threshold if tail == -1 else threshold
+
+    model = RandomInterceptLMM.from_formula(formula, metadata, groups)
+    Y = np.reshape(X, (len(X), -1)).astype(np.float64)
+    # z values don't depend on the scale of the data; unit variance keeps
+    # REML sums of e.g. squared Tesla far from underflow
+    if Y.std() > 0:
+        Y /= Y.std()
+    observed = model.sufficient_stats(Y)
+    i_effect = model.exog_names.index(effect)
+    T_obs, rho = lmm_zvalues(model, observed, i_effect)
+
+    rng = np.random.default_rng(seed)
+    shared = dict(
+        X=Y, model=model, group_sums=observed["group_sums"],
+        yty=observed["yty"], i_effect=i_effect, rho=rho,
+        tol=cfg.lmm_config["perm_tol"], threshold=threshold, tail=tail,
+        graph=graph, t_power=t_power,
+    )
+    config = dict(
+        test="lmm", formula=formula, effect=effect, groups=groups, seed=seed,
+        max_step=max_step,
+    )
+    return _permutation_test(
+        T_obs, sample_shape, shared, _lmm_block,
+        partial(iter_within_permutations, model.codes, block_size=block_size,
+                seed=rng),
+        rng, config, n_permutations, block_size, n_jobs, out_type, p_accept,
+        save_path,
+    )
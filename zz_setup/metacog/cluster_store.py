@@ -0,0 +1,278 @@
+"""
+Results of cluster permutation tests and checkpoints of running tests
+
+A cluster test given ``save_path`` (see `metacog.cluster_stats`) writes two
+files sharing that path prefix, e.g. cluster_stats/sources_high_low:
+
+    <prefix>.npz    T_obs, clusters, p-values, H0 and the test config
+    <prefix>.ckpt   H0 of the permutations run so far and the RNG state
+
+The checkpoint is rewritten every ``cfg.cluster_config["checkpoint_s"]``
+seconds and when the run is interrupted (e.g. Ctrl-C), so that a rerun with
+the same data and parameters resumes after the last finished block of
+permutations. Once the results are written the checkpoint is removed; its
+final state goes into the results store instead. Both files are keyed by a
+hash of the test config (including the seed), the observed statistic and the
+adjacency graph. A rerun of a finished test returns the stored results, and
+one with a larger n_permutations continues the finished run. Files of another
+test (e.g. after a change of threshold, seed or data) are stale: the test is
+recomputed and they are overwritten.
+
+`load_cluster_results` reads a store without recomputing anything, e.g. to
+plot it with `metacog.utils.plot_stored_clusters`::
+
+    res = load_cluster_results(dirs.cluster_stats / "erp_high_low_grad")
+    res.good_cluster_inds(p_accept=0.05)
+    T_obs, clusters, p_values, H0 = res.as_tuple()
+
+"""
+import hashlib
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def cluster_store_files(prefix):
+    """Paths of the results store and the checkpoint with prefix"""
+    prefix = Path(prefix)
+    return prefix.with_suffix(".npz"), prefix.with_suffix(".ckpt")
+
+
+def config_hash(config, *arrays):
+    """Hash of a JSON-serializable config and arrays"""
+    h = hashlib.sha1(json.dumps(config, sort_keys=True).encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update(str((array.dtype, array.shape)).encode())
+        h.update(array.data)
+    return h.hexdigest()
+
+
+def rng_state(rng):
+    """State of a RandomState or Generator"""
+    if isinstance(rng, np.random.RandomState):
+        return rng.get_state()
+    return rng.bit_generator.state
+
+
+def set_rng_state(rng, state):
+    if isinstance(rng, np.random.RandomState):
+        rng.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+class ClusterResults:
+    """
+    Results of a cluster permutation test
+
+    Attributes
+    ----------
+    T_obs : array, shape (n_times, n_space)
+    clusters : list of array
+        flat indices into T_obs of each cluster
+    p_values : array, shape (n_clusters,)
+    H0 : array, shape (n_permutations,)
+    config : dict
+        parameters of the test
+    config_hash : str
+        hash identifying the test, see `cluster_store_files`
+    checkpoint : dict | None
+        final state of the `PermutationCheckpoint`, continuing the run with
+        more permutations
+
+    """
+
+    def __init__(
+        self, T_obs, clusters, p_values, H0, config, config_hash,
+        checkpoint=None,
+    ):
+        self.T_obs = T_obs
+        self.clusters = clusters
+        self.p_values = p_values
+        self.H0 = H0
+        self.config = config
+        self.config_hash = config_hash
+        self.checkpoint = checkpoint
+
+    def good_cluster_inds(self, p_accept=0.05):
+        """Indices of clusters with p-value below p_accept"""
+        return np.where(self.p_values < p_accept)[0]
+
+    def as_tuple(self, out_type="indices"):
+        """(T_obs, clusters, p_values, H0), as the cluster tests return"""
+        from metacog.cluster_stats import reshape_clusters
+
+        clusters = reshape_clusters(self.clusters, self.T_obs.shape, out_type)
+        return self.T_obs, clusters, self.p_values, self.H0
+
+    def plot_args(self):
+        """T_obs and clusters as `plot_temporal_clusters` takes them"""
+        return self.as_tuple()[:2]
+
+
+def write_cluster_results(prefix, results):
+    """Write ClusterResults to the store with prefix"""
+    results_path = cluster_store_files(prefix)[0]
+    results_path.parent.mkdir(exist_ok=True, parents=True)
+    sizes = [len(c) for c in results.clusters]
+    flat = (
+        np.concatenate(results.clusters) if results.clusters
+        else np.array([], dtype=int)
+    )
+    extra = {}
+    if results.checkpoint is not None:
+        # RNG states are tuples or dicts; stored as bytes, so that the store
+        # loads without allow_pickle
+        extra["checkpoint"] = np.frombuffer(
+            pickle.dumps(results.checkpoint), dtype=np.uint8
+        )
+    tmp_path = results_path.with_suffix(".tmp.npz")
+    np.savez(
+        tmp_path,
+        T_obs=results.T_obs,
+        cluster_indices=flat,
+        cluster_sizes=np.array(sizes, dtype=int),
+        p_values=results.p_values,
+        H0=results.H0,
+        config=json.dumps(results.config),
+        config_hash=results.config_hash,
+        **extra,
+    )
+    os.replace(tmp_path, results_path)
+
+
+def load_cluster_results(prefix):
+    """Read ClusterResults from the store with prefix"""
+    results_path = cluster_store_files(prefix)[0]
+    with np.load(results_path, allow_pickle=False) as f:
+        bounds = np.cumsum(f["cluster_sizes"])[:-1]
+        clusters = (
+            np.split(f["cluster_indices"], bounds)
+            if len(f["cluster_sizes"]) else []
+        )
+        checkpoint = None
+        if "checkpoint" in f.files:
+            checkpoint = pickle.loads(f["checkpoint"].tobytes())
+        return ClusterResults(
+            f["T_obs"],
+            clusters,
+            f["p_values"],
+            f["H0"],
+            json.loads(str(f["config"])),
+            str(f["config_hash"]),
+            checkpoint,
+        )
+
+
+class PermutationCheckpoint:
+    """
+    H0 of finished blocks and RNG state, saved periodically to a file
+
+    Parameters
+    ----------
+    path : str | Path
+        checkpoint file, see `cluster_store_files`
+    config_hash : str
+        hash of the test; a checkpoint of another test is not resumed
+    rng : RandomState | Generator
+        generator drawing the permutations
+    interval : float
+        seconds between saves
+    results : ClusterResults | None
+        stored results of a finished run, continued if they are of the same
+        test and no checkpoint is left
+
+    """
+
+    def __init__(self, path, config_hash, rng, interval, results=None):
+        self.path = Path(path)
+        self.config_hash = config_hash
+        self.rng = rng
+        self.interval = interval
+        self.results = results
+        self.H0 = []
+        self._states = []
+        self._resumed = None
+        self._n_resumed = 0
+        self._n_saved = 0
+        self._last_save = time.monotonic()
+
+    @property
+    def n_done(self):
+        """Number of permutations in H0"""
+        return sum(len(h) for h in self.H0)
+
+    def resume(self):
+        """
+        Load H0 and RNG state of a checkpoint or results of the same test
+
+        A checkpoint of another test is stale and removed.
+
+        Returns
+        -------
+        int
+            number of permutations already done
+
+        """
+        state = None
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+            if state["config_hash"] != self.config_hash:
+                self.discard()
+                state = None
+        if state is None and self.results is not None:
+            state = self.results.checkpoint
+        if state is None or state["config_hash"] != self.config_hash:
+            return 0
+        set_rng_state(self.rng, state["rng_state"])
+        self.H0 = [state["H0"]]
+        self._resumed = state
+        self._n_resumed = self._n_saved = len(self.H0)
+        return self.n_done
+
+    def track(self, blocks):
+        """Yield blocks, recording the RNG state after drawing each"""
+        for block in blocks:
+            self._states.append(rng_state(self.rng))
+            yield block
+
+    def add(self, H0):
+        """Record the H0 of the next finished block"""
+        self.H0.append(H0)
+        if time.monotonic() - self._last_save > self.interval:
+            self.save()
+
+    def state(self):
+        """H0 so far and the RNG state after its last block, or None"""
+        if len(self.H0) == self._n_resumed:
+            return self._resumed
+        # blocks are drawn ahead of being finished (by the worker pool), so
+        # the state after the last finished block is one of the recorded
+        return dict(
+            config_hash=self.config_hash,
+            H0=np.concatenate(self.H0),
+            rng_state=self._states[len(self.H0) - 1 - self._n_resumed],
+        )
+
+    def save(self):
+        """Write H0 so far and the RNG state after its last block"""
+        if len(self.H0) == self._n_saved:
+            return
+        state = self.state()
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.path)
+        self._n_saved = len(self.H0)
+        self._last_save = time.monotonic()
+
+    def discard(self):
+        """Remove the checkpoint file"""
+        self.path.unlink(missing_ok=True)
@@ -23,6 +23,11 @@ er_sessions: list[str]
 
 # ---------------------------- 03-apply_maxfilter --------------------------- #
 maxfilt_config: dict = {"t_window": "auto"}
+# Maxfilter recordings in chunks of chunk_duration seconds padded with
+# overlap seconds on both sides instead of loading them whole, so memory
+# doesn't grow with recording length; None to disable. overlap must exceed
+# cHPI filter window (t_window).
+maxfilt_stream_config: dict = dict(chunk_duration=None, overlap=2.0)
 # --------------------------------------------------------------------------- #
 
 # -------- 04-concat_filter_resample -------- #
@@ -41,6 +46,14 @@ ica_config: dict = {
 }
 # -------------------------------- #
 
+# -------- 03-05-maxfilter_filter_ica -------- #
+# Run maxfilter, concat/filter/resample and ICA as one task per recording
+# passing data between the steps in memory instead of tasks apply_maxfilter,
+# concat_filter_resample and compute_ica. Maxfiltered data is written only if
+# save_maxfilt is True.
+fused_config: dict = dict(enabled=False, save_maxfilt=False)
+# -------------------------------------------- #
+
 # -------- 09-make_epochs -------- #
 epochs_config: dict = dict(
     tmin=-1,
@@ -78,6 +91,12 @@ config_sources: dict = dict(
     baseline_win=[-1, -0.25],
     active_win=[0.25, 1],
 )
+# Morph of source trials to fsaverage (see metacog/morph.py): number of
+# trials morphed with one sparse product and dtype; "float32" halves memory.
+morph_config: dict = dict(chunk_size=32, dtype="float64")
+# Source PSD of single epochs (see metacog/source_psd.py): number of epochs
+# projected to source space at once.
+source_psd_config: dict = dict(batch_size=16)
 # ------------------------------------ #
 
 # -------- 15-compute_tfr_epochs -------- #
@@ -86,6 +105,13 @@ tfr_config: dict = dict(
     decim=4,
     use_fft=True,
 )
+# Storage of single-trial TFR (see metacog/tfr_store.py): chunk size along
+# epochs, channels and freqs and compression, "blosc" | "gzip" | "lzf" | None
+tfr_store_config: dict = dict(
+    chunks=dict(epochs=16, channels=34, freqs=1),
+    compression="blosc",
+    clevel=5,
+)
 # -------------------------------------- #
 
 # ----------- 16-average_tfr ----------- #
@@ -96,3 +122,96 @@ target_bands: dict[str, tuple[float, float]] = {
     "beta": (13., 25.),
 }
 # -------------------------------------- #
+
+# -------- 15-16-compute_band_power -------- #
+# Compute band power of batch_size epochs at a time and write the band
+# averages directly instead of tasks compute_tfr_epochs and average_tfr; the
+# single-trial TFR of all freqs is then not stored.
+band_power_config: dict = dict(enabled=False, batch_size=32)
+# ------------------------------------------ #
+
+# ------------------------------- scheduler -------------------------------- #
+# Peak memory (GB), threads and expected duration (s) of tasks by doit task
+# name. Memory and duration learned from the run ledger take precedence.
+scheduler_config: dict = dict(
+    mem_budget_gb=None,  # None: 80% of physical memory
+    n_cores=None,  # None: os.cpu_count()
+    mem_safety_factor=1.2,  # learned peak memory is multiplied by this
+    default=dict(mem_gb=2.0, threads=1, duration=60.0),
+    resources=dict(
+        compute_head_position=dict(mem_gb=3.0, duration=300.0),
+        apply_maxfilter=dict(mem_gb=8.0, duration=900.0),
+        concat_filter_resample=dict(mem_gb=16.0, duration=600.0),
+        compute_ica=dict(mem_gb=6.0, duration=1200.0),
+        maxfilter_filter_ica=dict(mem_gb=24.0, duration=2700.0),
+        apply_ica=dict(mem_gb=6.0, duration=300.0),
+        make_epochs=dict(mem_gb=4.0, duration=120.0),
+        compute_forward=dict(mem_gb=4.0, threads=8, duration=600.0),
+        compute_sources=dict(mem_gb=8.0, duration=1800.0),
+        compute_tfr_epochs=dict(mem_gb=16.0, duration=1200.0),
+        average_tfr=dict(mem_gb=16.0, duration=300.0),
+        compute_band_power=dict(mem_gb=4.0, duration=900.0),
+    ),
+)
+# --------------------------------------------------------------------------- #
+
+# ------------------------------ fingerprints ------------------------------- #
+# Files larger than sample_above_mb are fingerprinted by hashing n_blocks
+# blocks of block_kb spread evenly over the file instead of the whole file.
+# Set sample_above_mb to None to always hash full files.
+fingerprint_config: dict = dict(
+    sample_above_mb=1024, n_blocks=128, block_kb=256,
+)
+# --------------------------------------------------------------------------- #
+
+# ------------------------------- job arrays -------------------------------- #
+job_array_config: dict = dict(
+    out_dir=None,  # None: derivatives/job_arrays
+    python=None,  # None: python running metacog.backends
+    sbatch_options=["--time=12:00:00"],  # added to every job array script
+)
+# --------------------------------------------------------------------------- #
+
+# ------------------------------- epoch store ------------------------------- #
+# Group epochs store written by the build_epoch_store task: event names or
+# tags of epochs to keep, channel types (one array each) and array dtype;
+# "float32" halves the store size.
+epoch_store_config: dict = dict(
+    events=["answer"], ch_types=["grad", "mag"], dtype="float64",
+)
+# --------------------------------------------------------------------------- #
+
+# ------------------------------ result cache ------------------------------- #
+# Results of group-level loaders are cached in derivatives/cache/results;
+# least recently used entries are removed when their total size exceeds
+# quota_gb (None: no limit).
+result_cache_config: dict = dict(quota_gb=50.0)
+# --------------------------------------------------------------------------- #
+
+# ------------------------------ group loaders ------------------------------ #
+# Processes reading subjects in parallel in group-level loaders such as
+# assemble_epochs; each of them holds one subject's epochs in memory.
+loader_config: dict = dict(n_jobs=4)
+# --------------------------------------------------------------------------- #
+
+# ------------------------ cluster permutation tests ------------------------ #
+# metacog.cluster_stats: worker processes running blocks of permutations, and
+# permutations per block (memory of a block is about 3 x block_size arrays of
+# the size of one observation). Sequential tests (p_accept given) stop once the
+# ci_level confidence interval of every cluster p-value excludes p_accept.
+# Tests given save_path checkpoint their permutations every checkpoint_s
+# seconds.
+cluster_config: dict = dict(
+    n_jobs=4, block_size=32, ci_level=0.99, checkpoint_s=300
+)
+# --------------------------------------------------------------------------- #
+
+# ------------------------------ mixed models ------------------------------- #
+# metacog.lmm: response columns (e.g. channel x time points) fit at once and
+# tolerance of the random intercept variance ratio gamma / (1 + gamma).
+# Permutations of cluster-LME tests search the ratio within warm_width of the
+# observed one, to perm_tol.
+lmm_config: dict = dict(
+    batch_size=20000, tol=1e-7, warm_width=0.02, perm_tol=1e-4,
+)
+# --------------------------------------------------------------------------- #
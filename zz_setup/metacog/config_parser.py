@@ -1,7 +1,10 @@
+from functools import lru_cache
 from types import SimpleNamespace
 
 
+@lru_cache(maxsize=None)
 def get_config():
+    """Merge config.py defaults with config_user.py; resolved once"""
     from metacog import config
     res_config = SimpleNamespace()
     res_config.__annotations__ = config.__annotations__
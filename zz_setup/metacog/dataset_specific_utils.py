@@ -1,17 +1,15 @@
 from argparse import ArgumentParser
+import mmap
+import multiprocessing as mp
 
-from joblib import Memory
 import numpy as np
 from mne import read_epochs
 from tqdm import tqdm
-import pandas as pd
 
 from metacog import bp
+from metacog.cache import cached
 from metacog.config_parser import cfg
-
-
-location = "./cachedir"
-memory = Memory(location, verbose=0)
+from metacog.utils import read_epochs_selection
 
 
 def iter_files(subjects, runs_return="sep"):
@@ -104,47 +102,139 @@ LOW_CONF_EPOCH = 24
 HIGH_CONF_EPOCH = 44
 
 
-@memory.cache
-def assemble_epochs(ep_type="answer", average=False, ch_type="grad"):
-    """Read in epochs"""
+def read_subject_epochs(subj, ep_type="answer", average=False, ch_type="grad"):
+    """Read epochs of one subject as data and labels for assemble_epochs"""
+    ep_path = bp.epochs.fpath(subject=subj)
+    ep = read_epochs_selection(ep_path, ep_type, meg=ch_type)
+    ep.apply_baseline()
+
+    # required to merge epochs from differen subjects together
+    ep.info["dev_head_t"] = None
+    X_low = ep["low"].get_data()
+    if average:
+        X_low = X_low.mean(axis=0, keepdims=True)
+        y_low = [LOW_CONF_EPOCH]
+    else:
+        y_low = ep["low"].events[:, 2]
+    X_high = ep["high"].get_data()
+    if average:
+        X_high = X_high.mean(axis=0, keepdims=True)
+        y_high = [HIGH_CONF_EPOCH]
+    else:
+        y_high = ep["high"].events[:, 2]
+    return np.concatenate([X_low, X_high]), np.r_[y_low, y_high]
+
+
+def count_subject_epochs(subj, ep_type="answer", average=False):
+    """Get number of epochs and times of a subject from the epochs header"""
+    ep_path = bp.epochs.fpath(subject=subj)
+    ep = read_epochs(ep_path, preload=False, verbose=False)[ep_type]
+    n_epochs = 2 if average else len(ep["low"]) + len(ep["high"])
+    return n_epochs, len(ep.times)
+
+
+# output array of assemble_epochs; set before forking workers so that they
+# write to the same memory
+_shared = {}
+
+
+def _fill_subject(subj, start, stop, read_kwargs):
+    X_subj, y_subj = read_subject_epochs(subj, **read_kwargs)
+    if len(X_subj) != stop - start:
+        raise RuntimeError(
+            f"Expected {stop - start} epochs for subject {subj} from the"
+            f" epochs header, got {len(X_subj)}"
+        )
+    _shared["X"][start:stop] = X_subj
+    return start, stop, y_subj
+
+
+def _fill_subject_star(args):
+    return _fill_subject(*args)
+
+
+def epochs_files(**kwargs):
+    """Epochs of all subjects; inputs of cached group loaders"""
+    return [bp.epochs.fpath(subject=s) for s in cfg.subjects]
+
+
+@cached(inputs=epochs_files, config=["subjects"], ignore=["n_jobs"])
+def assemble_epochs(
+    ep_type="answer", average=False, ch_type="grad", n_jobs=None
+):
+    """
+    Read in epochs of all subjects
+
+    The output is sized from the epochs headers and preallocated; subjects
+    are then read in parallel, each worker writing its subject's epochs into
+    its slice of the output.
+
+    Parameters
+    ----------
+    ep_type : str
+        epochs event type to select
+    average : bool
+        average low and high confidence epochs of each subject
+    ch_type : "grad" | "mag"
+        channels to pick
+    n_jobs : int | None
+        number of worker processes; defaults to cfg.loader_config["n_jobs"]
+
+    Returns
+    -------
+    X : array, shape (n_epochs, n_channels, n_times)
+        low and high confidence epochs of each subject, in order of subjects
+    y : array, shape (n_epochs,)
+        event codes, or LOW_CONF_EPOCH and HIGH_CONF_EPOCH if averaged
+
+    """
     if ch_type == "grad":
         n_channels = 204
     elif ch_type == "mag":
         n_channels = 102
     else:
         raise AttributeError
-    n_times = 1001
-    X = np.empty((0, n_channels, n_times))
-    y = np.empty(0)
-    for subj in tqdm(cfg.subjects, desc="Loading epochs"):
-        ep_path = bp.epochs.fpath(subject=subj)
-        ep = (
-            read_epochs(ep_path)
-            .interpolate_bads()
-            .pick_types(meg=ch_type)[ep_type]
-        )
-        ep.apply_baseline()
-
-        # required to merge epochs from differen subjects together
-        ep.info["dev_head_t"] = None
-        X_low = ep["low"].get_data()
-        if average:
-            X_low = X_low.mean(axis=0, keepdims=True)
-            y_low = LOW_CONF_EPOCH
-        else:
-            y_low = ep["low"].events[:, 2]
-        X_high = ep["high"].get_data()
-        if average:
-            X_high = X_high.mean(axis=0, keepdims=True)
-            y_high = HIGH_CONF_EPOCH
+    if n_jobs is None:
+        n_jobs = cfg.loader_config["n_jobs"]
+
+    jobs, start, n_times = [], 0, None
+    read_kwargs = dict(ep_type=ep_type, average=average, ch_type=ch_type)
+    for subj in cfg.subjects:
+        n_epochs, n_times = count_subject_epochs(subj, ep_type, average)
+        jobs.append((subj, start, start + n_epochs, read_kwargs))
+        start += n_epochs
+    shape = (start, n_channels, n_times)
+
+    use_pool = n_jobs > 1 and "fork" in mp.get_all_start_methods()
+    if use_pool:
+        # anonymous shared memory is inherited by the forked workers
+        nbytes = int(np.prod(shape)) * np.dtype(np.float64).itemsize
+        buffer = mmap.mmap(-1, max(nbytes, 1))
+        X = np.frombuffer(buffer, dtype=np.float64, count=np.prod(shape))
+        X = X.reshape(shape)
+    else:
+        X = np.empty(shape)
+    y = np.empty(shape[0])
+
+    _shared["X"] = X
+    try:
+        if use_pool:
+            with mp.get_context("fork").Pool(min(n_jobs, len(jobs))) as pool:
+                results = pool.imap_unordered(_fill_subject_star, jobs)
+                for start, stop, y_subj in tqdm(
+                    results, total=len(jobs), desc="Loading epochs"
+                ):
+                    y[start:stop] = y_subj
         else:
-            y_high = ep["high"].events[:, 2]
-        X = np.r_[X, X_low, X_high]
-        y = np.r_[y, y_low, y_high]
+            for job in tqdm(jobs, desc="Loading epochs"):
+                start, stop, y_subj = _fill_subject(*job)
+                y[start:stop] = y_subj
+    finally:
+        del _shared["X"]
     return X, y
 
 
-@memory.cache
+@cached(inputs=epochs_files, config=["subjects"])
 def assemble_epochs_new(
     kind="answer", average=False, baseline=(-0.2, 0), ch_type="grad"
 ):
@@ -152,13 +242,15 @@ def assemble_epochs_new(
     X, dfs = [], []
     for subj in tqdm(cfg.subjects, desc="Loading epochs"):
         fp = bp.epochs.fpath(subject=subj)
-        ep = read_epochs(fp).interpolate_bads().pick_types(meg=ch_type)[kind]
+        ep = read_epochs_selection(fp, kind, meg=ch_type)
         ep.apply_baseline(baseline=baseline)
         metadata = ep.metadata
         metadata["subject"] = subj
         dfs.append(metadata)
         X.append(ep.get_data())
 
+    import pandas as pd
+
     metadata = pd.concat(dfs)
     X = np.concatenate(X)
     return X, metadata, ep.times, ep.info
@@ -208,5 +300,7 @@ def get_events_metadata(events, beh_df):
         beh_data["is_correct"].append(is_correct)
         beh_data["question_num"].append(question_num)
 
+    import pandas as pd
+
     metadata = pd.DataFrame(beh_data)
     return metadata
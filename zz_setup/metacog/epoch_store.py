@@ -0,0 +1,200 @@
+"""
+Epochs of all subjects in one memory-mapped store
+
+Group-level stats need the trials x channels x times array of all subjects.
+`build_epoch_store` (doit task build_epoch_store) reads the epochs files once
+and writes the store folder:
+
+    <ch_type>.npy         epochs of all subjects, one array per channel type
+    <ch_type>-info.fif    measurement info of these channels
+    times.npy             epochs times
+    metadata.parquet      one row per epoch: subject, event and behavioral
+                          metadata (confidence, is_correct, question_num)
+
+`load_epoch_store` memory-maps the arrays instead of reading them, so opening
+the store takes milliseconds and selecting epochs by event or subject reads
+only the selected rows.
+
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+from mne import pick_info, pick_types, read_epochs
+from mne.baseline import rescale
+from mne.io import read_info, write_info
+
+from metacog.paths import dirs
+from metacog.utils import read_epochs_selection
+
+
+def store_files(store_dir, ch_types):
+    """Paths of all files of the store"""
+    store_dir = Path(store_dir)
+    files = [store_dir / "metadata.parquet", store_dir / "times.npy"]
+    for ch_type in ch_types:
+        files.append(store_dir / f"{ch_type}.npy")
+        files.append(store_dir / f"{ch_type}-info.fif")
+    return files
+
+
+def _read_header(ep_path, events):
+    """Number of epochs, times, info and metadata without reading data"""
+    import pandas as pd
+
+    ep = read_epochs(ep_path, preload=False, verbose=False)[events]
+    id_to_event = {v: k for k, v in ep.event_id.items()}
+    metadata = pd.DataFrame(
+        dict(event=[id_to_event[e] for e in ep.events[:, 2]])
+    )
+    if ep.metadata is not None:
+        extra = ep.metadata.reset_index(drop=True)
+        metadata = pd.concat([metadata, extra], axis=1)
+    return len(ep), ep.times, ep.info, metadata
+
+
+def _fill_subject(ep_path, events, start, stop, arrays):
+    """Write epochs of a subject to rows start:stop of the store arrays"""
+    ep = read_epochs_selection(ep_path, events, meg=True)
+    if len(ep) != stop - start:
+        raise RuntimeError(
+            f"Expected {stop - start} epochs in {ep_path} from the epochs"
+            f" header, got {len(ep)}"
+        )
+    for ch_type, path in arrays.items():
+        X = np.load(path, mmap_mode="r+")
+        X[start:stop] = ep.get_data(picks=pick_types(ep.info, meg=ch_type))
+        X.flush()
+        del X
+
+
+def build_epoch_store(
+    epochs_paths,
+    store_dir,
+    events=("answer",),
+    ch_types=("grad", "mag"),
+    dtype="float64",
+    n_jobs=1,
+):
+    """
+    Write epochs of all subjects to the store
+
+    Bad channels are interpolated; no baseline correction is applied.
+
+    Parameters
+    ----------
+    epochs_paths : dict
+        subject -> path to the subject's epochs
+    store_dir : str | Path
+        store folder
+    events : list of str
+        event names or tags of epochs to keep
+    ch_types : list of str
+        channel types to store, one array each
+    dtype : str
+        dtype of the stored arrays; "float32" halves the store size
+    n_jobs : int
+        number of subjects read in parallel
+
+    """
+    import pandas as pd
+    from joblib import Parallel, delayed
+
+    store_dir = Path(store_dir)
+    tmp_dir = store_dir / ".building"
+    tmp_dir.mkdir(exist_ok=True, parents=True)
+    events = list(events)
+
+    jobs, metadata, start = [], [], 0
+    for subj, ep_path in epochs_paths.items():
+        n_epochs, times, info, subj_metadata = _read_header(ep_path, events)
+        subj_metadata.insert(0, "subject", subj)
+        metadata.append(subj_metadata)
+        jobs.append((ep_path, events, start, start + n_epochs))
+        start += n_epochs
+        if len(jobs) == 1:
+            first_times, first_info = times, info
+        elif not np.array_equal(times, first_times):
+            raise ValueError(f"Times of {ep_path} differ from other subjects")
+
+    # bads are interpolated, and heads are in different positions
+    first_info["bads"] = []
+    first_info["dev_head_t"] = None
+    arrays = {}
+    for ch_type in ch_types:
+        picks = pick_types(first_info, meg=ch_type)
+        shape = (start, len(picks), len(first_times))
+        arrays[ch_type] = tmp_dir / f"{ch_type}.npy"
+        X = np.lib.format.open_memmap(
+            arrays[ch_type], mode="w+", dtype=dtype, shape=shape
+        )
+        del X
+        info_path = tmp_dir / f"{ch_type}-info.fif"
+        write_info(info_path, pick_info(first_info, picks))
+
+    Parallel(n_jobs=n_jobs)(
+        delayed(_fill_subject)(*job, arrays) for job in jobs
+    )
+    np.save(tmp_dir / "times.npy", first_times)
+    metadata = pd.concat(metadata, ignore_index=True)
+    metadata.to_parquet(tmp_dir / "metadata.parquet", index=False)
+
+    # move into place only when complete
+    for path in store_files(store_dir, ch_types):
+        os.replace(tmp_dir / path.name, path)
+    tmp_dir.rmdir()
+
+
+def load_epoch_store(
+    ch_type="grad", event=None, subjects=None, baseline=None, store_dir=None
+):
+    """
+    Open epochs of all subjects from the store
+
+    Parameters
+    ----------
+    ch_type : str
+        channel type
+    event : str | None
+        keep only epochs with this event name or tag, e.g. "answer"
+    subjects : list of str | None
+        keep only epochs of these subjects
+    baseline : tuple | None
+        baseline correction applied to the loaded epochs, as in
+        `mne.Epochs.apply_baseline`
+    store_dir : str | Path | None
+        defaults to dirs.group_epochs
+
+    Returns
+    -------
+    X : array, shape (n_epochs, n_channels, n_times)
+        read-only memory map if no epochs are dropped and baseline is None,
+        otherwise in-memory array
+    metadata : pandas.DataFrame
+        one row per epoch
+    times : array
+    info : mne.Info
+
+    """
+    import pandas as pd
+
+    store_dir = Path(dirs.group_epochs if store_dir is None else store_dir)
+    metadata = pd.read_parquet(store_dir / "metadata.parquet")
+    X = np.load(store_dir / f"{ch_type}.npy", mmap_mode="r")
+    times = np.load(store_dir / "times.npy")
+    info = read_info(store_dir / f"{ch_type}-info.fif", verbose=False)
+
+    mask = np.ones(len(metadata), dtype=bool)
+    if event is not None:
+        tags = set(event.split("/"))
+        mask &= [tags <= set(e.split("/")) for e in metadata.event]
+    if subjects is not None:
+        mask &= metadata.subject.isin(subjects).values
+    is_selected = not mask.all()
+    if is_selected:
+        X = np.asarray(X[mask])
+        metadata = metadata[mask].reset_index(drop=True)
+    if baseline is not None:
+        # never write to the store
+        X = rescale(X, times, baseline, copy=not is_selected, verbose=False)
+    return X, metadata, times, info
@@ -0,0 +1,81 @@
+"""
+In-process execution of preprocessing scripts for doit tasks
+
+Command actions like ``python preproc/03-apply_maxfilter.py ...`` start a new
+interpreter for every subtask, which then re-imports mne, mne_bids, matplotlib
+and metacog and re-parses the configuration. Python actions created with
+`script_action` instead import the script once per process and call its main
+function directly.
+
+Run with ``doit -n <N> -P process`` to get a pool of N long-lived workers:
+doit forks them after dodo.py (and with it the whole stack) is imported, and
+each worker then pulls subtasks from a shared queue.
+
+Wall and CPU time, peak memory and I/O of each call are recorded in the run
+ledger; see `metacog.ledger`. Targets are added to the dataset manifest as
+soon as they are written; see `metacog.manifest`.
+
+"""
+import importlib.util
+from pathlib import Path
+
+from metacog.ledger import track
+from metacog.manifest import get_manifest
+
+_scripts = {}
+
+
+def script_action(script, func, *pargs, **kwargs):
+    """
+    Create doit python-action calling `func` from preprocessing `script`
+
+    Parameters
+    ----------
+    script : str | Path
+        path to the script, relative to the directory doit is run from
+    func : str
+        name of the function to call from the script
+    *pargs, **kwargs
+        arguments passed to the function
+
+    Returns
+    -------
+    action : tuple
+        (callable, args, kwargs) triplet understood by doit
+
+    """
+    return (run_script, [str(script), func, pargs, kwargs], {})
+
+
+def load_script(script):
+    """Import preprocessing script as a module; cached for the process"""
+    script = Path(script).resolve()
+    if script not in _scripts:
+        name = "metacog_script_" + script.stem.replace("-", "_")
+        spec = importlib.util.spec_from_file_location(name, script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _scripts[script] = module
+    return _scripts[script]
+
+
+def run_script(script, func, pargs, kwargs, task):
+    """
+    Call `func` from `script`, creating target folders first
+
+    Resource usage of the call is recorded in the run ledger (see
+    `metacog.ledger`) and returned so doit saves it with the task values.
+    Written targets are added to the dataset manifest.
+
+    """
+    for target in task.targets:
+        Path(target).parent.mkdir(exist_ok=True, parents=True)
+
+    module = load_script(script)
+    stage = task.name.split(":")[0]
+    inputs = getattr(task, "file_dep", ())
+    with track(task.name, stage, script, func, inputs, task.targets) as rec:
+        getattr(module, func)(*pargs, **kwargs)
+    get_manifest().add(task.targets)
+    keys = ("wall_time", "cpu_time", "peak_rss_mb", "read_mb", "write_mb")
+    return {k: rec[k] for k in keys}
@@ -0,0 +1,190 @@
+"""
+Cached content fingerprints of (large) files
+
+Fingerprints are stored in a small SQLite database keyed by file path and
+are recomputed only when size, modification time or inode of the file
+change, so a file shared by several tasks is hashed once after each change
+and never on no-op runs. Hashing uses xxhash when it is installed and crc32
+otherwise; files above ``cfg.fingerprint_config["sample_above_mb"]`` are
+hashed by evenly spaced blocks.
+
+`FingerprintChecker` plugs the cache into doit::
+
+    DOIT_CONFIG = {"check_file_uptodate": FingerprintChecker}
+
+"""
+import os
+import sqlite3
+import zlib
+
+from doit.dependency import FileChangedChecker, MD5Checker
+
+from metacog.config_parser import cfg
+from metacog.paths import dirs
+
+try:
+    from xxhash import xxh3_64 as _hash_cls
+except ImportError:
+    _hash_cls = None
+
+CHUNK_SIZE = 1024 ** 2
+
+
+class _Crc32:
+    """Minimal hashlib-like wrapper around zlib.crc32"""
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        return f"{self._value:08x}"
+
+
+def _new_hash():
+    return _hash_cls() if _hash_cls is not None else _Crc32()
+
+
+def file_digest(
+    path, size=None, sample_above_mb=None, n_blocks=128, block_kb=256
+):
+    """
+    Compute fast non-cryptographic digest of a file
+
+    Parameters
+    ----------
+    path : str | Path
+        file to hash
+    size : int | None
+        file size in bytes; taken from the file system if None
+    sample_above_mb : float | None
+        hash only `n_blocks` blocks of `block_kb` KB for files larger than
+        this; None to always hash the whole file
+    n_blocks : int
+        number of blocks to hash for large files; first and last blocks are
+        always included
+    block_kb : int
+        size of each sampled block in KB
+
+    Returns
+    -------
+    digest : str
+        hex digest prefixed with "full:" or "sampled:"
+
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    h = _new_hash()
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        if sample_above_mb is None or size <= sample_above_mb * 1024 ** 2:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+            return "full:" + h.hexdigest()
+
+        block_size = block_kb * 1024
+        last = size - block_size
+        for i in range(n_blocks):
+            f.seek(last * i // (n_blocks - 1))
+            h.update(f.read(block_size))
+    return "sampled:" + h.hexdigest()
+
+
+class FingerprintCache:
+    """
+    Persistent cache of file digests keyed by (path, size, mtime_ns, inode)
+
+    Parameters
+    ----------
+    db_path : str | Path
+        SQLite file to keep fingerprints in
+    **digest_kwargs
+        passed to `file_digest`; default to cfg.fingerprint_config
+
+    """
+
+    def __init__(self, db_path, **digest_kwargs):
+        self.db_path = str(db_path)
+        self.digest_kwargs = dict(cfg.fingerprint_config)
+        self.digest_kwargs.update(digest_kwargs)
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # sqlite connections must not be shared by forked workers
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+                " inode INTEGER, digest TEXT)"
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def fingerprint(self, path, stat=None):
+        """Get (size, mtime_ns, inode, digest) of a file, rehash if changed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path) if stat is None else stat
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, digest FROM fingerprints"
+            " WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row is not None and tuple(row[:3]) == key:
+            return row
+        digest = file_digest(path, stat.st_size, **self.digest_kwargs)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                (path, *key, digest),
+            )
+        return (*key, digest)
+
+    def digest(self, path, stat=None):
+        return self.fingerprint(path, stat)[3]
+
+
+_cache = None
+
+
+def get_cache():
+    """Fingerprint cache shared by all tasks, located in derivatives"""
+    global _cache
+    if _cache is None:
+        _cache = FingerprintCache(dirs.cache / "fingerprints.sqlite")
+    return _cache
+
+
+class FingerprintChecker(FileChangedChecker):
+    """
+    doit file checker using cached fast fingerprints instead of MD5
+
+    Saved state is [size, mtime_ns, inode, digest]. A file with unchanged
+    size, mtime and inode is up-to-date without reading it; otherwise its
+    digest is looked up in (or added to) the shared fingerprint cache.
+
+    """
+
+    def check_modified(self, file_path, file_stat, state):
+        if len(state) == 3:
+            # saved by doit's default checker before switching to this one
+            return MD5Checker().check_modified(file_path, file_stat, state)
+        key = [file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino]
+        if list(state[:3]) == key:
+            return False
+        if file_stat.st_size != state[0]:
+            return True
+        return get_cache().digest(file_path, file_stat) != state[3]
+
+    def get_state(self, dep, current_state):
+        stat = os.stat(dep)
+        key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        if current_state and list(current_state[:3]) == key:
+            return None
+        return list(get_cache().fingerprint(dep, stat))
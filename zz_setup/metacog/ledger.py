@@ -0,0 +1,443 @@
+"""
+Run ledger: resource usage of every pipeline task in a local SQLite database
+
+Each run of a dodo task executed in-process (see `metacog.executor`) and of a
+preprocessing script started from the command line is recorded with wall
+time, CPU time, peak resident memory, bytes read and written by the process,
+total size of input and output files (NULL when they are not known) and a
+hash of the configuration.
+Runs started by the same ``doit`` (or scheduler) invocation share a run id.
+
+Summarise the ledger with ``doit ledger`` (registered in doit.cfg) or::
+
+    python -m metacog.ledger [slowest|regressions|outliers] [--threshold X]
+
+"""
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from statistics import median
+from time import perf_counter, process_time
+
+from doit.cmd_base import Command
+
+from metacog.config_parser import cfg
+from metacog.paths import dirs
+
+# next to the file manifest, outside the source tree
+ledger_path = dirs.cache / "ledger.sqlite"
+
+# inherited by doit workers and by the scripts they start
+RUN_ID_VAR = "METACOG_RUN_ID"
+run_id = os.environ.setdefault(
+    RUN_ID_VAR, f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+)
+
+COLUMNS = [
+    ("date", "TEXT"),
+    ("run_id", "TEXT"),
+    ("task", "TEXT"),
+    ("stage", "TEXT"),
+    ("script", "TEXT"),
+    ("func", "TEXT"),
+    ("subject", "TEXT"),
+    ("status", "TEXT"),
+    ("wall_time", "REAL"),
+    ("cpu_time", "REAL"),
+    ("peak_rss_mb", "REAL"),
+    ("read_mb", "REAL"),
+    ("write_mb", "REAL"),
+    ("input_mb", "REAL"),
+    ("output_mb", "REAL"),
+    ("config_hash", "TEXT"),
+]
+
+
+def connect(path=None):
+    path = Path(path or ledger_path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    conn = sqlite3.connect(str(path), timeout=60)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS runs ("
+        + ", ".join(f"{name} {kind}" for name, kind in COLUMNS)
+        + ")"
+    )
+    return conn
+
+
+@lru_cache()
+def config_hash():
+    """Short hash of the configuration the pipeline runs with"""
+    items = sorted(
+        (k, repr(v)) for k, v in vars(cfg).items() if k != "__annotations__"
+    )
+    return hashlib.sha1(repr(items).encode()).hexdigest()[:12]
+
+
+def get_subject(text):
+    """Extract subject label from task name or file path; "" if none"""
+    match = re.search(r"sub-([a-zA-Z0-9]+)", text)
+    return match.group(1) if match else ""
+
+
+def reset_peak_rss():
+    """Reset peak resident memory of the process (linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the process in MB since the last reset
+
+    Falls back to getrusage when /proc is not available; in that case the
+    value is the peak over the whole process lifetime.
+
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macos and in kilobytes elsewhere
+    return maxrss / 1024 ** 2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def io_mb():
+    """
+    MB read and written by the process so far
+
+    Counts all read/write calls, including the ones served from page cache
+    (linux). Falls back to block input/output operations from getrusage.
+
+    """
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(":") for line in f)
+        read, write = int(counters["rchar"]), int(counters["wchar"])
+        return read / 1024 ** 2, write / 1024 ** 2
+    except (OSError, KeyError, ValueError):
+        pass
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # block operations are counted in 512-byte units
+    return usage.ru_inblock / 2048, usage.ru_oublock / 2048
+
+
+def files_mb(paths):
+    """Total size of existing files in MB; None if paths are not known"""
+    if paths is None:
+        return None
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p)) / (
+        1024 ** 2
+    )
+
+
+def record(rec, path=None):
+    """Append run record (dict with COLUMNS keys) to the ledger"""
+    names = [name for name, _ in COLUMNS]
+    with connect(path) as conn:
+        conn.execute(
+            f"INSERT INTO runs ({', '.join(names)})"
+            f" VALUES ({', '.join('?' * len(names))})",
+            [rec.get(name) for name in names],
+        )
+    conn.close()
+
+
+@contextmanager
+def track(task, stage, script="", func="", inputs=None, outputs=None):
+    """
+    Measure the code in with-block and record it in the ledger
+
+    Yields the record; wall_time, cpu_time, peak_rss_mb, read_mb, write_mb,
+    input_mb and output_mb are filled in on exit. Runs which raise are
+    recorded with status "failed". input_mb and output_mb are None (NULL)
+    when inputs and outputs are None, i.e. not known.
+
+    """
+    rec = dict(
+        date=datetime.now().isoformat(timespec="seconds"),
+        run_id=os.environ.get(RUN_ID_VAR, run_id),
+        task=task,
+        stage=stage,
+        script=str(script),
+        func=func,
+        subject=get_subject(task),
+        status="failed",
+        input_mb=files_mb(inputs),
+        config_hash=config_hash(),
+    )
+    reset_peak_rss()
+    read_start, write_start = io_mb()
+    wall_start, cpu_start = perf_counter(), process_time()
+    try:
+        yield rec
+        rec["status"] = "ok"
+    finally:
+        read, write = io_mb()
+        rec.update(
+            wall_time=perf_counter() - wall_start,
+            cpu_time=process_time() - cpu_start,
+            peak_rss_mb=peak_rss_mb(),
+            read_mb=read - read_start,
+            write_mb=write - write_start,
+            output_mb=files_mb(outputs),
+        )
+        record(rec)
+
+
+def track_main(script):
+    """
+    Record run of a preprocessing script started from the command line
+
+    Command line arguments which are existing files are taken as inputs, and
+    other arguments that look like paths as outputs. Scripts taking only
+    subject, task or run ids have no known files: their input_mb and
+    output_mb are left NULL rather than 0. The run is recorded at exit.
+
+    """
+    args = sys.argv[1:]
+    name = Path(script).stem
+    task = f"{name}:{' '.join(Path(a).name for a in args)}" if args else name
+    inputs = [a for a in args if os.path.isfile(a)]
+    outputs = [
+        a for a in args
+        if not os.path.exists(a) and (os.sep in a or Path(a).suffix)
+    ]
+    tracker = track(
+        task, name, script, "__main__", inputs or None, outputs or None
+    )
+    tracker.__enter__()
+
+    def finish():
+        # set by the interpreter when the script dies with an exception
+        exc = getattr(sys, "last_value", None)
+        if exc is None:
+            tracker.__exit__(None, None, None)
+        else:
+            tracker.__exit__(type(exc), exc, exc.__traceback__)
+
+    atexit.register(finish)
+
+
+def read_runs(status="ok", path=None):
+    """Read ledger as list of dicts, one per task run, oldest first"""
+    if not Path(path or ledger_path).exists():
+        return []
+    conn = connect(path)
+    conn.row_factory = sqlite3.Row
+    query = "SELECT * FROM runs"
+    params = ()
+    if status is not None:
+        query += " WHERE status = ?"
+        params = (status,)
+    rows = [dict(r) for r in conn.execute(query + " ORDER BY rowid", params)]
+    conn.close()
+    return rows
+
+
+def latest(runs):
+    """Most recent run of each task"""
+    return list({r["task"]: r for r in runs}.values())
+
+
+def slowest_stages(runs):
+    """
+    Aggregate the latest run of each task by stage, slowest stage first
+
+    Returns
+    -------
+    list of dict
+        stage, n_tasks, total and max wall time, max peak memory and total
+        MB read, written and taken as input (None if unknown for all tasks)
+
+    """
+    by_stage = defaultdict(list)
+    for r in latest(runs):
+        by_stage[r["stage"]].append(r)
+    res = [
+        dict(
+            stage=stage,
+            n_tasks=len(rs),
+            total_wall=sum(r["wall_time"] for r in rs),
+            max_wall=max(r["wall_time"] for r in rs),
+            max_peak_rss_mb=max(r["peak_rss_mb"] for r in rs),
+            read_mb=sum(r["read_mb"] for r in rs),
+            write_mb=sum(r["write_mb"] for r in rs),
+            input_mb=known_sum(r["input_mb"] for r in rs),
+        )
+        for stage, rs in by_stage.items()
+    ]
+    return sorted(res, key=lambda s: s["total_wall"], reverse=True)
+
+
+def known_sum(values):
+    """Sum of values that are not None; None if all are"""
+    known = [v for v in values if v is not None]
+    return sum(known) if known else None
+
+
+def regressions(runs, threshold=1.5, metrics=("wall_time", "peak_rss_mb")):
+    """
+    Find tasks whose latest run is slower or bigger than the ones before
+
+    The latest run of a task is compared with the median of its previous
+    runs; a metric is reported when it grew by more than `threshold` times.
+
+    """
+    by_task = defaultdict(list)
+    for r in runs:
+        by_task[r["task"]].append(r)
+    res = []
+    for task, rs in by_task.items():
+        if len(rs) < 2:
+            continue
+        last, previous = rs[-1], rs[:-1]
+        for metric in metrics:
+            before = median(r[metric] for r in previous)
+            if before > 0 and last[metric] / before > threshold:
+                res.append(
+                    dict(
+                        task=task,
+                        metric=metric,
+                        before=before,
+                        after=last[metric],
+                        ratio=last[metric] / before,
+                        config_changed=last["config_hash"]
+                        != previous[-1]["config_hash"],
+                    )
+                )
+    return sorted(res, key=lambda r: r["ratio"], reverse=True)
+
+
+def outliers(runs, threshold=3.5, metrics=("wall_time", "peak_rss_mb")):
+    """
+    Find subjects that are unusually slow or big within a stage
+
+    Uses robust z-score, ``0.6745 * (x - median) / MAD``, over the latest
+    runs of the stage's tasks; stages with less than 3 subjects are skipped.
+
+    """
+    by_stage = defaultdict(list)
+    for r in latest(runs):
+        if r["subject"]:
+            by_stage[r["stage"]].append(r)
+    res = []
+    for stage, rs in by_stage.items():
+        if len({r["subject"] for r in rs}) < 3:
+            continue
+        for metric in metrics:
+            values = [r[metric] for r in rs]
+            med = median(values)
+            mad = median(abs(v - med) for v in values)
+            if mad == 0:
+                continue
+            for r in rs:
+                z = 0.6745 * (r[metric] - med) / mad
+                if z > threshold:
+                    res.append(
+                        dict(
+                            stage=stage,
+                            subject=r["subject"],
+                            task=r["task"],
+                            metric=metric,
+                            value=r[metric],
+                            median=med,
+                            z=z,
+                        )
+                    )
+    return sorted(res, key=lambda r: r["z"], reverse=True)
+
+
+def print_report(report="slowest", threshold=None, path=None, file=None):
+    runs = read_runs(path=path)
+    if report == "slowest":
+        print(
+            f"{'stage':<40}{'tasks':>6}{'total, s':>11}{'max, s':>10}"
+            f"{'peak, MB':>10}{'read, MB':>11}{'written, MB':>13}",
+            file=file,
+        )
+        for s in slowest_stages(runs):
+            print(
+                f"{s['stage']:<40}{s['n_tasks']:>6}{s['total_wall']:>11.1f}"
+                f"{s['max_wall']:>10.1f}{s['max_peak_rss_mb']:>10.0f}"
+                f"{s['read_mb']:>11.0f}{s['write_mb']:>13.0f}",
+                file=file,
+            )
+    elif report == "regressions":
+        for r in regressions(runs, threshold or 1.5):
+            note = "  (config changed)" if r["config_changed"] else ""
+            print(
+                f"{r['task']:<70} {r['metric']:<12}"
+                f" {r['before']:10.1f} -> {r['after']:10.1f}"
+                f" x{r['ratio']:.2f}{note}",
+                file=file,
+            )
+    elif report == "outliers":
+        for r in outliers(runs, threshold or 3.5):
+            print(
+                f"{r['stage']:<30} sub-{r['subject']:<8} {r['metric']:<12}"
+                f" {r['value']:10.1f} (median {r['median']:.1f},"
+                f" z={r['z']:.1f})",
+                file=file,
+            )
+    else:
+        raise ValueError(f"Unknown report: {report}")
+
+
+class LedgerCmd(Command):
+    """doit command printing ledger reports: ``doit ledger [report]``"""
+
+    name = "ledger"
+    doc_purpose = "summarise resource usage recorded in the run ledger"
+    doc_usage = "[slowest|regressions|outliers]"
+    cmd_options = (
+        dict(
+            name="threshold",
+            long="threshold",
+            type=float,
+            default=None,
+            help="ratio for regressions, robust z-score for outliers",
+        ),
+    )
+
+    def execute(self, params, args):
+        for report in args or ["slowest"]:
+            print_report(report, params["threshold"])
+        return 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "report",
+        nargs="?",
+        default="slowest",
+        choices=["slowest", "regressions", "outliers"],
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="ratio for regressions, robust z-score for outliers",
+    )
+    args = parser.parse_args()
+    print_report(args.report, args.threshold)
@@ -0,0 +1,359 @@
+"""
+Index of all files in BIDS root and derivatives
+
+One row per file with BIDS entities parsed from the file name, stage (folder
+under derivatives, or "rawdata" for BIDS root), size, mtime and content
+fingerprint. `Manifest.update` walks the tree once and only touches rows of
+new or changed files; fingerprints come from the fingerprint cache shared
+with doit's up-to-date checks (see `metacog.fingerprint`). Targets of tasks
+run with `metacog.executor` are added as soon as they are written.
+
+Find files with `query` instead of globbing the derivatives tree::
+
+    from metacog.manifest import get_manifest
+    get_manifest().query(stage="03-maxfilter", subject="01")
+
+Command line::
+
+    python -m metacog.manifest update [--no-fingerprints]
+    python -m metacog.manifest query --stage 03-maxfilter --subject 01
+
+"""
+from argparse import ArgumentParser
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+
+from metacog.fingerprint import get_cache
+from metacog.paths import dirs
+
+# BIDS key in file name -> column
+ENTITIES = {
+    "sub": "subject",
+    "ses": "session",
+    "task": "task",
+    "acq": "acquisition",
+    "run": "run",
+    "proc": "processing",
+    "rec": "recording",
+    "space": "space",
+    "split": "split",
+}
+COLUMNS = (
+    ["path", "stage", "datatype"]
+    + list(ENTITIES.values())
+    + ["suffix", "extension", "entities", "size", "mtime_ns", "fingerprint"]
+)
+RAWDATA = "rawdata"
+# not indexed: our own databases and freesurfer subjects
+SKIP_DIRS = {dirs.cache, dirs.fsf_subjects}
+
+_key_value = re.compile(r"^([a-zA-Z]+)-(.+)$")
+# extensions with more than one dot; others start at the last dot, so that
+# entity values may contain dots, e.g. parc-aparc.a2009s
+MULTI_EXTENSIONS = (".nii.gz", ".tsv.gz", ".fif.gz", ".tar.gz")
+
+
+def parse_name(name):
+    """
+    Parse BIDS-like file name
+
+    Returns
+    -------
+    entities : dict
+        all key-value pairs from the name, e.g. {"sub": "01", "cond": "high"}
+    suffix : str | None
+    extension : str
+        from the last dot, or one of MULTI_EXTENSIONS, e.g. ".nii.gz";
+        includes hemisphere of source estimates, e.g. "-lh.stc"
+
+    """
+    ext = next((e for e in MULTI_EXTENSIONS if name.endswith(e)), None)
+    if ext is None:
+        dot = name.rfind(".")
+        ext = name[dot:] if dot > 0 else ""
+    stem = name[:len(name) - len(ext)]
+    if stem.endswith(("-lh", "-rh")):
+        stem, ext = stem[:-3], stem[-3:] + ext
+    entities, suffix = {}, None
+    parts = stem.split("_")
+    for i, part in enumerate(parts):
+        match = _key_value.match(part)
+        if match:
+            entities[match.group(1)] = match.group(2)
+        elif i == len(parts) - 1 and entities:
+            suffix = part
+        else:
+            return {}, None, ext
+    return entities, suffix, ext
+
+
+def get_stage(path):
+    """Derivatives folder of path, RAWDATA for BIDS root, None if outside"""
+    path = Path(path)
+    # not Path.is_relative_to, which needs python 3.9
+    try:
+        parts = path.relative_to(dirs.derivatives).parts
+    except ValueError:
+        pass
+    else:
+        return parts[0] if len(parts) > 1 else None
+    try:
+        path.relative_to(dirs.bids_root)
+    except ValueError:
+        return None
+    return RAWDATA
+
+
+def describe(path, stat=None):
+    """Make manifest row for a file; fingerprint is not computed"""
+    path = Path(path)
+    stat = os.stat(path) if stat is None else stat
+    stage = get_stage(path)
+    datatype = path.parent.name
+    if datatype not in ("meg", "anat", "beh", "eeg", "func"):
+        datatype = None
+
+    entities, suffix, extension = parse_name(path.name)
+    row = dict(
+        path=str(path),
+        stage=stage,
+        datatype=datatype,
+        suffix=suffix,
+        extension=extension,
+        entities=json.dumps(entities),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        fingerprint=None,
+    )
+    for key, column in ENTITIES.items():
+        row[column] = entities.get(key)
+    return row
+
+
+class Manifest:
+    """
+    SQLite index of files in BIDS root and derivatives
+
+    Parameters
+    ----------
+    db_path : str | Path
+        SQLite file to keep the index in
+
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # sqlite connections must not be shared by forked workers
+        if self._conn is None or self._pid != os.getpid():
+            self.db_path.parent.mkdir(exist_ok=True, parents=True)
+            self._conn = sqlite3.connect(str(self.db_path), timeout=60)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                + ", ".join(
+                    c + (" TEXT PRIMARY KEY" if c == "path" else "")
+                    for c in COLUMNS
+                )
+                + ")"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_stage_subject"
+                " ON files (stage, subject)"
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def _upsert(self, rows):
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)})"
+                f" VALUES ({', '.join('?' * len(COLUMNS))})",
+                [[row[c] for c in COLUMNS] for row in rows],
+            )
+
+    def add(self, paths):
+        """Add or refresh files in the dataset; fingerprints are left out"""
+        rows = [
+            describe(p)
+            for p in map(Path, paths)
+            if p.is_file() and get_stage(p) is not None
+        ]
+        if rows:
+            self._upsert(rows)
+        return len(rows)
+
+    def update(self, roots=None, fingerprints=True):
+        """
+        Scan folders and sync the index with them
+
+        Files with unchanged size and mtime are skipped; rows of removed
+        files are deleted.
+
+        Parameters
+        ----------
+        roots : list of Path | None
+            folders to scan; defaults to BIDS root (derivatives included)
+        fingerprints : bool
+            whether to compute missing content fingerprints
+
+        Returns
+        -------
+        n_changed, n_removed : int
+
+        """
+        roots = [dirs.bids_root] if roots is None else roots
+        known = {
+            r["path"]: (r["size"], r["mtime_ns"], r["fingerprint"])
+            for r in self.conn.execute(
+                "SELECT path, size, mtime_ns, fingerprint FROM files"
+            )
+        }
+        seen, changed = set(), []
+        for root in map(Path, roots):
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [
+                    d
+                    for d in dirnames
+                    if not d.startswith(".")
+                    and Path(dirpath, d) not in SKIP_DIRS
+                ]
+                for name in filenames:
+                    if name.startswith("."):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    stat = os.stat(path)
+                    seen.add(path)
+                    old = known.get(path)
+                    key = (stat.st_size, stat.st_mtime_ns)
+                    if old and old[:2] == key:
+                        if old[2] or not fingerprints:
+                            continue
+                    row = describe(path, stat)
+                    if fingerprints:
+                        row["fingerprint"] = get_cache().digest(path, stat)
+                    changed.append(row)
+        self._upsert(changed)
+
+        scanned = [str(Path(r)) + os.sep for r in roots]
+        removed = [
+            p
+            for p in known
+            if p not in seen and any(p.startswith(r) for r in scanned)
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM files WHERE path = ?", [(p,) for p in removed]
+            )
+        return len(changed), len(removed)
+
+    def rows(self, **filters):
+        """
+        Get rows matching filters, sorted by path
+
+        Parameters
+        ----------
+        **filters
+            column=value pairs; value None matches missing entity, list or
+            tuple matches any of its values. Other entities from the file
+            name (e.g. cond="high") are matched against `entities`.
+
+        """
+        where, params, extra = [], [], {}
+        for column, value in filters.items():
+            if column not in COLUMNS:
+                extra[column] = value
+            elif value is None:
+                where.append(f"{column} IS NULL")
+            elif isinstance(value, (list, tuple, set)):
+                where.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(map(str, value))
+            else:
+                where.append(f"{column} = ?")
+                params.append(str(value))
+        query = "SELECT * FROM files"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY path"
+        res = [dict(r) for r in self.conn.execute(query, params)]
+        if extra:
+            res = [
+                r
+                for r in res
+                if all(
+                    json.loads(r["entities"]).get(k) == str(v)
+                    for k, v in extra.items()
+                )
+            ]
+        return res
+
+    def query(self, **filters):
+        """Get paths of files matching filters (see `rows`), sorted"""
+        return [Path(r["path"]) for r in self.rows(**filters)]
+
+    def subjects(self, stage=RAWDATA):
+        """Sorted subject labels with files at stage"""
+        return [
+            r[0]
+            for r in self.conn.execute(
+                "SELECT DISTINCT subject FROM files WHERE stage = ?"
+                " AND subject IS NOT NULL ORDER BY subject",
+                (stage,),
+            )
+        ]
+
+
+_manifest = None
+
+
+def get_manifest():
+    """Manifest of the dataset, located in derivatives"""
+    global _manifest
+    if _manifest is None:
+        _manifest = Manifest(dirs.cache / "manifest.sqlite")
+    return _manifest
+
+
+def update_manifest(fingerprints=True):
+    """Sync manifest with the dataset; doit python-action"""
+    n_changed, n_removed = get_manifest().update(fingerprints=fingerprints)
+    return dict(n_changed=n_changed, n_removed=n_removed)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update", help="scan the dataset")
+    update_parser.add_argument(
+        "--no-fingerprints",
+        action="store_true",
+        help="only record size and mtime of new files",
+    )
+    query_parser = subparsers.add_parser("query", help="list matching files")
+    for column in ["stage", "datatype", "suffix", "extension"]:
+        query_parser.add_argument(f"--{column}")
+    for column in ENTITIES.values():
+        query_parser.add_argument(f"--{column}")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        res = update_manifest(fingerprints=not args.no_fingerprints)
+        print(
+            f"{res['n_changed']} files added or changed,"
+            f" {res['n_removed']} removed"
+        )
+    else:
+        filters = {
+            k: v
+            for k, v in vars(args).items()
+            if k != "command" and v is not None
+        }
+        for path in get_manifest().query(**filters):
+            print(path)
@@ -0,0 +1,122 @@
+"""
+Morph source estimates of many trials with one sparse matrix product
+
+`SourceMorph.apply` morphs one SourceEstimate at a time, building a new
+SourceEstimate for every trial. A surface morph is a fixed sparse matrix, so
+`apply_morph` stacks trials side by side and morphs a chunk of them with a
+single sparse x dense product::
+
+    morphed = apply_morph(morph, X)  # X: trials x vertices_from x times
+
+Chunk size and dtype are set in ``cfg.morph_config``; "float32" halves the
+memory of the product and of its result.
+
+"""
+import numpy as np
+
+
+def _morph_mat(morph, dtype):
+    if morph.kind != "surface":
+        raise ValueError(
+            f"Only surface morphs can be applied in batches, got {morph.kind}"
+        )
+    return morph.morph_mat.astype(dtype).tocsr()
+
+
+def _check_vertices(morph, vertices):
+    for hemi, v_morph, v_data in zip(
+        ("lh", "rh"), morph.src_data["vertices_from"], vertices
+    ):
+        if not np.array_equal(v_morph, v_data):
+            raise ValueError(
+                f"Vertices of {hemi} of the data don't match the morph"
+            )
+
+
+def _iter_trial_chunks(morph, data, chunk_size):
+    """Chunks of trials of an array, or of an iterable of trials"""
+    if isinstance(data, np.ndarray):
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+        return
+    chunk = []
+    for trial in data:
+        if hasattr(trial, "vertices"):  # SourceEstimate
+            if not chunk:
+                _check_vertices(morph, trial.vertices)
+            trial = trial.data
+        chunk.append(trial)
+        if len(chunk) == chunk_size:
+            yield np.stack(chunk)
+            chunk = []
+    if chunk:
+        yield np.stack(chunk)
+
+
+def iter_apply_morph(morph, data, dtype=None, chunk_size=None):
+    """
+    Morph trials chunk by chunk
+
+    Parameters
+    ----------
+    morph : mne.SourceMorph
+        surface morph
+    data : array, shape (n_trials, n_vertices_from, n_times) | iterable
+        stacked trials, or an iterable of arrays of shape
+        (n_vertices_from, n_times) or of SourceEstimate, e.g. the generator
+        returned by apply_inverse_epochs(..., return_generator=True)
+    dtype : str | None
+        dtype of the product and the result; defaults to
+        cfg.morph_config["dtype"]
+    chunk_size : int | None
+        number of trials morphed at once; defaults to
+        cfg.morph_config["chunk_size"]
+
+    Yields
+    ------
+    array, shape (n_chunk_trials, n_vertices_to, n_times)
+        morphed trials of consecutive chunks
+
+    """
+    from metacog.config_parser import cfg
+
+    dtype = np.dtype(dtype or cfg.morph_config["dtype"])
+    chunk_size = chunk_size or cfg.morph_config["chunk_size"]
+    morph_mat = _morph_mat(morph, dtype)
+    for chunk in _iter_trial_chunks(morph, data, chunk_size):
+        n_trials, n_from, n_times = chunk.shape
+        if n_from != morph_mat.shape[1]:
+            raise ValueError(
+                f"Data have {n_from} vertices, morph expects"
+                f" {morph_mat.shape[1]}"
+            )
+        # trials side by side: (n_from, n_trials * n_times)
+        stacked = chunk.astype(dtype, copy=False).transpose(1, 0, 2)
+        morphed = morph_mat @ stacked.reshape(n_from, -1)
+        yield morphed.reshape(-1, n_trials, n_times).transpose(1, 0, 2)
+
+
+def apply_morph(morph, data, dtype=None, chunk_size=None):
+    """
+    Morph stacked trials
+
+    Same as morphing every trial with `SourceMorph.apply`, see
+    `iter_apply_morph` for parameters
+
+    Returns
+    -------
+    array, shape (n_trials, n_vertices_to, n_times)
+
+    """
+    chunks = iter_apply_morph(morph, data, dtype, chunk_size)
+    if not isinstance(data, np.ndarray):
+        return np.concatenate(list(chunks))
+    # preallocated, so that peak memory is the result and one chunk
+    out = None
+    start = 0
+    for chunk in chunks:
+        if out is None:
+            out = np.empty((len(data), *chunk.shape[1:]), chunk.dtype)
+        out[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return out
@@ -1,8 +1,8 @@
 from pathlib import Path
 from types import SimpleNamespace
 
-from metacog.config_parser import get_config
-BIDS_ROOT = get_config().BIDS_ROOT
+from metacog.config_parser import cfg
+BIDS_ROOT = cfg.BIDS_ROOT
 
 
 # ---------------------------- setup directories ---------------------------- #
@@ -32,12 +32,11 @@ dirs.inverse      = dirs.derivatives / "12-inverses"                # noqa
 dirs.sources      = dirs.derivatives / "13-sources"                 # noqa
 dirs.tfr          = dirs.derivatives / "15-tfr"                     # noqa
 dirs.tfr_average  = dirs.derivatives / "16-average_tfr"             # noqa
+dirs.group_epochs = dirs.derivatives / "group_epochs"               # noqa
+dirs.cluster_stats = dirs.derivatives / "cluster_stats"             # noqa
 dirs.reports      = dirs.derivatives / "99-reports"                 # noqa
-
-# create directories for derivatives
-for k, d in vars(dirs).items():
-    if k not in ("raw", "beh_raw", "bids_root"):
-        d.mkdir(exist_ok=True, parents=True)
+dirs.cache        = dirs.derivatives / "cache"                      # noqa
+# directories are not created here; whoever writes to a directory creates it
 
 crosstalk = str(dirs.sourcedata / "SSS_data" / "ct_sparse.fif")
 calibration = str(dirs.sourcedata / "SSS_data" / "sss_cal.dat")
@@ -0,0 +1,267 @@
+"""
+Memory-aware parallel scheduler for the doit tasks in dodo.py
+
+``doit -n N`` starts up to N tasks at once regardless of how much memory they
+need, so a few concurrent maxfilter/concatenation/ICA subtasks can exhaust
+RAM. This scheduler loads the same tasks from dodo.py and uses doit's
+dependency database to skip up-to-date ones, but starts a task only when its
+peak memory and threads fit into the machine-wide budget. Among the ready
+tasks the ones with the longest expected remaining path through the
+dependency graph go first.
+
+Task footprints come from ``cfg.scheduler_config`` (or ``meta["resources"]``
+of a task in dodo.py) and are replaced by the peak memory and wall time
+recorded in the run ledger (`metacog.ledger`) once a task has run.
+
+Usage (from the folder with dodo.py)::
+
+    python -m metacog.scheduler [task ...] [--mem-gb 32] [--cores 8]
+
+"""
+from argparse import ArgumentParser
+from collections import defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+import os
+from statistics import median
+
+from metacog.config_parser import cfg
+from metacog.ledger import read_runs
+
+Job = namedtuple("Job", ["name", "deps", "mem_gb", "threads", "duration"])
+
+
+def get_budget(mem_budget_gb=None, n_cores=None):
+    """Get memory (GB) and cores budget; defaults to most of the machine"""
+    if mem_budget_gb is None:
+        mem_budget_gb = cfg.scheduler_config["mem_budget_gb"]
+    if mem_budget_gb is None:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        mem_budget_gb = 0.8 * total / 1024 ** 3
+    if n_cores is None:
+        n_cores = cfg.scheduler_config["n_cores"] or os.cpu_count()
+    return mem_budget_gb, n_cores
+
+
+def estimate_resources(task_name, declared=None, history=()):
+    """
+    Estimate peak memory, threads and duration for a doit (sub)task
+
+    Parameters
+    ----------
+    task_name : str
+        full task name, e.g. "apply_maxfilter:sub-01_..._meg.fif"
+    declared : dict | None
+        resources declared for the task; missing keys are taken from
+        cfg.scheduler_config
+    history : list of dict
+        past runs as returned by `metacog.ledger.read_runs`
+
+    Returns
+    -------
+    mem_gb, threads, duration : float, int, float
+
+    """
+    basename = task_name.split(":")[0]
+    res = dict(cfg.scheduler_config["default"])
+    res.update(cfg.scheduler_config["resources"].get(basename, {}))
+    res.update(declared or {})
+
+    same_task = [r for r in history if r["task"] == task_name]
+    same_basename = [
+        r for r in history if r["task"].split(":")[0] == basename
+    ]
+    runs = same_task or same_basename
+    if runs:
+        factor = cfg.scheduler_config["mem_safety_factor"]
+        res["mem_gb"] = max(r["peak_rss_mb"] for r in runs) / 1024 * factor
+        res["duration"] = median(r["wall_time"] for r in runs)
+    return res["mem_gb"], res["threads"], res["duration"]
+
+
+def critical_path(jobs):
+    """
+    Length of the longest chain of dependent jobs starting at each job
+
+    Parameters
+    ----------
+    jobs : dict
+        job name -> Job
+
+    Returns
+    -------
+    dict
+        job name -> summed expected duration of the job and of the longest
+        chain of jobs waiting for it
+
+    """
+    dependents = defaultdict(list)
+    for job in jobs.values():
+        for dep in job.deps:
+            dependents[dep].append(job.name)
+
+    lengths = {}
+
+    def length(name):
+        if name not in lengths:
+            lengths[name] = jobs[name].duration + max(
+                (length(d) for d in dependents[name]), default=0
+            )
+        return lengths[name]
+
+    for name in jobs:
+        length(name)
+    return lengths
+
+
+def run_jobs(
+    jobs, executor, func, mem_budget_gb, n_cores, skip=None, on_done=None
+):
+    """
+    Run jobs respecting dependencies and memory and cores budget
+
+    Ready jobs are started in the order of decreasing critical path length
+    while their memory and threads fit into what is left of the budget. A job
+    which doesn't fit into the whole budget is started only when nothing else
+    is running.
+
+    Parameters
+    ----------
+    jobs : dict
+        job name -> Job; all dependencies must be in `jobs`
+    executor : concurrent.futures.Executor
+        pool to run the jobs with
+    func : callable
+        called in the pool as ``func(job)``; the job fails if it raises
+    mem_budget_gb : float
+        memory available for the jobs running at once
+    n_cores : int
+        cores available for the jobs running at once
+    skip : callable | None
+        called as ``skip(job_name)`` when the job is ready; if returns True
+        the job is considered done without running it
+    on_done : callable | None
+        called as ``on_done(job_name, result)`` when the job is finished;
+        result is the value returned by `func` or the exception it raised
+
+    Returns
+    -------
+    failed : list of str
+        names of jobs that failed or were not run because a dependency failed
+
+    """
+    priority = critical_path(jobs)
+    waiting = {name: set(job.deps) for name, job in jobs.items()}
+    ready, running, failed = [], {}, []
+    free_mem, free_cores = mem_budget_gb, n_cores
+
+    def release(name, ok):
+        for other in [n for n, deps in waiting.items() if name in deps]:
+            if other not in waiting:  # already dropped by a recursive call
+                continue
+            if ok:
+                waiting[other].remove(name)
+            else:
+                del waiting[other]
+                failed.append(other)
+                release(other, False)
+
+    def collect_ready():
+        found = True
+        while found:
+            found = False
+            for name in [n for n, deps in waiting.items() if not deps]:
+                del waiting[name]
+                if skip is not None and skip(name):
+                    release(name, True)
+                    found = True
+                else:
+                    ready.append(name)
+
+    collect_ready()
+    while ready or running:
+        ready.sort(key=lambda n: priority[n], reverse=True)
+        for name in list(ready):
+            job = jobs[name]
+            threads = min(job.threads, n_cores)
+            fits = job.mem_gb <= free_mem and threads <= free_cores
+            if fits or not running:
+                ready.remove(name)
+                running[executor.submit(func, job)] = name
+                free_mem -= job.mem_gb
+                free_cores -= threads
+
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            free_mem += jobs[name].mem_gb
+            free_cores += min(jobs[name].threads, n_cores)
+            try:
+                result = future.result()
+            except Exception as exc:
+                result = exc
+            ok = not isinstance(result, Exception)
+            if on_done is not None:
+                on_done(name, result)
+            if not ok:
+                failed.append(name)
+            release(name, ok)
+        collect_ready()
+    return failed + list(waiting)
+
+
+def load_dodo_tasks(dodo_path="dodo.py"):
+    """Load tasks from dodo file; returns (tasks dict, DOIT_CONFIG)"""
+    from doit.control import TaskControl
+    from doit.loader import get_module, load_tasks
+
+    dodo = get_module(dodo_path)
+    task_list = load_tasks(vars(dodo))
+    # sets task_dep implied by file_dep <-> targets
+    control = TaskControl(task_list)
+    return control.tasks, getattr(dodo, "DOIT_CONFIG", {})
+
+
+def select_tasks(tasks, selected):
+    """Get names of selected tasks and all tasks they depend on"""
+    res = set()
+    stack = list(selected)
+    while stack:
+        name = stack.pop()
+        if name not in res:
+            res.add(name)
+            stack.extend(tasks[name].task_dep)
+    return res
+
+
+def make_jobs(tasks, names, history=None):
+    """Create Job for each of selected doit tasks with estimated resources"""
+    history = read_runs() if history is None else history
+    jobs = {}
+    for name in names:
+        task = tasks[name]
+        declared = (getattr(task, "meta", None) or {}).get("resources")
+        if task.actions:
+            res = estimate_resources(name, declared, history)
+        else:
+            res = (0.0, 0, 0.0)  # group tasks do nothing
+        jobs[name] = Job(name, tuple(task.task_dep), *res)
+    return jobs
+
+
+def run(selected=(), dodo_path="dodo.py", mem_budget_gb=None, n_cores=None):
+    """Run selected tasks from dodo file with the memory-aware scheduler"""
+    from metacog.backends import Pipeline, ProcessPoolBackend
+
+    backend = ProcessPoolBackend(mem_budget_gb, n_cores)
+    return backend.run(Pipeline(selected, dodo_path))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("tasks", nargs="*", help="tasks to run")
+    parser.add_argument("--dodo", default="dodo.py", help="path to dodo file")
+    parser.add_argument("--mem-gb", type=float, help="memory budget, GB")
+    parser.add_argument("--cores", type=int, help="number of cores to use")
+    args = parser.parse_args()
+    ok = run(args.tasks, args.dodo, args.mem_gb, args.cores)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,197 @@
+"""
+Source estimates of all trials of a subject in one memory-mapped array
+
+Saving every trial as a lh/rh .stc pair leaves thousands of small files per
+subject which are then globbed and read one by one. `write_source_trials`
+writes the trials of a subject as three files sharing a path prefix, e.g.
+13-sources/sub-01/sub-01_stctrials:
+
+    <prefix>.npy        trials x vertices x times (or freqs)
+    <prefix>.parquet    one row per trial: condition and epochs metadata
+    <prefix>.npz        lh and rh vertex numbers, times or freqs, subject
+
+Writing is one sequential pass and `load_source_trials` memory-maps the
+array, so reading a subject takes milliseconds and selecting trials reads
+only the selected rows.
+
+"""
+from pathlib import Path
+
+import numpy as np
+
+SUFFIX = "stctrials"
+
+
+def source_trials_prefix(subj_dir, subject):
+    """Path prefix of source trials of subject in subj_dir"""
+    return Path(subj_dir) / f"sub-{subject}_{SUFFIX}"
+
+
+def source_trials_files(prefix):
+    """Paths of all files of source trials with prefix"""
+    prefix = Path(prefix)
+    return [prefix.with_suffix(ext) for ext in (".npy", ".parquet", ".npz")]
+
+
+def write_source_trials(
+    prefix,
+    data,
+    vertices,
+    axis,
+    metadata,
+    axis_name="times",
+    subject="fsaverage",
+    dtype=None,
+):
+    """
+    Write source estimates of all trials of a subject
+
+    Parameters
+    ----------
+    prefix : str | Path
+        path prefix of the written files, see `source_trials_prefix`
+    data : array, shape (n_trials, n_vertices, n_axis) | iterable of arrays
+        source estimates, or consecutive chunks of trials of it, e.g. from
+        `metacog.morph.iter_apply_morph`
+    vertices : list of array
+        lh and rh vertex numbers
+    axis : array, shape (n_axis,)
+        times, or freqs for source PSD
+    metadata : pandas.DataFrame
+        one row per trial
+    axis_name : "times" | "freqs"
+    subject : str
+        subject of the source space, e.g. "fsaverage" for morphed data
+    dtype : str | None
+        dtype of the stored array; defaults to the dtype of data
+
+    """
+    import pandas as pd
+
+    data_path, metadata_path, extra_path = source_trials_files(prefix)
+    data_path.parent.mkdir(exist_ok=True, parents=True)
+    n_trials = len(metadata)
+    n_vertices = sum(len(v) for v in vertices)
+
+    chunks = [data] if isinstance(data, np.ndarray) else data
+    X = None
+    start = 0
+    for chunk in chunks:
+        if X is None:
+            X = np.lib.format.open_memmap(
+                data_path,
+                mode="w+",
+                dtype=dtype or chunk.dtype,
+                shape=(n_trials, n_vertices, len(axis)),
+            )
+        X[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    if X is None or start != n_trials:
+        raise ValueError(
+            f"Got {start} trials of source estimates for {n_trials} rows of"
+            " metadata"
+        )
+    X.flush()
+    del X
+
+    metadata = pd.DataFrame(metadata).reset_index(drop=True)
+    metadata.to_parquet(metadata_path, index=False)
+    np.savez(
+        extra_path,
+        lh=vertices[0],
+        rh=vertices[1],
+        axis=np.asarray(axis),
+        axis_name=axis_name,
+        subject=subject,
+    )
+
+
+class SourceTrials:
+    """
+    Source estimates of trials of a subject
+
+    Attributes
+    ----------
+    data : array, shape (n_trials, n_vertices, n_axis)
+        read-only memory map, or in-memory array if trials were selected
+    metadata : pandas.DataFrame
+        one row per trial
+    vertices : list of array
+        lh and rh vertex numbers
+    axis : array
+        times, or freqs for source PSD
+    axis_name : "times" | "freqs"
+    subject : str
+        subject of the source space
+
+    """
+
+    def __init__(self, data, metadata, vertices, axis, axis_name, subject):
+        self.data = data
+        self.metadata = metadata
+        self.vertices = vertices
+        self.axis = axis
+        self.axis_name = axis_name
+        self.subject = subject
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        """Select trials by index, slice, mask or metadata query"""
+        if isinstance(idx, str):
+            idx = self.metadata.eval(idx).values
+        idx = np.atleast_1d(np.arange(len(self))[idx])
+        return SourceTrials(
+            np.asarray(self.data[idx]),
+            self.metadata.iloc[idx].reset_index(drop=True),
+            self.vertices,
+            self.axis,
+            self.axis_name,
+            self.subject,
+        )
+
+    def to_stc(self, i):
+        """Trial i as mne.SourceEstimate"""
+        from mne import SourceEstimate
+
+        step = self.axis[1] - self.axis[0] if len(self.axis) > 1 else 1.0
+        return SourceEstimate(
+            np.asarray(self.data[i]),
+            self.vertices,
+            tmin=self.axis[0],
+            tstep=step,
+            subject=self.subject,
+        )
+
+
+def load_source_trials(prefix):
+    """
+    Open source trials written by `write_source_trials`
+
+    Parameters
+    ----------
+    prefix : str | Path
+        path prefix of the files, see `source_trials_prefix`
+
+    Returns
+    -------
+    SourceTrials
+
+    """
+    import pandas as pd
+
+    data_path, metadata_path, extra_path = source_trials_files(prefix)
+    with np.load(extra_path) as extra:
+        vertices = [extra["lh"], extra["rh"]]
+        axis = extra["axis"]
+        axis_name = str(extra["axis_name"])
+        subject = str(extra["subject"])
+    return SourceTrials(
+        np.load(data_path, mmap_mode="r"),
+        pd.read_parquet(metadata_path),
+        vertices,
+        axis,
+        axis_name,
+        subject,
+    )
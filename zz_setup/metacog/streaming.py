@@ -0,0 +1,102 @@
+"""
+Bounded-memory processing of long raw recordings in overlapping chunks
+
+`process_raw_in_chunks` loads a chunk of a (not preloaded) raw together with
+some padding on both sides, processes it, drops the padding and writes the
+result to a temporary file, so at most one padded chunk is in memory at a
+time. The chunk files are then concatenated lazily and saved as one file,
+which mne does buffer by buffer.
+
+The result matches processing of the whole recording if the output at each
+sample depends only on the input within `overlap` seconds around it and if
+the processing is aligned to a grid of `step` samples (like the sliding
+windows of `mne.chpi.filter_chpi`): chunk boundaries are placed on that grid.
+
+"""
+from pathlib import Path
+import shutil
+
+import numpy as np
+from mne import concatenate_raws
+from mne.io import read_raw_fif
+
+
+def chunk_bounds(n_times, chunk_samples, pad_samples):
+    """
+    Split samples into chunks with padding
+
+    Returns
+    -------
+    list of tuple
+        (start, stop, padded_start, padded_stop) sample indices for each
+        chunk; padding is clipped to the recording boundaries
+
+    """
+    bounds = []
+    for start in range(0, n_times, chunk_samples):
+        stop = min(start + chunk_samples, n_times)
+        padded = max(start - pad_samples, 0), min(stop + pad_samples, n_times)
+        bounds.append((start, stop, *padded))
+    return bounds
+
+
+def process_raw_in_chunks(
+    raw, process, dest, chunk_duration, overlap, step=1, tmp_dir=None
+):
+    """
+    Process raw chunk by chunk and save the result
+
+    Parameters
+    ----------
+    raw : mne.io.Raw
+        raw to process; should not be preloaded to keep memory bounded.
+        Its annotations are copied to the result.
+    process : callable
+        called as ``process(chunk)`` with a preloaded raw chunk; returns the
+        processed raw of the same length (can modify chunk in place)
+    dest : str | Path
+        where to save the result
+    chunk_duration : float
+        length of chunks without padding, s
+    overlap : float
+        padding added to each side of a chunk, s
+    step : int
+        chunk boundaries are multiples of this number of samples
+    tmp_dir : str | Path | None
+        folder for chunk files; defaults to a hidden folder next to `dest`.
+        Removed when done.
+
+    """
+    dest = Path(dest)
+    sfreq = raw.info["sfreq"]
+    chunk_samples = int(np.ceil(chunk_duration * sfreq / step)) * step
+    pad_samples = int(np.ceil(overlap * sfreq / step)) * step
+    if tmp_dir is None:
+        tmp_dir = dest.parent / f".{dest.name}.chunks"
+    tmp_dir = Path(tmp_dir)
+    tmp_dir.mkdir(exist_ok=True, parents=True)
+
+    annotations = raw.annotations.copy()
+    try:
+        chunk_paths = []
+        bounds = chunk_bounds(raw.n_times, chunk_samples, pad_samples)
+        for i, (start, stop, pad_start, pad_stop) in enumerate(bounds):
+            chunk = raw.copy().crop(
+                raw.times[pad_start], raw.times[pad_stop - 1]
+            )
+            chunk.load_data()
+            res = process(chunk)
+            del chunk
+            first, last = start - pad_start, stop - pad_start - 1
+            res.crop(res.times[first], res.times[last])
+            chunk_paths.append(tmp_dir / f"chunk-{i:04d}_raw.fif")
+            res.save(chunk_paths[-1], overwrite=True)
+            del res
+
+        # lazily concatenated; saving reads one buffer at a time
+        result = concatenate_raws([read_raw_fif(p) for p in chunk_paths])
+        # drop boundary annotations added by concatenation
+        result.set_annotations(annotations)
+        result.save(dest, overwrite=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
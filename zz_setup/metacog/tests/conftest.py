@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from metacog import ledger
+from metacog.paths import dirs
+
+
+@pytest.fixture(autouse=True)
+def run_outputs(tmp_path, monkeypatch):
+    """Point the run ledger and script logs away from the source tree"""
+    monkeypatch.setattr(ledger, "ledger_path", tmp_path / "ledger.sqlite")
+    monkeypatch.setattr(dirs, "logs", tmp_path / "logs")
+
+
+def _make_meg_raw(n_sensors=102, sfreq=500.0, duration=30.0):
+    """Random data for a helmet of magnetometer and 2 gradiometer triplets"""
+    import mne
+    from mne.io.constants import FIFF
+
+    idx = np.arange(n_sensors)
+    z = 1 - 0.9 * (idx + 0.5) / n_sensors
+    theta = np.pi * (3 - np.sqrt(5)) * idx
+    r = np.sqrt(1 - z ** 2)
+    pos = 0.12 * np.c_[r * np.cos(theta), r * np.sin(theta), z]
+
+    names, coils, locs = [], [], []
+    for i, p in enumerate(pos):
+        ez = p / np.linalg.norm(p)
+        ex = np.cross([0.0, 0.0, 1.0], ez)
+        ex /= np.linalg.norm(ex)
+        ey = np.cross(ez, ex)
+        for suffix, coil, (a, b) in [
+            ("1", FIFF.FIFFV_COIL_VV_MAG_T3, (ex, ey)),
+            ("2", FIFF.FIFFV_COIL_VV_PLANAR_T1, (ex, ey)),
+            ("3", FIFF.FIFFV_COIL_VV_PLANAR_T1, (ey, -ex)),
+        ]:
+            names.append(f"MEG{i:03d}{suffix}")
+            coils.append(coil)
+            locs.append(np.r_[p, a, b, ez])
+    ch_types = ["mag", "grad", "grad"] * n_sensors
+    info = mne.create_info(names, sfreq, ch_types)
+    info["line_freq"] = 50.0
+    for ch, coil, loc in zip(info["chs"], coils, locs):
+        ch["coil_type"] = coil
+        ch["loc"][:] = loc
+
+    rng = np.random.RandomState(0)
+    times = np.arange(int(duration * sfreq)) / sfreq
+    data = 1e-12 * rng.randn(len(names), len(times))
+    data += 5e-12 * np.sin(2 * np.pi * info["line_freq"] * times)
+    return mne.io.RawArray(data, info, verbose=False)
+
+
+@pytest.fixture(scope="session")
+def make_meg_raw():
+    """Factory of random MEG recordings, see `_make_meg_raw`"""
+    return _make_meg_raw
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from metacog.backends import (
+    JobArrayBackend,
+    LocalJobArrayRunner,
+    Pipeline,
+    SerialBackend,
+)
+
+DODO = '''
+def write(targets):
+    for t in targets:
+        with open(t, "w") as f:
+            f.write("x")
+
+
+def task_raw():
+    for i in range(3):
+        yield dict(name=str(i), actions=[(write,)], targets=[f"raw{i}.txt"])
+
+
+def task_maxfilt():
+    for i in range(3):
+        yield dict(
+            name=str(i),
+            actions=[(write,)],
+            file_dep=[f"raw{i}.txt"],
+            targets=[f"maxfilt{i}.txt"],
+        )
+
+
+def task_concat():
+    return dict(
+        actions=[(write,)],
+        file_dep=[f"maxfilt{i}.txt" for i in range(3)],
+        targets=["concat.txt"],
+    )
+'''
+
+
+@pytest.fixture
+def dodo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i in range(3):
+        (tmp_path / f"raw{i}.txt").write_text("raw")
+    path = tmp_path / "dodo.py"
+    path.write_text(DODO.replace("def task_raw", "def _task_raw"))
+    return path
+
+
+def test_serial_backend_runs_tasks_in_dependency_order(dodo, tmp_path):
+    assert SerialBackend().run(Pipeline(["concat"], dodo))
+    assert (tmp_path / "concat.txt").read_text() == "x"
+
+
+def test_job_array_backend_emits_stages(dodo, tmp_path):
+    backend = JobArrayBackend(tmp_path / "jobs")
+    manifest_path = backend.emit(Pipeline(["concat"], dodo))
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    names = [s["name"] for s in manifest["stages"]]
+    assert names == ["00-maxfilt", "01-concat"]
+    assert manifest["stages"][0]["tasks"] == [f"maxfilt:{i}" for i in range(3)]
+    assert manifest["stages"][1]["deps"] == ["00-maxfilt"]
+    script = (tmp_path / "jobs" / "00-maxfilt.sh").read_text()
+    assert "#SBATCH --array=0-2" in script
+    submit = (tmp_path / "jobs" / "submit.sh").read_text()
+    assert "--dependency=afterok:$jid_0" in submit
+
+
+def test_local_runner_runs_job_arrays_and_saves_results(dodo, tmp_path):
+    manifest_path = JobArrayBackend(tmp_path / "jobs").emit(
+        Pipeline(["concat"], dodo)
+    )
+    assert LocalJobArrayRunner(manifest_path).run()
+    assert (tmp_path / "concat.txt").exists()
+
+    # everything is up-to-date in doit db now
+    manifest_path = JobArrayBackend(tmp_path / "jobs2").emit(
+        Pipeline(["concat"], dodo)
+    )
+    with open(manifest_path) as f:
+        assert json.load(f)["stages"] == []
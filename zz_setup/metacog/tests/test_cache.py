@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from metacog import cache as cache_module, fingerprint
+from metacog.cache import ResultCache, cached
+from metacog.config_parser import cfg
+from metacog.fingerprint import FingerprintCache
+
+
+@pytest.fixture
+def result_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        fingerprint,
+        "_cache",
+        FingerprintCache(tmp_path / "fingerprints.sqlite"),
+    )
+    cache = ResultCache(tmp_path / "results")
+    monkeypatch.setattr(cache_module, "_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def epochs_file(tmp_path):
+    path = tmp_path / "sub-01_epo.fif"
+    path.write_bytes(b"epochs")
+    return path
+
+
+def test_cached_keys_on_arguments_inputs_and_config(
+    result_cache, epochs_file, monkeypatch
+):
+    calls = []
+
+    @cached(
+        inputs=lambda scale, n_jobs: [epochs_file],
+        config=["subjects"],
+        ignore=["n_jobs"],
+    )
+    def load(scale, n_jobs=1):
+        calls.append(scale)
+        return np.arange(3) * scale
+
+    np.testing.assert_array_equal(load(2), [0, 2, 4])
+    load(2, n_jobs=4)
+    assert calls == [2]
+    load(3)
+    assert calls == [2, 3]
+
+    # re-epoching invalidates results
+    epochs_file.write_bytes(b"new epochs")
+    load(2)
+    assert calls == [2, 3, 2]
+
+    monkeypatch.setattr(cfg, "subjects", ["01"])
+    load(2)
+    assert calls == [2, 3, 2, 2]
+
+    (stats,) = result_cache.stats().values()
+    assert (stats["hits"], stats["misses"], stats["n_entries"]) == (1, 4, 4)
+    assert load.func(2) is not None
+
+
+def test_evicts_least_recently_used_over_quota(result_cache):
+    calls = []
+
+    @cached()
+    def load(i):
+        calls.append(i)
+        return np.zeros(1024 ** 2 // 8)  # 1 MB
+
+    for i in range(3):
+        load(i)
+    load(0)  # 1 is now least recently used
+    entry = next(result_cache.location.rglob("*.pkl"))
+    size_gb = entry.stat().st_size / 1024 ** 3
+
+    assert len(result_cache.evict(quota_gb=2.5 * size_gb)) == 1
+    load(0), load(2)
+    assert calls == [0, 1, 2]
+    load(1)
+    assert calls == [0, 1, 2, 1]
+    (stats,) = result_cache.stats().values()
+    assert (stats["hits"], stats["n_entries"]) == (3, 3)
+
+
+def test_key_covers_module_helpers_and_version(
+    result_cache, tmp_path, monkeypatch
+):
+    import importlib
+
+    module = tmp_path / "loaders.py"
+    source = (
+        "from metacog.cache import cached\n"
+        "def helper(x):\n"
+        "    return x + {}\n"
+        "@cached(version={!r})\n"
+        "def load(x):\n"
+        "    return helper(x)\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module.write_text(source.format(1, None))
+    loaders = importlib.import_module("loaders")
+    assert loaders.load(1) == 2
+
+    # editing a helper of the same module gives a new key
+    module.write_text(source.format(10, None))
+    loaders = importlib.reload(loaders)
+    assert loaders.load(1) == 11
+    module.write_text(source.format(10, "2"))
+    loaders = importlib.reload(loaders)
+    loaders.load(1)
+    (stats,) = result_cache.stats().values()
+    assert (stats["hits"], stats["misses"]) == (0, 3)
+
+
+def test_results_over_quota_are_not_cached(result_cache):
+    result_cache.quota_gb = 0.5 / 1024  # 0.5 MB
+
+    @cached()
+    def load(i):
+        return np.zeros(1024 ** 2 // 8)  # 1 MB
+
+    with pytest.warns(UserWarning, match="larger than the cache quota"):
+        load(0)
+    assert not [p for p in result_cache.location.rglob("*") if p.is_file()]
+    (stats,) = result_cache.stats().values()
+    assert stats["n_entries"] == 0
@@ -0,0 +1,251 @@
+import numpy as np
+import mne
+import pytest
+from scipy import sparse
+
+from metacog.cluster_stats import (
+    iter_within_permutations,
+    spatio_temporal_cluster_correlation_test,
+    spatio_temporal_cluster_lmm_test,
+    spatio_temporal_cluster_test,
+)
+from metacog.lmm import RandomInterceptLMM
+
+
+@pytest.fixture(scope="module")
+def groups():
+    rng = np.random.RandomState(0)
+    n_times, n_space = 40, 30
+    adjacency = sparse.random(n_space, n_space, density=0.1, random_state=rng)
+    adjacency = sparse.csr_matrix((adjacency + adjacency.T) > 0)
+    a = rng.randn(60, n_times, n_space)
+    b = rng.randn(50, n_times, n_space)
+    a[:, 10:20, :8] += 0.8
+    b[:, 25:30, 10:15] += 0.9
+    return a, b, adjacency
+
+
+def as_sets(clusters):
+    return sorted(tuple(sorted(zip(*c))) for c in clusters)
+
+
+@pytest.mark.parametrize(
+    "stat, stat_fun, threshold",
+    [("f", mne.stats.f_oneway, 3.0), ("t", mne.stats.ttest_ind_no_p, 2.0)],
+)
+def test_matches_mne(groups, stat, stat_fun, threshold):
+    a, b, adjacency = groups
+    kwargs = dict(
+        threshold=threshold, n_permutations=100, tail=1, adjacency=adjacency,
+        seed=3,
+    )
+    expected = mne.stats.spatio_temporal_cluster_test(
+        [a, b], stat_fun=stat_fun, buffer_size=None, verbose=False, **kwargs
+    )
+    T_obs, clusters, p_values, H0 = spatio_temporal_cluster_test(
+        [a, b], stat=stat, n_jobs=2, block_size=16, **kwargs
+    )
+    np.testing.assert_allclose(T_obs, expected[0], atol=1e-10)
+    assert as_sets(clusters) == as_sets(expected[1])
+    np.testing.assert_allclose(np.sort(p_values), np.sort(expected[2]))
+    np.testing.assert_allclose(H0, expected[3], rtol=1e-10)
+
+
+def test_negative_tail_mirrors_positive_tail(groups):
+    a, b, adjacency = groups
+    kwargs = dict(n_permutations=50, stat="t", adjacency=adjacency, seed=0)
+    neg = spatio_temporal_cluster_test([a, b], -2.0, tail=-1, **kwargs)
+    pos = spatio_temporal_cluster_test([-a, -b], 2.0, tail=1, **kwargs)
+    np.testing.assert_allclose(neg[0], -pos[0])
+    assert as_sets(neg[1]) == as_sets(pos[1])
+    np.testing.assert_allclose(neg[3], -pos[3])
+
+
+def test_no_clusters(groups):
+    a, b, adjacency = groups
+    T_obs, clusters, p_values, H0 = spatio_temporal_cluster_test(
+        [a, b], threshold=1e6, adjacency=adjacency, n_jobs=1
+    )
+    assert T_obs.shape == a.shape[1:]
+    assert clusters == [] and p_values.size == 0 and H0.size == 0
+
+
+@pytest.fixture(scope="module")
+def trials():
+    rng = np.random.RandomState(1)
+    n_times, n_space = 20, 10
+    subjects = np.repeat(np.arange(4), 30)
+    y = rng.randn(len(subjects)) + subjects
+    X = rng.randn(len(subjects), n_times, n_space)
+    X += 3 * subjects[:, None, None]
+    X[:, 5:12, 2:6] += 0.6 * y[:, None, None]
+    adjacency = sparse.diags([1, 1], [-1, 1], shape=(n_space, n_space))
+    return X, y, subjects, adjacency
+
+
+def test_correlation_t_values(trials):
+    from scipy import stats
+
+    X, y, subjects, adjacency = trials
+    T_obs, clusters, p_values, H0 = spatio_temporal_cluster_correlation_test(
+        X, y, subjects, n_permutations=50, adjacency=adjacency, seed=0,
+        n_jobs=2, block_size=8,
+    )
+    # correlation of data and y centered within subjects
+    means = [X[subjects == s].mean(0) for s in range(4)]
+    X_c = X - np.array(means)[subjects]
+    y_c = y - np.array([y[subjects == s].mean() for s in range(4)])[subjects]
+    r = stats.pearsonr(X_c[:, 7, 3], y_c)[0]
+    df = len(y) - 4 - 1
+    np.testing.assert_allclose(T_obs[7, 3], r * np.sqrt(df / (1 - r ** 2)))
+
+    assert len(H0) == 50 and p_values.min() == 1 / 50
+    effect = clusters[np.argmin(p_values)]
+    assert set(zip(*effect)) >= {(t, s) for t in range(6, 11) for s in (3, 4)}
+
+    serial = spatio_temporal_cluster_correlation_test(
+        X, y, subjects, n_permutations=50, adjacency=adjacency, seed=0,
+        n_jobs=1, block_size=16,
+    )
+    np.testing.assert_allclose(serial[3], H0)
+
+
+def test_permutations_stay_within_groups():
+    groups = np.array(["b", "a", "b", "c", "a", "b"])
+    blocks = list(iter_within_permutations(groups, 10, 4, seed=0))
+    assert [len(b) for b in blocks] == [4, 4, 2]
+    for order in np.concatenate(blocks):
+        np.testing.assert_array_equal(groups[order], groups)
+        assert sorted(order) == list(range(len(groups)))
+
+
+def test_cluster_lmm(trials):
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("patsy")
+    X, y, subjects, adjacency = trials
+    rng = np.random.RandomState(2)
+    metadata = pd.DataFrame(
+        dict(subject=subjects, confidence=y, is_correct=rng.rand(len(y)) > .3)
+    )
+    T_obs, clusters, p_values, H0 = spatio_temporal_cluster_lmm_test(
+        X * 1e-12, metadata, "~ is_correct + confidence", "confidence",
+        n_permutations=40, adjacency=adjacency, seed=0, n_jobs=1,
+        block_size=16,
+    )
+    fit = RandomInterceptLMM.from_formula(
+        "~ is_correct + confidence", metadata, "subject"
+    ).fit(X)
+    np.testing.assert_allclose(T_obs, fit["confidence"]["zvalues"], atol=1e-6)
+    assert len(H0) == 40 and p_values.min() == 1 / 40
+    effect = clusters[np.argmin(p_values)]
+    assert set(zip(*effect)) >= {(t, s) for t in range(6, 11) for s in (3, 4)}
+
+
+def test_sequential_stops_with_same_decisions(groups):
+    a, b, adjacency = groups
+    kwargs = dict(
+        threshold=6.0, n_permutations=1000, tail=1, adjacency=adjacency,
+        seed=0, n_jobs=2, block_size=16,
+    )
+    full = spatio_temporal_cluster_test([a, b], **kwargs)
+    seq = spatio_temporal_cluster_test([a, b], p_accept=0.05, **kwargs)
+    assert len(seq[3]) < 300
+    # same permutations, cut after a block
+    np.testing.assert_array_equal(seq[3], full[3][:len(seq[3])])
+    np.testing.assert_array_equal(seq[2] < 0.05, full[2] < 0.05)
+
+
+def test_interrupted_run_resumes(groups, tmp_path, monkeypatch):
+    from metacog import cluster_stats
+    from metacog.cluster_store import load_cluster_results
+
+    a, b, adjacency = groups
+    kwargs = dict(
+        threshold=6.0, tail=1, adjacency=adjacency, seed=0, n_jobs=1,
+        block_size=8,
+    )
+    X = [a, b]
+    expected = spatio_temporal_cluster_test(X, n_permutations=100, **kwargs)
+
+    group_block = cluster_stats._group_block
+    calls = []
+
+    def interrupted(orders):
+        calls.append(len(orders))
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        return group_block(orders)
+
+    prefix = tmp_path / "erp"
+    monkeypatch.setattr(cluster_stats, "_group_block", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        spatio_temporal_cluster_test(
+            X, n_permutations=100, save_path=prefix, **kwargs
+        )
+    monkeypatch.undo()
+    # a shorter run, extended by the rerun with all permutations
+    short = spatio_temporal_cluster_test(
+        X, n_permutations=40, save_path=prefix, **kwargs
+    )
+    np.testing.assert_array_equal(short[3], expected[3][:40])
+    res = spatio_temporal_cluster_test(
+        X, n_permutations=100, save_path=prefix, **kwargs
+    )
+    np.testing.assert_array_equal(res[3], expected[3])
+    np.testing.assert_array_equal(res[2], expected[2])
+
+    stored = load_cluster_results(prefix)
+    assert stored.config["n_permutations"] == 100
+    assert as_sets(stored.as_tuple()[1]) == as_sets(expected[1])
+    np.testing.assert_array_equal(stored.T_obs, expected[0])
+    # finished runs are read back without permuting
+    monkeypatch.setattr(cluster_stats, "_group_block", None)
+    again = spatio_temporal_cluster_test(
+        X, n_permutations=100, save_path=prefix, **kwargs
+    )
+    np.testing.assert_array_equal(again[3], expected[3])
+    assert not (tmp_path / "erp.ckpt").exists()
+
+
+def test_stale_store_is_recomputed(groups, tmp_path, monkeypatch):
+    from metacog import cluster_stats
+
+    a, b, adjacency = groups
+    kwargs = dict(
+        tail=1, adjacency=adjacency, n_permutations=50, n_jobs=1,
+        block_size=8,
+    )
+    X = [a, b]
+    prefix = tmp_path / "erp"
+    spatio_temporal_cluster_test(
+        X, threshold=6.0, seed=0, save_path=prefix, **kwargs
+    )
+
+    # a checkpoint left by an interrupted run of another test
+    group_block = cluster_stats._group_block
+    calls = []
+
+    def interrupted(orders):
+        calls.append(len(orders))
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return group_block(orders)
+
+    monkeypatch.setattr(cluster_stats, "_group_block", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        spatio_temporal_cluster_test(
+            X, threshold=5.0, seed=1, save_path=prefix, **kwargs
+        )
+    monkeypatch.undo()
+    assert (tmp_path / "erp.ckpt").exists()
+
+    for threshold, seed in [(4.0, 0), (6.0, 1)]:
+        expected = spatio_temporal_cluster_test(
+            X, threshold=threshold, seed=seed, **kwargs
+        )
+        res = spatio_temporal_cluster_test(
+            X, threshold=threshold, seed=seed, save_path=prefix, **kwargs
+        )
+        np.testing.assert_array_equal(res[3], expected[3])
+        np.testing.assert_array_equal(res[2], expected[2])
+        assert not (tmp_path / "erp.ckpt").exists()
@@ -0,0 +1,62 @@
+import numpy as np
+import mne
+import pytest
+
+from metacog import bp, dataset_specific_utils as dsu
+from metacog.config_parser import cfg
+from metacog.utils import BIDSPathTemplate
+
+EVENT_ID = {"answer/low": 1, "answer/high": 2, "question/low": 3}
+
+
+def make_epochs(n_epochs, seed):
+    ch_names = [f"MEG{i:03d}" for i in range(306)]
+    info = mne.create_info(ch_names, 100.0, ["grad", "grad", "mag"] * 102)
+    rng = np.random.RandomState(seed)
+    data = rng.randn(n_epochs, len(info["ch_names"]), 31)
+    events = np.c_[
+        np.arange(n_epochs) * 100,
+        np.zeros(n_epochs, int),
+        rng.randint(1, 4, n_epochs),
+    ]
+    return mne.EpochsArray(
+        data, info, events, tmin=-0.1, event_id=EVENT_ID, verbose=False
+    )
+
+
+@pytest.fixture
+def epochs_files(tmp_path, monkeypatch):
+    subjects = ["01", "02", "03"]
+    template = BIDSPathTemplate(
+        root=tmp_path, suffix="epo", extension=".fif",
+        template_vars=["subject"],
+    )
+    for i, subj in enumerate(subjects):
+        path = template.fpath(subject=subj)
+        path.parent.mkdir(parents=True)
+        make_epochs(12 + 5 * i, seed=i).save(path, verbose=False)
+    monkeypatch.setattr(bp, "epochs", template)
+    monkeypatch.setattr(cfg, "subjects", subjects)
+
+
+def assemble_epochs_reference(ep_type, average, ch_type):
+    """Growing implementation assemble_epochs used to have"""
+    X = np.empty((0, 204 if ch_type == "grad" else 102, 31))
+    y = np.empty(0)
+    for subj in cfg.subjects:
+        X_subj, y_subj = dsu.read_subject_epochs(
+            subj, ep_type, average, ch_type
+        )
+        X = np.r_[X, X_subj]
+        y = np.r_[y, y_subj]
+    return X, y
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+@pytest.mark.parametrize("average", [False, True])
+def test_assemble_epochs_matches_growing_arrays(epochs_files, n_jobs, average):
+    X, y = dsu.assemble_epochs.func("answer", average, "grad", n_jobs=n_jobs)
+    X_ref, y_ref = assemble_epochs_reference("answer", average, "grad")
+    assert X.shape == X_ref.shape and X.dtype == X_ref.dtype
+    np.testing.assert_array_equal(X, X_ref)
+    np.testing.assert_array_equal(y, y_ref)
@@ -0,0 +1,91 @@
+import numpy as np
+import mne
+import pandas as pd
+import pytest
+
+from metacog import bp, dataset_specific_utils as dsu
+from metacog.config_parser import cfg
+from metacog.epoch_store import build_epoch_store, load_epoch_store
+from metacog.utils import BIDSPathTemplate
+
+pytest.importorskip("pyarrow")
+
+EVENT_ID = {"answer": 4, "confidence": 5}
+
+
+def make_epochs(n_epochs, seed):
+    ch_names = [f"MEG{i:03d}" for i in range(306)]
+    info = mne.create_info(ch_names, 100.0, ["grad", "grad", "mag"] * 102)
+    rng = np.random.RandomState(seed)
+    data = rng.randn(n_epochs, len(info["ch_names"]), 41)
+    events = np.c_[
+        np.arange(n_epochs) * 100,
+        np.zeros(n_epochs, int),
+        rng.choice(list(EVENT_ID.values()), n_epochs),
+    ]
+    metadata = pd.DataFrame(
+        dict(
+            confidence=rng.randint(0, 100, n_epochs),
+            is_correct=rng.rand(n_epochs) > 0.5,
+            question_num=np.arange(n_epochs) // 2,
+        )
+    )
+    return mne.EpochsArray(
+        data, info, events, tmin=-0.2, event_id=EVENT_ID,
+        metadata=metadata, verbose=False,
+    )
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    subjects = ["01", "02", "03"]
+    template = BIDSPathTemplate(
+        root=tmp_path, suffix="epo", extension=".fif",
+        template_vars=["subject"],
+    )
+    for i, subj in enumerate(subjects):
+        path = template.fpath(subject=subj)
+        path.parent.mkdir(parents=True)
+        make_epochs(10 + 3 * i, seed=i).save(path, verbose=False)
+    monkeypatch.setattr(bp, "epochs", template)
+    monkeypatch.setattr(cfg, "subjects", subjects)
+
+    epochs_paths = {s: template.fpath(subject=s) for s in subjects}
+    store_dir = tmp_path / "group_epochs"
+    build_epoch_store(
+        epochs_paths, store_dir, events=EVENT_ID, ch_types=["grad", "mag"]
+    )
+    return store_dir
+
+
+@pytest.mark.parametrize("ch_type", ["grad", "mag"])
+def test_store_matches_assemble_epochs_new(store, ch_type):
+    X, metadata, times, info = load_epoch_store(
+        ch_type, "answer", baseline=(-0.2, 0), store_dir=store
+    )
+    X_ref, metadata_ref, times_ref, info_ref = dsu.assemble_epochs_new.func(
+        "answer", ch_type=ch_type
+    )
+    np.testing.assert_allclose(X, X_ref)
+    np.testing.assert_array_equal(times, times_ref)
+    assert info["ch_names"] == info_ref["ch_names"]
+    cols = ["subject", "confidence", "is_correct", "question_num"]
+    pd.testing.assert_frame_equal(
+        metadata[cols], metadata_ref[cols].reset_index(drop=True)
+    )
+    assert set(metadata.event) == {"answer"}
+
+
+def test_load_epoch_store_maps_and_selects(store):
+    X, metadata, _, _ = load_epoch_store("grad", store_dir=store)
+    assert isinstance(X, np.memmap) and not X.flags.writeable
+    assert X.shape == (10 + 13 + 16, 204, 41) and len(metadata) == len(X)
+
+    X_sel, metadata_sel, _, _ = load_epoch_store(
+        "grad", "confidence", subjects=["02"], store_dir=store
+    )
+    mask = (metadata.subject == "02") & (metadata.event == "confidence")
+    np.testing.assert_array_equal(X_sel, X[mask.values])
+    assert list(metadata_sel.question_num) == list(
+        metadata.question_num[mask]
+    )
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from metacog import executor, ledger
+
+
+SCRIPT = '''
+calls = []
+
+
+def write(dest, text):
+    calls.append(text)
+    with open(dest, "w") as f:
+        f.write(text)
+'''
+
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    monkeypatch.setattr(ledger, "ledger_path", tmp_path / "ledger.sqlite")
+    script_path = tmp_path / "01-some_script.py"
+    script_path.write_text(SCRIPT)
+    return script_path
+
+
+def test_load_script_imports_module_once(script):
+    assert executor.load_script(script) is executor.load_script(script)
+
+
+def test_script_action_is_doit_python_action(script):
+    func, args, kwargs = executor.script_action(script, "write", "dest", "a")
+    assert func is executor.run_script
+    assert args == [str(script), "write", ("dest", "a"), {}]
+    assert kwargs == {}
+
+
+def test_run_script_creates_target_dir_and_records_run(script, tmp_path):
+    dest = tmp_path / "out" / "res.txt"
+    task = SimpleNamespace(name="write:res.txt", targets=[str(dest)])
+    func, args, _ = executor.script_action(script, "write", dest, "a")
+
+    timings = func(*args, task=task)
+
+    assert dest.read_text() == "a"
+    assert executor.load_script(script).calls[-1] == "a"
+    assert timings["peak_rss_mb"] > 0
+    (record,) = ledger.read_runs()
+    assert (record["task"], record["func"]) == ("write:res.txt", "write")
+    assert record["stage"] == "write"
+    assert record["output_mb"] > 0
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from metacog import fingerprint
+from metacog.fingerprint import (
+    FingerprintCache,
+    FingerprintChecker,
+    file_digest,
+)
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / "raw.fif"
+    path.write_bytes(os.urandom(64 * 1024))
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = FingerprintCache(tmp_path / "fingerprints.sqlite")
+    monkeypatch.setattr(fingerprint, "_cache", cache)
+    return cache
+
+
+def test_file_digest_changes_with_content(data_file):
+    digest = file_digest(data_file)
+    assert digest.startswith("full:")
+    assert file_digest(data_file) == digest
+    data = bytearray(data_file.read_bytes())
+    data[100] ^= 1
+    data_file.write_bytes(data)
+    assert file_digest(data_file) != digest
+
+
+def test_file_digest_samples_large_files(data_file):
+    kwargs = dict(sample_above_mb=16 / 1024, n_blocks=4, block_kb=1)
+    digest = file_digest(data_file, **kwargs)
+    assert digest.startswith("sampled:")
+    data = bytearray(data_file.read_bytes())
+    data[-1] ^= 1  # last block is always sampled
+    data_file.write_bytes(data)
+    assert file_digest(data_file, **kwargs) != digest
+
+
+def test_cache_rehashes_only_on_stat_change(data_file, cache, monkeypatch):
+    calls = []
+    real_digest = fingerprint.file_digest
+
+    def counting_digest(*pargs, **kwargs):
+        calls.append(pargs[0])
+        return real_digest(*pargs, **kwargs)
+
+    monkeypatch.setattr(fingerprint, "file_digest", counting_digest)
+    first = cache.fingerprint(data_file)
+    assert cache.fingerprint(data_file) == first
+    assert len(calls) == 1
+
+    st = data_file.stat()
+    os.utime(data_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.digest(data_file) == first[3]
+    assert len(calls) == 2
+
+
+def test_checker_ignores_touch_and_detects_change(data_file, cache):
+    checker = FingerprintChecker()
+    state = checker.get_state(str(data_file), None)
+    stat = data_file.stat()
+    assert checker.get_state(str(data_file), state) is None
+    assert not checker.check_modified(str(data_file), stat, state)
+
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not checker.check_modified(str(data_file), data_file.stat(), state)
+
+    data_file.write_bytes(b"x" * stat.st_size)
+    assert checker.check_modified(str(data_file), data_file.stat(), state)
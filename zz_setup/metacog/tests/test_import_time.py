@@ -0,0 +1,69 @@
+"""Import budget: light metacog modules must not import heavy packages"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+# modules used by short CLI invocations and by worker pools
+LIGHT_MODULES = [
+    "metacog.config_parser",
+    "metacog.paths",
+    "metacog.ledger",
+    "metacog.executor",
+    "metacog.fingerprint",
+    "metacog.manifest",
+    "metacog.cache",
+    "metacog.tfr_store",
+    "metacog.scheduler",
+    "metacog.backends",
+    "metacog.cluster_stats",
+    "metacog.lmm",
+    "metacog.cluster_store",
+]
+HEAVY = ["mne", "matplotlib", "pandas"]
+
+# imported by dodo.py and every preprocessing script
+SCRIPT_MODULES = ["metacog.bp", "metacog.dataset_specific_utils"]
+PLOTTING = ["matplotlib.pyplot", "mpl_toolkits.axes_grid1"]
+
+
+def import_in_subprocess(module):
+    """Import module in a fresh interpreter; return the loaded modules"""
+    code = (
+        "import json, sys\n"
+        f"import {module}\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True
+    ).stdout
+    return set(json.loads(out.decode().splitlines()[-1]))
+
+
+# import time itself is not asserted: it depends on the machine's load, and
+# the heavy imports are what makes it slow
+@pytest.mark.parametrize("module", LIGHT_MODULES)
+def test_light_modules_dont_import_heavy(module):
+    modules = import_in_subprocess(module)
+    assert not modules & set(HEAVY)
+
+
+@pytest.mark.parametrize("module", SCRIPT_MODULES)
+def test_script_modules_dont_import_plotting(module):
+    modules = import_in_subprocess(module)
+    assert not modules & set(PLOTTING)
+
+
+def test_import_creates_no_directories():
+    code = (
+        "import pathlib\n"
+        "calls = []\n"
+        "pathlib.Path.mkdir = lambda self, *a, **kw: calls.append(self)\n"
+        "import metacog.bp, metacog.dataset_specific_utils\n"
+        "print(len(calls))\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True
+    ).stdout
+    assert out.decode().splitlines()[-1] == "0"
@@ -0,0 +1,114 @@
+import subprocess
+import sys
+
+import pytest
+
+from metacog import ledger
+
+
+@pytest.fixture
+def ledger_path(tmp_path, monkeypatch):
+    path = tmp_path / "ledger.sqlite"
+    monkeypatch.setattr(ledger, "ledger_path", path)
+    return path
+
+
+def make_run(task, wall_time, peak_rss_mb=100.0, config_hash="abc"):
+    return dict(
+        task=task,
+        stage=task.split(":")[0],
+        subject=ledger.get_subject(task),
+        wall_time=wall_time,
+        peak_rss_mb=peak_rss_mb,
+        read_mb=1.0,
+        write_mb=1.0,
+        input_mb=1.0,
+        config_hash=config_hash,
+    )
+
+
+def test_track_records_failed_runs(ledger_path, tmp_path):
+    src = tmp_path / "sub-01_raw.fif"
+    src.write_bytes(b"0" * 1024 ** 2)
+    task = "maxfilter:sub-01_raw.fif"
+    with pytest.raises(RuntimeError):
+        with ledger.track(task, "maxfilter", inputs=[src]):
+            raise RuntimeError
+
+    (run,) = ledger.read_runs(status=None)
+    assert run["status"] == "failed"
+    assert run["subject"] == "01"
+    assert run["input_mb"] == 1
+    assert run["run_id"] == ledger.run_id
+    assert ledger.read_runs() == []
+
+
+def test_track_main_records_script_run_at_exit(ledger_path, tmp_path):
+    script = tmp_path / "03-script.py"
+    dest = tmp_path / "sub-02_out.txt"
+    script.write_text(
+        "import sys\n"
+        "from metacog import ledger\n"
+        f"ledger.ledger_path = {str(ledger_path)!r}\n"
+        "ledger.track_main(__file__)\n"
+        "open(sys.argv[1], 'w').write('a' * 2 ** 20)\n"
+    )
+    subprocess.run([sys.executable, str(script), str(dest)], check=True)
+
+    (run,) = ledger.read_runs()
+    assert run["task"] == "03-script:sub-02_out.txt"
+    assert run["stage"] == "03-script"
+    assert run["output_mb"] == 1
+    assert run["write_mb"] >= 1
+
+
+def test_track_main_leaves_unknown_sizes_null(ledger_path, tmp_path):
+    script = tmp_path / "09-script.py"
+    script.write_text(
+        "from metacog import ledger\n"
+        f"ledger.ledger_path = {str(ledger_path)!r}\n"
+        "ledger.track_main(__file__)\n"
+    )
+    subprocess.run([sys.executable, str(script), "01"], check=True)
+
+    (run,) = ledger.read_runs()
+    assert run["task"] == "09-script:01"
+    assert run["input_mb"] is None and run["output_mb"] is None
+
+    runs = [make_run("ica:sub-01", 10), make_run("ica:sub-02", 10)]
+    runs[1]["input_mb"] = None
+    (ica,) = ledger.slowest_stages(runs)
+    assert ica["input_mb"] == 1.0
+
+
+def test_slowest_stages_use_latest_run_of_each_task():
+    runs = [
+        make_run("ica:sub-01", 100),
+        make_run("ica:sub-01", 10),
+        make_run("ica:sub-02", 20),
+        make_run("epochs:sub-01", 5),
+    ]
+    ica, epochs = ledger.slowest_stages(runs)
+    assert (ica["stage"], ica["n_tasks"], ica["total_wall"]) == ("ica", 2, 30)
+    assert epochs["stage"] == "epochs"
+
+
+def test_regressions_compare_latest_run_with_previous_ones():
+    runs = [
+        make_run("ica:sub-01", 10),
+        make_run("ica:sub-01", 12),
+        make_run("ica:sub-01", 30, config_hash="def"),
+        make_run("ica:sub-02", 10),
+        make_run("ica:sub-02", 11),
+    ]
+    (reg,) = ledger.regressions(runs, threshold=1.5)
+    assert (reg["task"], reg["metric"]) == ("ica:sub-01", "wall_time")
+    assert reg["ratio"] == pytest.approx(30 / 11)
+    assert reg["config_changed"]
+
+
+def test_outliers_find_subjects_far_from_stage_median():
+    runs = [make_run(f"ica:sub-{i:02d}", 10 + i % 3) for i in range(10)]
+    runs.append(make_run("ica:sub-99", 60, peak_rss_mb=101))
+    (out,) = ledger.outliers(runs)
+    assert (out["subject"], out["metric"]) == ("99", "wall_time")
@@ -0,0 +1,111 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from metacog.lmm import RandomInterceptLMM
+
+
+@pytest.fixture(scope="module")
+def trials():
+    rng = np.random.default_rng(0)
+    n_subjects = 12
+    subjects = np.repeat(np.arange(n_subjects), rng.integers(30, 60, 12))
+    n = len(subjects)
+    metadata = pd.DataFrame(
+        dict(
+            subject=[f"{s:02d}" for s in subjects],
+            confidence=rng.integers(0, 100, n).astype(float),
+            is_correct=rng.random(n) > 0.3,
+        )
+    )
+    n_channels, n_times = 3, 4
+    subject_sd = np.linspace(0.5, 2, n_channels * n_times)
+    u = rng.standard_normal((n_subjects, n_channels * n_times)) * subject_sd
+    effect = 0.01 * metadata.confidence.values[:, np.newaxis]
+    Y = u[subjects] + rng.standard_normal((n, n_channels * n_times)) + effect
+    return metadata, Y.reshape(n, n_channels, n_times) * 1e-12
+
+
+def test_fit_matches_statsmodels(trials):
+    smf = pytest.importorskip("statsmodels.formula.api")
+    metadata, Y = trials
+    model = RandomInterceptLMM.from_formula(
+        "data ~ is_correct * confidence", metadata, groups="subject"
+    )
+    res = model.fit(Y, batch_size=5)
+    assert res.params.shape == (4, 3, 4) and res.scale.shape == (3, 4)
+    assert res.exog_names[1:] == [
+        "is_correct[T.True]", "confidence", "is_correct[T.True]:confidence"
+    ]
+
+    for ch, t in [(0, 0), (1, 2), (2, 3)]:
+        df = metadata.assign(data=Y[:, ch, t] * 1e12)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = smf.mixedlm(
+                "data ~ is_correct * confidence", df, groups=df.subject
+            ).fit(reml=True)
+        np.testing.assert_allclose(
+            res.params[:, ch, t] * 1e12, expected.fe_params, rtol=1e-4
+        )
+        # statsmodels' errors come from the Hessian of all parameters
+        np.testing.assert_allclose(
+            res.bse[:, ch, t] * 1e12, expected.bse[:4], rtol=5e-3
+        )
+        np.testing.assert_allclose(
+            res.group_var[ch, t] * 1e24, expected.cov_re.iloc[0, 0],
+            rtol=1e-3,
+        )
+    np.testing.assert_allclose(
+        res["confidence"]["pvalues"], res.pvalues[2]
+    )
+
+
+def test_fit_does_not_depend_on_units(trials):
+    metadata, Y = trials
+    model = RandomInterceptLMM.from_formula(
+        "~ is_correct * confidence", metadata, groups="subject"
+    )
+    res = model.fit(Y * 1e12)
+    # squares in the REML sums underflow float64 unless rescaled
+    tiny = model.fit(Y * 1e-150)
+    np.testing.assert_allclose(tiny.params * 1e162, res.params, rtol=1e-6)
+    np.testing.assert_allclose(tiny.bse * 1e162, res.bse, rtol=1e-6)
+    np.testing.assert_allclose(tiny.pvalues, res.pvalues, rtol=1e-6)
+
+
+def test_no_group_variance_gives_ols(trials):
+    metadata, Y = trials
+    rng = np.random.default_rng(1)
+    Y = rng.standard_normal((len(metadata), 5)) * 0.01
+    model = RandomInterceptLMM.from_formula(
+        "~ confidence", metadata, groups="subject"
+    )
+    res = model.fit(Y)
+    ols = np.linalg.lstsq(model.exog, Y, rcond=None)[0]
+    at_zero = res.gamma == 0
+    assert at_zero.any()
+    np.testing.assert_allclose(res.params[:, at_zero], ols[:, at_zero])
+
+
+def test_warm_start_matches_cold_fit(trials):
+    metadata, Y = trials
+    model = RandomInterceptLMM.from_formula(
+        "~ is_correct * confidence", metadata, groups="subject"
+    )
+    Y = Y.reshape(len(Y), -1) * 1e12
+    rho0 = model.fit_stats(model.sufficient_stats(Y))[3]
+    # labels permuted within subjects, as in cluster-LME permutations
+    rng = np.random.default_rng(2)
+    order = np.arange(len(Y))
+    for subject in np.unique(metadata.subject):
+        idx = np.flatnonzero(metadata.subject == subject)
+        order[idx] = rng.permutation(idx)
+    stats = model.sufficient_stats(Y, exog=model.exog[order])
+    cold = model.fit_stats(stats)
+    # far from the observed ratio, so that some searches leave the bracket
+    warm = model.fit_stats(stats, rho0=np.clip(rho0 + 0.05, 0, 0.9))
+    for c, w in zip(cold, warm):
+        np.testing.assert_allclose(w, c, rtol=1e-5, atol=1e-7)
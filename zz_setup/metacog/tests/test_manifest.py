@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from metacog import manifest
+from metacog.manifest import Manifest, parse_name
+from metacog.paths import dirs
+
+
+def test_parse_name():
+    name = "sub-01_task-rest_run-2_proc-sss_meg.fif"
+    entities, suffix, ext = parse_name(name)
+    assert entities == dict(sub="01", task="rest", run="2", proc="sss")
+    assert (suffix, ext) == ("meg", ".fif")
+
+    entities, suffix, ext = parse_name("sub-01_cond-high_trial-3-rh.stc")
+    assert entities == dict(sub="01", cond="high", trial="3")
+    assert (suffix, ext) == (None, "-rh.stc")
+
+    assert parse_name("dataset_description.json") == ({}, None, ".json")
+
+    name = "sub-01_parc-aparc.a2009s_trial-000.npy"
+    entities, suffix, ext = parse_name(name)
+    assert entities == dict(sub="01", parc="aparc.a2009s", trial="000")
+    assert (suffix, ext) == (None, ".npy")
+    assert parse_name("sub-01_T1w.nii.gz") == ({"sub": "01"}, "T1w", ".nii.gz")
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    bids_root = tmp_path / "BIDS"
+    monkeypatch.setattr(dirs, "bids_root", bids_root)
+    monkeypatch.setattr(dirs, "derivatives", bids_root / "derivatives")
+    monkeypatch.setattr(
+        manifest, "SKIP_DIRS", {bids_root / "derivatives" / "cache"}
+    )
+    files = [
+        "sub-01/meg/sub-01_task-rest_run-1_meg.fif",
+        "sub-02/meg/sub-02_task-rest_run-1_meg.fif",
+        "derivatives/03-maxfilter/sub-01/meg/"
+        "sub-01_task-rest_run-1_proc-sss_meg.fif",
+        "derivatives/cache/fingerprints.sqlite",
+    ]
+    for f in files:
+        (bids_root / f).parent.mkdir(parents=True, exist_ok=True)
+        (bids_root / f).write_bytes(f.encode())
+    return bids_root
+
+
+def test_update_is_incremental(dataset, tmp_path, monkeypatch):
+    hashed = []
+    cache = manifest.get_cache()
+    monkeypatch.setattr(
+        cache, "digest", lambda path, stat=None: hashed.append(path) or "x"
+    )
+    index = Manifest(tmp_path / "manifest.sqlite")
+
+    assert index.update() == (3, 0)
+    assert len(hashed) == 3
+    assert index.update() == (0, 0)
+    assert len(hashed) == 3
+
+    raw = dataset / "sub-02/meg/sub-02_task-rest_run-1_meg.fif"
+    os.remove(raw)
+    new = dataset / "sub-01/meg/sub-01_task-rest_run-2_meg.fif"
+    new.write_bytes(b"run 2")
+    assert index.update() == (1, 1)
+    assert hashed[-1] == str(new)
+
+
+def test_query(dataset, tmp_path):
+    index = Manifest(tmp_path / "manifest.sqlite")
+    index.update(fingerprints=False)
+
+    raws = index.query(stage="rawdata", suffix="meg")
+    assert [p.name for p in raws] == [
+        "sub-01_task-rest_run-1_meg.fif",
+        "sub-02_task-rest_run-1_meg.fif",
+    ]
+    (sss,) = index.query(stage="03-maxfilter", subject="01")
+    assert index.rows(path=str(sss))[0]["processing"] == "sss"
+    assert index.query(processing=None, subject=["02", "03"]) == raws[1:]
+    assert index.subjects() == ["01", "02"]
+
+    stc = dataset / "derivatives/13-sources/sub-01/sub-01_cond-low-lh.stc"
+    stc.parent.mkdir(parents=True)
+    stc.write_bytes(b"")
+    index.add([stc])
+    assert index.query(stage="13-sources", cond="low") == [stc]
+
+
+def test_get_stage(dataset, tmp_path):
+    derivatives = dataset / "derivatives"
+    assert manifest.get_stage(derivatives / "09-epochs/x.fif") == "09-epochs"
+    assert manifest.get_stage(derivatives / "x.json") is None
+    assert manifest.get_stage(dataset / "sub-01") == manifest.RAWDATA
+    assert manifest.get_stage(tmp_path / "elsewhere.fif") is None
@@ -0,0 +1,63 @@
+import numpy as np
+import mne
+import pytest
+from scipy import sparse
+
+from metacog.morph import apply_morph, iter_apply_morph
+
+
+@pytest.fixture
+def morph():
+    rng = np.random.RandomState(0)
+    vertices_from = [np.arange(0, 40, 2), np.arange(0, 30, 3)]
+    vertices_to = [np.arange(50), np.arange(45)]
+    morph_mat = sparse.random(95, 30, density=0.1, random_state=rng)
+    return mne.SourceMorph(
+        "sample", "fsaverage", "surface", None, None, None, vertices_to,
+        None, False, morph_mat.tocsr(), vertices_to, None, None, None, None,
+        dict(vertices_from=vertices_from), None,
+    )
+
+
+def make_stcs(morph, n_trials):
+    rng = np.random.RandomState(1)
+    return [
+        mne.SourceEstimate(
+            rng.randn(30, 7), morph.src_data["vertices_from"], tmin=0,
+            tstep=0.01, subject="sample",
+        )
+        for _ in range(n_trials)
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 100])
+def test_apply_morph_matches_morphing_each_trial(morph, chunk_size):
+    stcs = make_stcs(morph, 10)
+    expected = np.stack([morph.apply(s).data for s in stcs])
+    X = np.stack([s.data for s in stcs])
+
+    morphed = apply_morph(morph, X, dtype="float64", chunk_size=chunk_size)
+    np.testing.assert_allclose(morphed, expected, rtol=1e-12)
+
+    chunks = list(
+        iter_apply_morph(morph, iter(stcs), "float64", chunk_size)
+    )
+    assert len(chunks) == int(np.ceil(10 / chunk_size))
+    np.testing.assert_allclose(np.concatenate(chunks), expected, rtol=1e-12)
+
+
+def test_apply_morph_float32(morph):
+    stcs = make_stcs(morph, 5)
+    expected = np.stack([morph.apply(s).data for s in stcs])
+    morphed = apply_morph(
+        morph, np.stack([s.data for s in stcs]), dtype="float32"
+    )
+    assert morphed.dtype == np.float32
+    np.testing.assert_allclose(morphed, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_apply_morph_checks_vertices(morph):
+    stc = make_stcs(morph, 1)[0]
+    stc.vertices[0] = stc.vertices[0] + 1
+    with pytest.raises(ValueError, match="lh"):
+        apply_morph(morph, [stc])
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep
+
+import pytest
+
+from metacog.scheduler import Job, critical_path, estimate_resources, run_jobs
+
+
+@pytest.fixture
+def jobs():
+    # a -> c, b -> c, c -> d; b is on the longer path
+    return {
+        "a": Job("a", (), mem_gb=4, threads=1, duration=1),
+        "b": Job("b", (), mem_gb=4, threads=1, duration=5),
+        "c": Job("c", ("a", "b"), mem_gb=6, threads=2, duration=1),
+        "d": Job("d", ("c",), mem_gb=1, threads=1, duration=1),
+    }
+
+
+class Recorder:
+    def __init__(self, fail=()):
+        self.lock = Lock()
+        self.mem = 0
+        self.max_mem = 0
+        self.order = []
+        self.fail = fail
+
+    def __call__(self, job):
+        with self.lock:
+            self.order.append(job.name)
+            self.mem += job.mem_gb
+            self.max_mem = max(self.max_mem, self.mem)
+        sleep(0.01)
+        with self.lock:
+            self.mem -= job.mem_gb
+        if job.name in self.fail:
+            raise RuntimeError(job.name)
+        return job.name
+
+
+def test_critical_path_sums_longest_chain_of_dependents(jobs):
+    assert critical_path(jobs) == {"a": 3, "b": 7, "c": 2, "d": 1}
+
+
+def test_run_jobs_respects_dependencies_and_memory_budget(jobs):
+    rec = Recorder()
+    with ThreadPoolExecutor(4) as executor:
+        failed = run_jobs(jobs, executor, rec, mem_budget_gb=6, n_cores=4)
+    assert failed == []
+    assert rec.order == ["b", "a", "c", "d"]
+    assert rec.max_mem <= 6
+
+
+def test_run_jobs_runs_oversized_job_alone(jobs):
+    rec = Recorder()
+    with ThreadPoolExecutor(4) as executor:
+        failed = run_jobs(jobs, executor, rec, mem_budget_gb=3, n_cores=4)
+    assert failed == []
+    assert rec.max_mem == 6
+
+
+def test_run_jobs_skips_dependents_of_failed_job(jobs):
+    rec = Recorder(fail=("a",))
+    results = {}
+    with ThreadPoolExecutor(4) as executor:
+        failed = run_jobs(
+            jobs, executor, rec, 16, 4, on_done=results.__setitem__
+        )
+    assert sorted(failed) == ["a", "c", "d"]
+    assert isinstance(results["a"], RuntimeError)
+    assert results["b"] == "b"
+
+
+def test_run_jobs_doesnt_run_skipped_jobs(jobs):
+    rec = Recorder()
+    with ThreadPoolExecutor(4) as executor:
+        run_jobs(jobs, executor, rec, 16, 4, skip=lambda n: n in ("a", "c"))
+    assert sorted(rec.order) == ["b", "d"]
+
+
+def test_estimate_resources_prefers_past_runs():
+    name = "apply_maxfilter:sub-01_task-rest_meg.fif"
+    mem_gb, threads, duration = estimate_resources(name, {"threads": 3})
+    assert threads == 3 and mem_gb > 0 and duration > 0
+
+    history = [
+        dict(task=name, wall_time=10.0, peak_rss_mb=1024.0),
+        dict(task=name, wall_time=30.0, peak_rss_mb=2048.0),
+    ]
+    mem_gb_hist, _, duration_hist = estimate_resources(name, None, history)
+    assert duration_hist == 20.0
+    assert 2 <= mem_gb_hist < 3
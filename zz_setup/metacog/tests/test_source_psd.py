@@ -0,0 +1,63 @@
+import numpy as np
+import mne
+import pytest
+
+from metacog.source_psd import SourcePSD
+
+ACTIVE = (0.25, 1.0)
+BASELINE = (-1.0, -0.25)
+
+
+@pytest.fixture(scope="module")
+def epochs_inv(make_meg_raw):
+    raw = make_meg_raw(sfreq=250.0, duration=40.0)
+    n = 12
+    events = np.c_[
+        np.arange(1, n + 1) * 600, np.zeros(n, int), [4, 5] * (n // 2)
+    ]
+    epochs = mne.Epochs(
+        raw, events, dict(high=4, low=5), tmin=-1, tmax=1, baseline=None,
+        preload=True, verbose=False,
+    )
+    sphere = mne.make_sphere_model((0, 0, 0), 0.09, verbose=False)
+    src = mne.setup_volume_source_space(
+        pos=20.0, sphere=sphere, exclude=10.0, verbose=False
+    )
+    fwd = mne.make_forward_solution(
+        epochs.info, None, src, sphere, verbose=False
+    )
+    cov = mne.make_ad_hoc_cov(epochs.info, verbose=False)
+    inv = mne.minimum_norm.make_inverse_operator(
+        epochs.info, fwd, cov, loose=1.0, depth=None, verbose=False
+    )
+    return epochs, inv
+
+
+def test_ratio_matches_mne_on_cropped_epochs(epochs_inv):
+    from mne.minimum_norm import compute_source_psd_epochs
+
+    epochs, inv = epochs_inv
+    engine = SourcePSD(inv, lambda2=2, fmin=2, fmax=30, batch_size=4)
+    for cond in ("high", "low"):
+        stcs = {
+            name: compute_source_psd_epochs(
+                epochs[cond].copy().crop(*win), inv, lambda2=2, fmin=2,
+                fmax=30, verbose=False,
+            )
+            for name, win in (("active", ACTIVE), ("baseline", BASELINE))
+        }
+        expected = np.stack(
+            [a.data / b.data for a, b in zip(*stcs.values())]
+        )
+        freqs, ratio = engine.ratio(epochs[cond], ACTIVE, BASELINE)
+        np.testing.assert_allclose(ratio, expected, rtol=1e-8)
+        np.testing.assert_allclose(freqs, stcs["active"][0].times)
+        np.testing.assert_allclose(freqs, engine.freqs(epochs, ACTIVE))
+    assert len(engine._kernels) == 1 and len(engine._tapers) == 1
+
+
+def test_ratio_checks_window_lengths(epochs_inv):
+    epochs, inv = epochs_inv
+    engine = SourcePSD(inv, fmin=2, fmax=30)
+    with pytest.raises(ValueError, match="same length"):
+        engine.ratio(epochs[:2], (0, 1), (-1, -0.5))
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from metacog.source_store import (
+    load_source_trials, source_trials_prefix, write_source_trials,
+)
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def trials():
+    rng = np.random.RandomState(0)
+    vertices = [np.array([0, 5, 9]), np.array([1, 2])]
+    data = rng.randn(6, 5, 4)
+    metadata = pd.DataFrame(
+        dict(cond=["high"] * 3 + ["low"] * 3, confidence=[90, 70, 80, 5, 9, 1])
+    )
+    return data, vertices, metadata
+
+
+def test_roundtrip_from_chunks(trials, tmp_path):
+    data, vertices, metadata = trials
+    prefix = source_trials_prefix(tmp_path / "sub-01", "01")
+    chunks = (data[i:i + 4] for i in range(0, len(data), 4))
+    write_source_trials(
+        prefix, chunks, vertices, np.arange(2.0, 6.0), metadata,
+        axis_name="freqs", dtype="float32",
+    )
+
+    src = load_source_trials(prefix)
+    assert isinstance(src.data, np.memmap) and src.data.dtype == np.float32
+    np.testing.assert_allclose(src.data, data, rtol=1e-6)
+    pd.testing.assert_frame_equal(src.metadata, metadata)
+    assert src.axis_name == "freqs" and src.subject == "fsaverage"
+
+    low = src["cond == 'low' and confidence > 2"]
+    np.testing.assert_array_equal(low.data, src.data[[3, 4]])
+    assert list(low.metadata.confidence) == [5, 9]
+
+    stc = src.to_stc(1)
+    assert stc.tmin == 2.0 and stc.tstep == 1.0
+    np.testing.assert_array_equal(stc.vertices[0], vertices[0])
+    np.testing.assert_array_equal(stc.data, src.data[1])
+
+
+def test_write_checks_number_of_trials(trials, tmp_path):
+    data, vertices, metadata = trials
+    with pytest.raises(ValueError, match="5 trials"):
+        write_source_trials(
+            tmp_path / "sub-01_stctrials", data[:5], vertices, np.arange(4),
+            metadata,
+        )
@@ -0,0 +1,55 @@
+import numpy as np
+import mne
+import pytest
+
+from metacog.streaming import chunk_bounds, process_raw_in_chunks
+
+
+def maxfilter(raw):
+    mne.chpi.filter_chpi(raw, allow_line_only=True, verbose=False)
+    return mne.preprocessing.maxwell_filter(
+        raw,
+        origin=(0.0, 0.0, 0.04),
+        coord_frame="meg",
+        skip_by_annotation=[],
+        verbose=False,
+    )
+
+
+@pytest.fixture
+def raw_path(tmp_path, make_meg_raw):
+    path = tmp_path / "sub-01_raw.fif"
+    raw = make_meg_raw()
+    raw.set_annotations(mne.Annotations([3.0, 13.5], [1.0, 2.0], "BAD"))
+    raw.save(path, verbose=False)
+    return path
+
+
+def test_chunk_bounds_cover_recording_and_clip_padding():
+    bounds = chunk_bounds(25, chunk_samples=10, pad_samples=3)
+    assert bounds == [(0, 10, 0, 13), (10, 20, 7, 23), (20, 25, 17, 25)]
+
+
+def test_chunked_maxfilter_matches_whole_recording(raw_path, tmp_path):
+    raw = mne.io.read_raw_fif(raw_path, preload=True, verbose=False)
+    expected = maxfilter(raw).get_data()
+
+    chunk_lengths = []
+
+    def process(chunk):
+        chunk_lengths.append(chunk.n_times)
+        return maxfilter(chunk)
+
+    lazy = mne.io.read_raw_fif(raw_path, verbose=False)
+    dest = tmp_path / "sub-01_proc-sss_raw.fif"
+    # 10 ms filter_chpi step is 5 samples
+    process_raw_in_chunks(lazy, process, dest, 6.0, 1.0, step=5)
+
+    res = mne.io.read_raw_fif(dest, verbose=False)
+    assert max(chunk_lengths) == (6 + 2 * 1) * 500
+    np.testing.assert_allclose(
+        res.get_data(), expected, atol=1e-6 * np.abs(expected).max()
+    )
+    assert list(res.annotations.onset) == list(raw.annotations.onset)
+    # temporary chunk files are removed
+    assert set(tmp_path.iterdir()) == {raw_path, dest}
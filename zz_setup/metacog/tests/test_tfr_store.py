@@ -0,0 +1,110 @@
+import numpy as np
+import mne
+import pandas as pd
+import pytest
+
+from metacog.config_parser import cfg
+from metacog.tfr_store import TFRStore, write_tfr_store
+
+pytest.importorskip("h5py")
+pytest.importorskip("h5io")
+pytest.importorskip("hdf5plugin")
+
+EVENT_ID = {"answer/high": 4, "answer/low": 5}
+
+
+@pytest.fixture
+def tfr():
+    info = mne.create_info(
+        [f"MEG{i:03d}" for i in range(30)], 100.0, ["mag", "grad", "grad"] * 10
+    )
+    rng = np.random.RandomState(0)
+    n_epochs = 20
+    events = np.c_[
+        np.arange(n_epochs) * 100,
+        np.zeros(n_epochs, int),
+        rng.choice(list(EVENT_ID.values()), n_epochs),
+    ]
+    metadata = pd.DataFrame(
+        dict(
+            confidence=rng.randint(0, 101, n_epochs),
+            is_correct=rng.rand(n_epochs) > 0.5,
+        )
+    )
+    return mne.time_frequency.EpochsTFR(
+        info,
+        rng.rand(n_epochs, 30, 12, 50),
+        np.arange(50) / 100.0 - 0.2,
+        np.arange(1.0, 13.0),
+        events=events,
+        event_id=EVENT_ID,
+        metadata=metadata,
+        verbose=False,
+    )
+
+
+@pytest.mark.parametrize("compression", ["blosc", "gzip", None])
+def test_store_roundtrip(tfr, tmp_path, compression):
+    path = tmp_path / "sub-01_tfr.h5"
+    write_tfr_store(
+        path, tfr, chunks=dict(epochs=8), compression=compression
+    )
+    with TFRStore(path) as store:
+        assert store.ch_types == ["mag", "grad"]
+        assert store.info["ch_names"] == tfr.ch_names
+        assert store.event_id == EVENT_ID
+        np.testing.assert_array_equal(store.freqs, tfr.freqs)
+        pd.testing.assert_frame_equal(store.metadata, tfr.metadata)
+        for ch_type in store.ch_types:
+            picks = mne.pick_types(tfr.info, meg=ch_type)
+            np.testing.assert_array_equal(
+                store.select(ch_type).load(), tfr.data[:, picks]
+            )
+
+
+def test_select_excludes_bads(tfr, tmp_path):
+    tfr.info["bads"] = ["MEG001", "MEG005"]
+    path = tmp_path / "sub-01_tfr.h5"
+    write_tfr_store(path, tfr, chunks=dict(epochs=8))
+    with TFRStore(path) as store:
+        sel = store.select("grad", exclude="bads")
+        everything = store.select("grad")
+        data = sel.load(average_freqs=True)
+
+    picks = mne.pick_types(tfr.info, meg="grad")
+    assert sel.info["ch_names"] == [tfr.ch_names[i] for i in picks]
+    assert "MEG001" not in sel.info["ch_names"]
+    assert sel.shape[1] == len(picks) == len(everything.info["ch_names"]) - 2
+    np.testing.assert_allclose(
+        data[:, :, 0], tfr.data[:, picks].mean(axis=2), rtol=1e-6
+    )
+
+
+def test_select_band_time_and_epochs(tfr, tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg, "target_bands", {"theta": (4.0, 8.0)})
+    path = tmp_path / "sub-01_tfr.h5"
+    write_tfr_store(path, tfr, chunks=dict(epochs=4, channels=5))
+
+    with TFRStore(path) as store:
+        sel = store.select(
+            "grad", band="theta", tmin=0, tmax=0.2,
+            query="confidence > 30", events="high",
+        )
+        data = sel.load()
+        band_average = sel.load(average_freqs=True, batch_size=3)
+
+    epochs = (tfr.metadata.confidence > 30) & (tfr.events[:, 2] == 4)
+    freqs = (tfr.freqs >= 4) & (tfr.freqs <= 8)
+    times = (tfr.times >= 0) & (tfr.times <= 0.2)
+    picks = mne.pick_types(tfr.info, meg="grad")
+    expected = tfr.data[epochs.values][:, picks][:, :, freqs][..., times]
+
+    assert sel.shape == expected.shape
+    np.testing.assert_array_equal(data, expected)
+    np.testing.assert_allclose(
+        band_average, expected.mean(axis=2, keepdims=True)
+    )
+    np.testing.assert_array_equal(sel.freqs, [4, 5, 6, 7, 8])
+    np.testing.assert_array_equal(sel.events, tfr.events[epochs.values])
+    assert list(sel.metadata.index) == list(np.flatnonzero(epochs))
+    assert sel.info["ch_names"] == [tfr.ch_names[i] for i in picks]
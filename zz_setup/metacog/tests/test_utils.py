@@ -1,4 +1,7 @@
-from utils import FrozenBIDSPath, BIDSPathTemplate
+import os
+import time
+
+from metacog.utils import FrozenBIDSPath, BIDSPathTemplate
 import pytest
 
 
@@ -78,3 +81,160 @@ def test_TemplateBIDSPath_update_template_vars_via_normal_vars():
     assert bp.template_vars == set(["task", "run"])
     bp.fpath(run=1, task="test")
     new_bp.fpath(run=1)
+
+
+def slow_fpath(template, **kwargs):
+    """fpath resolved by mne_bids, as before templates were compiled"""
+    template._fpath_sig.bind(**kwargs)
+    return FrozenBIDSPath.update(template, **kwargs)._bp.fpath
+
+
+def bp_templates():
+    from metacog import bp
+
+    return [t for t in vars(bp).values() if isinstance(t, BIDSPathTemplate)]
+
+
+@pytest.mark.parametrize(
+    "template",
+    [
+        BIDSPathTemplate(subject="foo", template_vars=["task", "run"]),
+        BIDSPathTemplate(
+            root="/data", subject="foo", datatype="meg", suffix="meg",
+            template_vars=["task", "run", "session"],
+        ),
+    ]
+    + bp_templates(),
+)
+def test_TemplateBIDSPath_fpath_matches_mne_bids(template):
+    values = dict(
+        subject=["01", "emptyroom"],
+        session=[None, "20200101"],
+        task=["rest", None],
+        acquisition=["oct6"],
+        run=[1, "2", None],
+    )
+    calls = [{}]
+    for var in sorted(template.template_vars):
+        calls = [dict(c, **{var: v}) for c in calls for v in values[var]]
+    for kwargs in calls:
+        assert template.fpath(**kwargs) == slow_fpath(template, **kwargs)
+
+
+def test_TemplateBIDSPath_fpath_validates_values(template_bp):
+    run_bp = BIDSPathTemplate(subject="foo", template_vars=["run"])
+    with pytest.raises(TypeError):
+        template_bp.fpath(task=1)
+    with pytest.raises(ValueError):
+        run_bp.fpath(run="a")
+
+
+def _pipeline_fpath_calls():
+    """fpath calls of the pipeline's templates for all subjects and runs"""
+    from metacog.config_parser import cfg
+    from metacog.dataset_specific_utils import iter_files
+
+    calls = []
+    for template in bp_templates():
+        for subj, task, run, ses in iter_files(cfg.subjects):
+            kwargs = dict(
+                subject=subj, task=task, run=run, session=ses, acquisition="a"
+            )
+            calls.append(
+                (template, {v: kwargs[v] for v in template.template_vars})
+            )
+        template._fpath_cached.cache_clear()
+    return calls
+
+
+def test_TemplateBIDSPath_fpath_matches_mne_bids_for_pipeline():
+    for template, kwargs in _pipeline_fpath_calls():
+        assert template.fpath(**kwargs) == slow_fpath(template, **kwargs)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("METACOG_BENCHMARK"),
+    reason="timing benchmark; set METACOG_BENCHMARK=1 to run",
+)
+def test_TemplateBIDSPath_fpath_is_faster_than_mne_bids():
+    # dodo.py asks for the same paths from several tasks
+    calls = _pipeline_fpath_calls() * 3
+
+    start = time.perf_counter()
+    for template, kwargs in calls:
+        template.fpath(**kwargs)
+    fast = time.perf_counter() - start
+    start = time.perf_counter()
+    for template, kwargs in calls:
+        slow_fpath(template, **kwargs)
+    slow = time.perf_counter() - start
+    print(f"{len(calls)} calls: {fast:.3f} s compiled, {slow:.3f} s mne_bids")
+    assert fast * 5 < slow
+
+
+@pytest.fixture
+def epochs_path(tmp_path, make_meg_raw):
+    import mne
+    import numpy as np
+    import pandas as pd
+
+    raw = make_meg_raw(duration=20.0)
+    # head shape for interpolation of bad channels
+    rng = np.random.RandomState(0)
+    hsp = rng.randn(50, 3)
+    hsp[:, 2] = np.abs(hsp[:, 2])
+    hsp = 0.09 * hsp / np.linalg.norm(hsp, axis=1, keepdims=True)
+    montage = mne.channels.make_dig_montage(
+        nasion=[0, 0.1, 0.04], lpa=[-0.08, 0, 0.04], rpa=[0.08, 0, 0.04],
+        hsp=hsp + [0, 0, 0.04], coord_frame="head",
+    )
+    raw.set_montage(montage)
+    raw.info["bads"] = ["MEG0102", "MEG0501"]
+    events = np.c_[np.arange(1, 19) * 500, np.zeros(18, int), [4, 5] * 9]
+    metadata = pd.DataFrame(dict(confidence=np.arange(18) * 10 % 101))
+    ep = mne.Epochs(
+        raw, events, dict(answer=4, confidence=5), tmin=-0.2, tmax=0.5,
+        baseline=None, metadata=metadata, preload=True, verbose=False,
+    )
+    path = tmp_path / "sub-01_epo.fif"
+    ep.save(path, verbose=False)
+    return path
+
+
+@pytest.mark.parametrize("meg", ["grad", "mag"])
+def test_read_epochs_selection_matches_full_read(epochs_path, meg):
+    import mne
+    import numpy as np
+    from metacog.utils import read_epochs_selection
+
+    query = "confidence > 30"
+    ref = mne.read_epochs(epochs_path, verbose=False)
+    ref = ref.interpolate_bads(verbose=False).pick_types(meg=meg)["answer"]
+    ref = ref[query]
+    ep = read_epochs_selection(epochs_path, "answer", query, meg=meg)
+
+    assert ep.ch_names == ref.ch_names
+    np.testing.assert_array_equal(ep.events, ref.events)
+    np.testing.assert_allclose(ep.get_data(), ref.get_data())
+    assert list(ep.metadata.confidence) == list(ref.metadata.confidence)
+
+
+def test_read_epochs_selection_falls_back_to_mne(epochs_path, monkeypatch):
+    import mne
+    import numpy as np
+    from mne.io.constants import FIFF
+    from metacog import utils
+
+    ep = mne.read_epochs(epochs_path, preload=False, verbose=False)
+    picks = mne.pick_types(ep.info, meg="grad")
+    assert utils._read_epochs_data(ep, picks) is not None
+    ep._raw[0].data_tag.type = FIFF.FIFFT_COMPLEX_FLOAT
+    assert utils._read_epochs_data(ep, picks) is None
+
+    monkeypatch.setattr(mne, "__version__", "9.0.0")
+    ep = mne.read_epochs(epochs_path, preload=False, verbose=False)
+    assert utils._read_epochs_data(ep, picks) is None
+    res = utils.read_epochs_selection(epochs_path, "answer", meg="grad")
+    ref = mne.read_epochs(epochs_path, verbose=False)
+    ref = ref.interpolate_bads(verbose=False).pick_types(meg="grad")["answer"]
+    np.testing.assert_allclose(res.get_data(), ref.get_data())
@@ -0,0 +1,463 @@
+"""
+Chunked, compressed storage of single-trial time-frequency data
+
+`EpochsTFR.save` writes the epochs x channels x freqs x times array as one
+HDF5 dataset, so reading one band or only gradiometers means reading all of
+it. `write_tfr_store` splits the data by channel type and stores it in
+chunks along epochs, channels and freqs, compressed with Blosc:
+
+    /data/<ch_type>    power, shape (n_epochs, n_channels, n_freqs, n_times)
+    /info              measurement info, FIF bytes
+    /header            times, freqs, events, event_id and metadata
+
+`TFRStore.select` returns a lazy slice by channel type, band, time window
+and metadata query; reading it decompresses only the chunks it touches::
+
+    with TFRStore(bp.tfr.fpath(subject="01")) as store:
+        theta = store.select("grad", band="theta", tmin=0, tmax=1).load()
+
+Chunk shape and compression are set in ``cfg.tfr_store_config``.
+
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+HEADER_TITLE = "metacog_tfr_header"
+# chunk cache of an open file; must hold at least one chunk, otherwise
+# chunks partially covered by a selection are decompressed over and over
+CHUNK_CACHE_BYTES = 64 * 1024 ** 2
+
+
+def _compression_kwargs(compression, clevel):
+    if compression == "blosc":
+        import hdf5plugin
+
+        return dict(
+            hdf5plugin.Blosc(
+                cname="lz4", clevel=clevel, shuffle=hdf5plugin.Blosc.SHUFFLE
+            )
+        )
+    if compression == "gzip":
+        return dict(compression="gzip", compression_opts=clevel, shuffle=True)
+    if compression in ("lzf", None):
+        return dict(compression=compression)
+    raise ValueError(f"Unknown compression {compression!r}")
+
+
+def _tfr_ch_types(info):
+    """Channel types of info, in order of first appearance"""
+    return list(dict.fromkeys(info.get_channel_types()))
+
+
+def _band_limits(band):
+    from metacog.config_parser import cfg
+
+    return cfg.target_bands[band] if isinstance(band, str) else band
+
+
+def write_tfr_store(
+    path,
+    tfr,
+    chunks=None,
+    compression="blosc",
+    clevel=5,
+    dtype=None,
+    batch_size=None,
+):
+    """
+    Write single-trial TFR to a chunked, compressed HDF5 file
+
+    Parameters
+    ----------
+    path : str | Path
+        output file
+    tfr : mne.time_frequency.EpochsTFR
+        single-trial power
+    chunks : dict | None
+        chunk size along "epochs", "channels" and "freqs"; times are never
+        split. Defaults to dict(epochs=16, channels=34, freqs=1)
+    compression : "blosc" | "gzip" | "lzf" | None
+        "blosc" (lz4 with byte shuffle) needs the hdf5plugin package
+    clevel : int
+        compression level
+    dtype : str | None
+        dtype of the stored data; defaults to the dtype of tfr.data
+    batch_size : int | None
+        number of epochs written at once; defaults to the epochs chunk size
+
+    """
+    write_tfr_header(
+        path, tfr.info, tfr.times, tfr.freqs, tfr.events, tfr.event_id,
+        tfr.metadata, tfr.method, tfr.comment,
+    )
+    with TFRWriter(
+        path, tfr.info, len(tfr), len(tfr.freqs), len(tfr.times), chunks,
+        compression, clevel, dtype or tfr.data.dtype,
+    ) as writer:
+        batch_size = batch_size or writer.chunks["epochs"]
+        for start in range(0, len(tfr), batch_size):
+            writer.write(start, tfr.data[start:start + batch_size])
+
+
+def write_tfr_header(
+    path, info, times, freqs, events, event_id, metadata=None, method=None,
+    comment=None,
+):
+    """Create TFR store file with the header; data are added by TFRWriter"""
+    import h5py
+
+    _, write_hdf5 = _import_h5io_funcs()
+    header = dict(
+        times=np.asarray(times),
+        freqs=np.asarray(freqs, dtype=float),
+        events=np.asarray(events),
+        event_id=event_id,
+        metadata=_prepare_write_metadata(metadata),
+        method=method,
+        comment=comment,
+    )
+    write_hdf5(
+        str(path), header, overwrite=True, title=HEADER_TITLE, slash="replace"
+    )
+    # info as FIF bytes: reading it from h5io groups takes over a second
+    with h5py.File(path, "a") as f:
+        info_bytes = np.frombuffer(_info_to_bytes(info), dtype="u1")
+        f.create_dataset("info", data=info_bytes)
+
+
+class TFRWriter:
+    """
+    Create the data datasets of a TFR store and fill them in epoch batches
+
+    The header must already be written to path with `write_tfr_header`.
+
+    """
+
+    def __init__(
+        self, path, info, n_epochs, n_freqs, n_times, chunks=None,
+        compression="blosc", clevel=5, dtype="float64",
+    ):
+        import h5py
+
+        chunks = {**dict(epochs=16, channels=34, freqs=1), **(chunks or {})}
+        self.chunks = chunks
+        self.picks = {
+            ch_type: np.flatnonzero(
+                np.array(info.get_channel_types()) == ch_type
+            )
+            for ch_type in _tfr_ch_types(info)
+        }
+        self._file = h5py.File(path, "a", rdcc_nbytes=CHUNK_CACHE_BYTES)
+        self._datasets = {}
+        for ch_type, picks in self.picks.items():
+            shape = (n_epochs, len(picks), n_freqs, n_times)
+            chunk_shape = (
+                min(chunks["epochs"], n_epochs) or 1,
+                min(chunks["channels"], len(picks)),
+                min(chunks["freqs"], n_freqs),
+                n_times,
+            )
+            self._datasets[ch_type] = self._file.create_dataset(
+                f"data/{ch_type}",
+                shape=shape,
+                dtype=dtype,
+                chunks=chunk_shape,
+                **_compression_kwargs(compression, clevel),
+            )
+
+    def write(self, start, data, ch_type=None):
+        """
+        Write power of epochs start:start + len(data)
+
+        data holds all channels of info, or only channels of ch_type
+
+        """
+        if ch_type is not None:
+            self._datasets[ch_type][start:start + len(data)] = data
+            return
+        for ch_type, picks in self.picks.items():
+            self._datasets[ch_type][start:start + len(data)] = data[:, picks]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TFRStore:
+    """
+    Read access to a TFR store written by `write_tfr_store`
+
+    Parameters
+    ----------
+    path : str | Path
+        TFR store file
+
+    Attributes
+    ----------
+    info : mne.Info
+        info of all stored channels
+    times, freqs : array
+    events : array, shape (n_epochs, 3)
+    event_id : dict
+    metadata : pandas.DataFrame | None
+    ch_types : list of str
+        stored channel types
+
+    """
+
+    def __init__(self, path):
+        import h5py
+        import hdf5plugin  # noqa: F401, registers the Blosc filter
+
+        self.path = Path(path)
+        read_hdf5, _ = _import_h5io_funcs()
+        header = read_hdf5(str(path), title=HEADER_TITLE, slash="replace")
+        self.times = header["times"]
+        self.freqs = header["freqs"]
+        self.events = header["events"]
+        self.event_id = header["event_id"]
+        self.metadata = _prepare_read_metadata(header["metadata"])
+        self.method = header["method"]
+        self._file = h5py.File(path, "r", rdcc_nbytes=CHUNK_CACHE_BYTES)
+        self.info = _info_from_bytes(self._file["info"][()].tobytes())
+        self.ch_types = _tfr_ch_types(self.info)
+
+    def __len__(self):
+        return len(self.events)
+
+    def select(
+        self, ch_type="grad", band=None, tmin=None, tmax=None, query=None,
+        events=None, exclude=(),
+    ):
+        """
+        Lazy slice of the stored power
+
+        Parameters
+        ----------
+        ch_type : str
+            channel type
+        band : str | tuple of float | None
+            name of a band in cfg.target_bands or (fmin, fmax); limits are
+            included. None for all freqs
+        tmin, tmax : float | None
+            time window, limits included
+        query : str | None
+            metadata query selecting epochs, e.g. "confidence > 0"
+        events : str | list of str | None
+            event names or tags selecting epochs, e.g. "answer/high"
+        exclude : "bads" | list of str
+            channels left out, as in `mne.pick_types`. By default all stored
+            channels are kept: tfr_morlet drops bads, and TFRWriter datasets
+            are sized for every channel of the type
+
+        Returns
+        -------
+        TFRSlice
+
+        """
+        from mne import pick_info
+
+        freq_mask = np.ones(len(self.freqs), dtype=bool)
+        if band is not None:
+            fmin, fmax = _band_limits(band)
+            freq_mask = (self.freqs >= fmin) & (self.freqs <= fmax)
+        time_mask = np.ones(len(self.times), dtype=bool)
+        if tmin is not None:
+            time_mask &= self.times >= tmin
+        if tmax is not None:
+            time_mask &= self.times <= tmax
+
+        epoch_mask = np.ones(len(self), dtype=bool)
+        if events is not None:
+            epoch_mask &= self._event_mask(events)
+        if query is not None:
+            selected = self.metadata.reset_index(drop=True).query(query)
+            epoch_mask &= np.isin(np.arange(len(self)), selected.index)
+
+        ch_picks = np.flatnonzero(
+            np.array(self.info.get_channel_types()) == ch_type
+        )
+        if exclude == "bads":
+            exclude = self.info["bads"]
+        # positions of the kept channels in the dataset of ch_type
+        channels = np.flatnonzero(
+            [self.info["ch_names"][i] not in exclude for i in ch_picks]
+        )
+        metadata = self.metadata
+        if metadata is not None:
+            metadata = metadata[epoch_mask]
+        return TFRSlice(
+            self._file[f"data/{ch_type}"],
+            np.flatnonzero(epoch_mask),
+            channels,
+            _to_slice(freq_mask),
+            _to_slice(time_mask),
+            info=pick_info(self.info, ch_picks[channels]),
+            times=self.times[time_mask],
+            freqs=self.freqs[freq_mask],
+            events=self.events[epoch_mask],
+            metadata=metadata,
+        )
+
+    def _event_mask(self, events):
+        if isinstance(events, str):
+            events = [events]
+        codes = set()
+        for event in events:
+            tags = set(event.split("/"))
+            codes |= {
+                code
+                for name, code in self.event_id.items()
+                if tags <= set(name.split("/"))
+            }
+        return np.isin(self.events[:, 2], list(codes))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _to_slice(mask):
+    """Contiguous boolean mask as a slice"""
+    idx = np.flatnonzero(mask)
+    if len(idx) == 0:
+        return slice(0, 0)
+    if not np.all(np.diff(idx) == 1):
+        raise ValueError("Selection of freqs or times must be contiguous")
+    return slice(idx[0], idx[-1] + 1)
+
+
+class TFRSlice:
+    """
+    Selection of stored power; nothing is read until `load`
+
+    Attributes
+    ----------
+    shape : tuple
+        (n_epochs, n_channels, n_freqs, n_times) of the selection
+    info : mne.Info
+        info of the selected channels
+    times, freqs, events, metadata
+        of the selected epochs, freqs and times
+
+    """
+
+    def __init__(
+        self, dataset, epochs, channels, freqs_slice, times_slice, info, times,
+        freqs, events, metadata,
+    ):
+        self._dataset = dataset
+        self._epochs = epochs
+        self._channels = channels
+        self._freqs_slice = freqs_slice
+        self._times_slice = times_slice
+        self.info = info
+        self.times = times
+        self.freqs = freqs
+        self.events = events
+        self.metadata = metadata
+        self.shape = (len(epochs), len(channels), len(freqs), len(times))
+
+    def _read(self, epochs):
+        if len(epochs) == 0:
+            return np.empty((0, *self.shape[1:]), self._dataset.dtype)
+        # contiguous runs of epochs are read as slices, which is much faster
+        # than point selection in h5py
+        runs = np.split(epochs, np.flatnonzero(np.diff(epochs) != 1) + 1)
+        data = np.concatenate(
+            [
+                self._dataset[
+                    run[0]:run[-1] + 1,
+                    :,
+                    self._freqs_slice,
+                    self._times_slice,
+                ]
+                for run in runs
+            ]
+        )
+        if len(self._channels) == self._dataset.shape[1]:
+            return data
+        return data[:, self._channels]
+
+    def load(self, average_freqs=False, batch_size=None):
+        """
+        Read the selection
+
+        Parameters
+        ----------
+        average_freqs : bool
+            average over the selected freqs; the result has one freq.
+            Epochs are then read in batches, so that peak memory stays at one
+            batch of all selected freqs
+        batch_size : int | None
+            number of epochs read at once; defaults to the epochs chunk size
+
+        Returns
+        -------
+        array, shape (n_epochs, n_channels, n_freqs, n_times)
+
+        """
+        if not average_freqs:
+            return self._read(self._epochs)
+        batch_size = batch_size or self._dataset.chunks[0]
+        out = np.empty(
+            (self.shape[0], self.shape[1], 1, self.shape[3]),
+            self._dataset.dtype,
+        )
+        for start in range(0, len(self._epochs), batch_size):
+            batch = self._epochs[start:start + batch_size]
+            data = self._read(batch)
+            out[start:start + len(batch)] = data.mean(axis=2, keepdims=True)
+        return out
+
+    def __array__(self, dtype=None):
+        data = self.load()
+        return data if dtype is None else data.astype(dtype)
+
+
+def _info_to_bytes(info):
+    from mne.io import write_info
+
+    with TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "tfr-info.fif"
+        write_info(path, info)
+        return path.read_bytes()
+
+
+def _info_from_bytes(data):
+    from mne.io import read_info
+
+    with TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "tfr-info.fif"
+        path.write_bytes(data)
+        return read_info(path, verbose=False)
+
+
+def _import_h5io_funcs():
+    from mne.utils import _import_h5io_funcs
+
+    return _import_h5io_funcs()
+
+
+def _prepare_write_metadata(metadata):
+    from mne.utils import _prepare_write_metadata
+
+    return _prepare_write_metadata(metadata)
+
+
+def _prepare_read_metadata(metadata):
+    from mne.utils import _prepare_read_metadata
+
+    return _prepare_read_metadata(metadata)
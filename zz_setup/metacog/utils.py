@@ -1,7 +1,9 @@
 """Tools for dataset manipulation"""
 from pathlib import Path
+import sys
 from collections import OrderedDict
-from functools import wraps
+from functools import lru_cache, wraps
+from os import path as op
 import re
 from datetime import datetime
 from types import GeneratorType
@@ -10,14 +12,15 @@ from inspect import Parameter, Signature
 import logging
 from logging import getLogger, FileHandler, StreamHandler, Formatter
 
-from mne.viz import plot_topomap, plot_compare_evokeds, tight_layout
-from mne import find_layout, set_log_file, sys_info, EvokedArray
+from mne import (
+    EpochsArray, pick_info, pick_types, read_epochs, set_log_file, sys_info,
+)
+from mne.utils import _validate_type
 from mne_bids import __version__ as mne_bids_version, BIDSPath
+from mne_bids.config import ALLOWED_PATH_ENTITIES_SHORT, ENTITY_VALUE_TYPE
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 
-from metacog import paths
+from metacog import ledger, paths
 
 
 def bids_from_path(path: Path):
@@ -98,6 +101,9 @@ def bids_from_path(path: Path):
 
 
 def plot_grads(data, info):
+    from mne import find_layout
+    from mne.viz import plot_topomap
+
     names = [info["chs"][i]["ch_name"] for i in range(len(info["chs"]))]
     av_data = data.reshape(-1, 2).mean(axis=1)
     print(av_data.shape)
@@ -108,10 +114,17 @@ def plot_grads(data, info):
 
 
 def setup_logging(script_name):
-    """Save mne-python log to a file in logs folder"""
+    """
+    Save mne-python log to a file in logs folder
+
+    When the script is run from the command line, its run is also recorded
+    in the run ledger (see `metacog.ledger`).
+
+    """
     log_basename = Path(script_name).stem
     log_fname = log_basename + ".log"
     log_savepath = (paths.dirs.logs) / log_fname
+    log_savepath.parent.mkdir(exist_ok=True, parents=True)
 
     logger = getLogger(log_basename)
     logger.setLevel(logging.INFO)
@@ -132,6 +145,8 @@ def setup_logging(script_name):
 
     write_log_header(log_savepath)
     set_log_file(log_savepath, overwrite=False)
+    if Path(sys.argv[0]).resolve() == Path(script_name).resolve():
+        ledger.track_main(script_name)
     return logger
 
 
@@ -174,6 +189,11 @@ def disable(func, *pargs, **kwargs):
     return inner
 
 
+def disable_if(condition):
+    """Decorator for disabling doit tasks when condition is True"""
+    return disable if condition else (lambda func: func)
+
+
 class FrozenBIDSPath:
     def __init__(self, *pargs, check=False, **kwargs):
         self._bp = BIDSPath(*pargs, check=check, **kwargs)
@@ -208,6 +228,10 @@ class FrozenBIDSPath:
         ]
 
 
+# number of distinct fpath calls remembered by each template
+FPATH_CACHE_SIZE = 4096
+
+
 class BIDSPathTemplate(FrozenBIDSPath):
     def __init__(self, *pargs, check=False, template_vars=set(), **kwargs):
         super().__init__(*pargs, check=check, **kwargs)
@@ -215,13 +239,63 @@ class BIDSPathTemplate(FrozenBIDSPath):
         for var in self._template_vars:
             self._check_template_var(var)
         self._make_fpath_signature()
+        self._compile_fpath()
 
     def fpath(self, **kwargs):
+        """
+        Path for template variables set to kwargs
+
+        Same as ``BIDSPath.fpath`` of the template updated with kwargs, but
+        rendered from the precompiled template without creating BIDSPath
+        objects and cached.
+
+        """
+        return self._fpath_cached(**kwargs)
+
+    def _fpath(self, **kwargs):
         # based on recipie 9.16 from the Python Cookbook, 3-d edition
         self._fpath_sig.bind(**kwargs)
 
-        concrete_bp = self.update(**kwargs)
-        return super(self.__class__, concrete_bp).__getattr__("fpath")
+        if self._fpath_entities is None:
+            concrete_bp = self.update(**kwargs)
+            return super(self.__class__, concrete_bp).__getattr__("fpath")
+
+        entities = self._fpath_entities.copy()
+        for key, val in kwargs.items():
+            entities[key] = _entity_value(key, val)
+        data_path = self._fpath_root
+        if entities["subject"] is not None:
+            data_path = op.join(data_path, f"sub-{entities['subject']}")
+        if entities["session"] is not None:
+            data_path = op.join(data_path, f"ses-{entities['session']}")
+        if self._fpath_datatype is not None:
+            data_path = op.join(data_path, self._fpath_datatype)
+        basename = [
+            f"{short}-{entities[key]}"
+            for short, key in ALLOWED_PATH_ENTITIES_SHORT.items()
+            if entities[key] is not None
+        ]
+        if self._fpath_suffix:
+            basename.append(self._fpath_suffix)
+        return Path(op.join(data_path, "_".join(basename)))
+
+    def _compile_fpath(self):
+        """Precompute the parts of fpath which don't depend on template vars"""
+        bp = self._bp
+        # mne_bids looks for matching files when suffix or extension is
+        # missing and handles some MEG formats specially; leave these to it
+        resolved = bp.root is None or None not in (bp.suffix, bp.extension)
+        special = bp.suffix == "meg" and bp.extension in (".ds", ".pdf")
+        if bp.check or not resolved or special:
+            self._fpath_entities = None
+        else:
+            self._fpath_entities = dict(bp.entities)
+            self._fpath_root = "" if bp.root is None else bp.root
+            self._fpath_datatype = bp.datatype
+            self._fpath_suffix = None
+            if bp.suffix is not None:
+                self._fpath_suffix = bp.suffix + (bp.extension or "")
+        self._fpath_cached = lru_cache(maxsize=FPATH_CACHE_SIZE)(self._fpath)
 
     def update(self, *, check=None, **kwargs):
         """
@@ -243,6 +317,7 @@ class BIDSPathTemplate(FrozenBIDSPath):
                 other_template_vars.remove(key)
         other._template_vars = other_template_vars
         other._make_fpath_signature()
+        other._compile_fpath()
         return other
 
     @property
@@ -268,6 +343,19 @@ class BIDSPathTemplate(FrozenBIDSPath):
             )
 
 
+def _entity_value(key, val):
+    """Validate and normalize entity value like ``BIDSPath.update`` does"""
+    if ENTITY_VALUE_TYPE[key] == "label":
+        _validate_type(val, types=(None, str), item_name=key)
+        return val
+    _validate_type(val, types=(int, str, None), item_name=key)
+    if isinstance(val, str) and not val.isdigit():
+        raise ValueError(f"{key} is not an index (Got {val})")
+    elif isinstance(val, int):
+        return "{:02}".format(val)
+    return val
+
+
 def read_ica_bads(ica_bads_path, logger):
     with open(ica_bads_path, "r") as f:
         line = f.readline()
@@ -282,9 +370,159 @@ def write_ica_bads(ica_bads_path, ica, logger):
         logger.info(f"Loading BADS from file: {ica.exclude}")
 
 
+def read_epochs_selection(ep_path, events=None, query=None, meg="grad"):
+    """
+    Read only selected epochs and MEG channels of an epochs file
+
+    Epochs are selected by event and metadata from the file header and only
+    the selected epochs and channels are read from the FIF data block through
+    a memory map. Bad channels are interpolated, so the result is the same as
+    ``read_epochs(ep_path).interpolate_bads().pick_types(meg=meg)[events]``;
+    if some of the picked channels are bad, all MEG channels are read since
+    interpolation uses them.
+
+    Parameters
+    ----------
+    ep_path : str | Path
+        epochs file
+    events : str | list of str | None
+        event names or tags to keep, e.g. "answer"
+    query : str | None
+        metadata query, e.g. "confidence > 0"
+    meg : "grad" | "mag" | True
+        MEG channels to return, as in `mne.pick_types`
+
+    Returns
+    -------
+    mne.Epochs
+        preloaded epochs
+
+    """
+    ep = read_epochs(ep_path, preload=False, verbose=False)
+    if events is not None:
+        ep = ep[events]
+    if query is not None:
+        ep = ep[query]
+    picks = pick_types(ep.info, meg=meg, exclude=[])
+    bads = set(ep.info["bads"]) & {ep.ch_names[i] for i in picks}
+    if bads:
+        picks = pick_types(ep.info, meg=True, exclude=[])
+
+    data = _read_epochs_data(ep, picks)
+    if data is None:
+        # data needs processing on load; let mne read all of it
+        ep.load_data()
+        data = ep.get_data(picks=picks)
+    res = EpochsArray(
+        data,
+        pick_info(ep.info, picks),
+        events=ep.events,
+        tmin=ep.tmin,
+        event_id=ep.event_id,
+        metadata=ep.metadata,
+        verbose=False,
+    )
+    if bads:
+        res.interpolate_bads(verbose=False)
+    return res.pick_types(meg=meg)
+
+
+# mne versions whose EpochsFIF internals (_raw containers with data_tag,
+# event_samps, epoch_shape, cals and fmt) `_read_epochs_data` was checked
+# against; other versions read through mne. Keep in sync with the mne pin in
+# environment.yml
+MMAP_MNE_VERSIONS = ((1, 0), (1, 1))
+
+
+def _mne_version():
+    import mne
+
+    return tuple(int(v) for v in re.findall(r"\d+", mne.__version__)[:2])
+
+
+def _mmap_layout(raw, n_epochs):
+    """dtype of the FIF data block of a raw container, None if unexpected"""
+    from mne.io.constants import FIFF
+
+    formats = {FIFF.FIFFT_FLOAT: ">f4", FIFF.FIFFT_DOUBLE: ">f8"}
+    try:
+        tag, fmt = raw.data_tag, raw.fmt
+        n_values = n_epochs * int(np.prod(raw.epoch_shape))
+        ok = (
+            tag.kind == FIFF.FIFF_EPOCH
+            and formats.get(tag.type) == fmt
+            # 16 bytes of tag header before the values
+            and tag.size == 16 + n_values * np.dtype(fmt).itemsize
+            and raw.cals.shape == (raw.epoch_shape[0], 1)
+            and op.isfile(raw.fid.name)
+        )
+    except (AttributeError, TypeError):
+        return None
+    return fmt if ok else None
+
+
+def _read_epochs_data(ep, picks):
+    """
+    Read picked channels of non-preloaded FIF epochs via memory maps
+
+    This relies on private mne internals, so it returns None, and the data
+    are read by mne, unless the mne version is in MMAP_MNE_VERSIONS, every
+    data block is a float FIF epochs tag of the expected size, and mne would
+    not modify the data when loading it (baseline, detrending, decimation,
+    projections, compensation, rejection).
+
+    """
+    lo, hi = MMAP_MNE_VERSIONS
+    if not lo <= _mne_version() < hi:
+        return None
+    try:
+        needs_processing = (
+            ep.detrend is not None
+            or ep._do_baseline
+            or ep._decim != 1
+            or ep._offset is not None
+            or ep._do_delayed_proj
+            or ep._projector is not None
+            or ep.reject is not None
+            or ep.flat is not None
+            or bool(ep.info["comps"])
+            or ep.compensation_grade not in (None, 0)
+        )
+        containers = list(ep._raw)
+        layouts = [_mmap_layout(r, len(r.event_samps)) for r in containers]
+    except (AttributeError, TypeError):
+        return None
+    if needs_processing or None in layouts:
+        return None
+
+    data = np.empty((len(ep), len(picks), len(ep.times)))
+    event_samps = ep.events[:, 0]
+    for raw, fmt in zip(containers, layouts):
+        file_data = np.memmap(
+            raw.fid.name,
+            dtype=fmt,
+            mode="r",
+            offset=raw.data_tag.pos + 16,  # 16 bytes of tag header
+            shape=(len(raw.event_samps), *raw.epoch_shape),
+        )
+        file_idx = {samp: i for i, samp in enumerate(raw.event_samps)}
+        out_idx = [i for i, s in enumerate(event_samps) if s in file_idx]
+        in_idx = [file_idx[event_samps[i]] for i in out_idx]
+        data[out_idx] = file_data[np.ix_(in_idx, picks)]
+        data[out_idx] *= raw.cals[picks]
+        del file_data
+    return data
+
+
 def plot_temporal_clusters(
     good_cluster_inds, evokeds, T_obs, clusters, times, info
 ):
+    # plotting imports are slow; keep them out of module import
+    import matplotlib.pyplot as plt
+    from mne import EvokedArray
+    from mne.viz import plot_compare_evokeds, tight_layout
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
     colors = {"low": "crimson", "high": "steelblue"}
     # linestyles = {"low": "-", "high": "--"}
     #
@@ -368,6 +606,33 @@ def plot_temporal_clusters(
         plt.show()
 
 
+def plot_stored_clusters(store, evokeds, times, info, p_accept=0.05):
+    """
+    Plot clusters of a results store with `plot_temporal_clusters`
+
+    Parameters
+    ----------
+    store : str | Path | ClusterResults
+        path prefix passed as save_path to a cluster test, or its results
+        loaded with `metacog.cluster_store.load_cluster_results`
+    evokeds : dict
+        low and high confidence evoked responses
+    times : array
+    info : mne.Info
+    p_accept : float
+        clusters with lower p-values are plotted
+
+    """
+    from metacog.cluster_store import ClusterResults, load_cluster_results
+
+    if not isinstance(store, ClusterResults):
+        store = load_cluster_results(store)
+    plot_temporal_clusters(
+        store.good_cluster_inds(p_accept), evokeds, *store.plot_args(),
+        times, info,
+    )
+
+
 if __name__ == "__main__":
     path = Path("sub-test_task-test_meg.fif")
     # p = bids_from_path(path)